@@ -0,0 +1,154 @@
+"""Per-room actors: one mailbox and one consumer task per busy room.
+
+Socket handlers and timer expirations for a room are queued as messages and run one at a time
+by that room's consumer, so a handler that awaits an emit can no longer interleave with a timer
+resolving the same phase. Messages that pile up while the consumer is busy are drained as one
+batch, after which a flush hook publishes work the handlers deferred (e.g. a single coalesced
+room update for a burst of joins). A room with nothing queued has no task at all.
+"""
+
+import asyncio
+import os
+from collections import deque
+
+from . import logs
+
+# most messages handled before a room's deferred work is flushed
+ROOM_BATCH_MAX = int(os.environ.get('ROOM_BATCH_MAX', 64))
+
+_log = logs.get('room_actor')
+
+
+class RoomActor:
+    """Mailbox of one room. `deferred` collects work to publish once the current batch is done."""
+
+    __slots__ = ('room', 'queue', 'task', 'deferred')
+
+    def __init__(self, room):
+        self.room = room
+        # (callable, args, future or None)
+        self.queue = deque()
+        self.task = None
+        self.deferred = {}
+
+
+class RoomActors:
+    """Registry of room actors.
+
+    `post(room, fn, *args)` queues `fn(*args)` without waiting; `call(room, fn, *args)` queues it
+    and waits for its result (after the batch's flush). Calls made from inside the room's own
+    consumer run inline, so handlers can use one another without deadlocking. `flush(room,
+    deferred)` is awaited after every batch that deferred something.
+    """
+
+    def __init__(self, flush=None, batch_max=ROOM_BATCH_MAX):
+        self.flush = flush
+        self.batch_max = max(1, batch_max)
+        self._actors = {}
+        # statistics
+        self.messages = 0
+        self.batches = 0
+        self.max_batch = 0
+        self.max_queue = 0
+        self.errors = 0
+
+    def get(self, room):
+        return self._actors.get(room)
+
+    def idle(self):
+        """True when no room has queued or running work."""
+        return not self._actors
+
+    def current(self, room):
+        """The room's actor if the running task is its consumer (i.e. we are inside a batch)."""
+        actor = self._actors.get(room)
+        if actor is not None and actor.task is not None and actor.task is asyncio.current_task():
+            return actor
+        return None
+
+    def post(self, room, fn, *args):
+        self._enqueue(room, fn, args, None)
+
+    async def call(self, room, fn, *args):
+        if self.current(room) is not None:
+            return await _invoke(fn, args)
+        future = asyncio.get_running_loop().create_future()
+        self._enqueue(room, fn, args, future)
+        return await future
+
+    def _enqueue(self, room, fn, args, future):
+        actor = self._actors.get(room)
+        if actor is None:
+            actor = self._actors[room] = RoomActor(room)
+        actor.queue.append((fn, args, future))
+        if len(actor.queue) > self.max_queue:
+            self.max_queue = len(actor.queue)
+        if actor.task is None:
+            # named after the room so a stall the loop watchdog catches can say whose work it was
+            actor.task = asyncio.create_task(self._consume(actor), name=f'room:{room}')
+
+    async def _consume(self, actor):
+        batch = []
+        try:
+            while actor.queue:
+                batch = [actor.queue.popleft() for _ in range(min(len(actor.queue), self.batch_max))]
+                self.batches += 1
+                self.messages += len(batch)
+                if len(batch) > self.max_batch:
+                    self.max_batch = len(batch)
+                outcomes = []
+                for fn, args, future in batch:
+                    try:
+                        outcomes.append((future, await _invoke(fn, args), None))
+                    except Exception as e:
+                        self.errors += 1
+                        if future is None:
+                            _log.error('handler failed', room=actor.room, handler=getattr(fn, '__name__', fn), error=e)
+                        outcomes.append((future, None, e))
+                if actor.deferred and self.flush is not None:
+                    deferred, actor.deferred = actor.deferred, {}
+                    try:
+                        await self.flush(actor.room, deferred)
+                    except Exception as e:
+                        self.errors += 1
+                        _log.error('flush failed', room=actor.room, error=e)
+                for future, result, error in outcomes:
+                    if future is None or future.done():
+                        continue
+                    if error is not None:
+                        future.set_exception(error)
+                    else:
+                        future.set_result(result)
+        finally:
+            actor.task = None
+            # only unresolved if the consumer was cancelled (shutdown): nobody will run these
+            batch.extend(actor.queue)
+            actor.queue.clear()
+            for _, _, future in batch:
+                if future is not None and not future.done():
+                    future.cancel()
+            if self._actors.get(actor.room) is actor:
+                del self._actors[actor.room]
+
+    def queued(self, room):
+        """Messages waiting in a room's mailbox."""
+        actor = self._actors.get(room)
+        return len(actor.queue) if actor is not None else 0
+
+    def stats(self):
+        return {
+            'active_rooms': len(self._actors),
+            'queued': sum(len(a.queue) for a in self._actors.values()),
+            'messages': self.messages,
+            'batches': self.batches,
+            'max_batch': self.max_batch,
+            'max_queue': self.max_queue,
+            'errors': self.errors,
+        }
+
+
+async def _invoke(fn, args):
+    result = fn(*args)
+    if asyncio.iscoroutine(result):
+        result = await result
+    return result
@@ -0,0 +1,392 @@
+"""Monte Carlo balance simulator: how often killers win for given role counts and room size.
+
+Plays many randomized games at once with NumPy: every array has one row per game and one
+column per player, and each night and vote is resolved for all games in a few array operations
+using the same rules as `engine` (killers cannot target killers, a live doctor's save cancels the
+kill, plurality vote with ties and skips blocking the elimination, the win check after the night
+and after the vote). How players choose is up to a policy:
+
+- RandomPolicy:   everyone picks uniformly among the targets the rules allow; some voters skip
+- InformedPolicy: killers vote as a bloc, detectives go public when they find a killer, the
+                  town mostly follows them and the doctor guards a public detective
+
+A policy is any object with `kill`, `save`, `check` and `vote` methods that take the `Batch`
+being played and return player columns, -1 for none (see `RandomPolicy`). `play_reference()`
+plays RandomPolicy games one at a time through `engine.HeadlessGame`, so the vectorized rules
+can be checked against the server's (`--check`).
+
+NumPy is optional for the server: without it `available()` is False and `GET /balance` answers 503.
+
+    python -m backend.app.balance --players 8 --games 1000000
+    python -m backend.app.balance --players 10 --sweep --policy informed
+"""
+
+import argparse
+import json
+import math
+import random
+import time
+
+from . import engine
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+CIVILIAN, KILLER, DOCTOR, DETECTIVE = 0, 1, 2, 3
+ROLE_CODES = {'Civilian': CIVILIAN, 'Killer': KILLER, 'Doctor': DOCTOR, 'Detective': DETECTIVE}
+# winner codes
+NOBODY, CIVILIANS, KILLERS = 0, 1, 2
+
+# games still undecided after this many rounds per player are reported as unfinished
+MAX_ROUNDS_PER_PLAYER = 3
+# games played per array batch (bounds memory: a few (games x players) arrays per batch)
+BATCH_GAMES = 50_000
+
+
+def available():
+    return np is not None
+
+
+def _require_numpy():
+    if np is None:
+        raise RuntimeError('the balance simulator needs numpy (pip install -r backend/requirements-balance.txt)')
+
+
+class Batch:
+    """The state of `games` games of `players` players, one row per game."""
+
+    def __init__(self, games, players, settings, rng):
+        self.games = games
+        self.players = players
+        self.rng = rng
+        base = np.array([ROLE_CODES[r] for r in engine.role_list(players, settings)], dtype=np.int8)
+        self.roles = rng.permuted(np.tile(base, (games, 1)), axis=1)
+        self.alive = np.ones((games, players), dtype=bool)
+        self.active = np.ones(games, dtype=bool)
+        self.rounds = np.zeros(games, dtype=np.int32)
+        self.winner = np.zeros(games, dtype=np.int8)
+        # detectives that used their one check, and what the town has learned from them
+        self.checked = np.zeros((games, players), dtype=bool)
+        self.exposed = np.zeros((games, players), dtype=bool)
+        self.cleared = np.zeros((games, players), dtype=bool)
+        self.revealed = np.zeros((games, players), dtype=bool)
+        self.rows = np.arange(games)
+
+    def keep(self, rows):
+        """Drop the games not selected by the boolean `rows`."""
+        for name in ('roles', 'alive', 'active', 'rounds', 'winner', 'checked', 'exposed', 'cleared', 'revealed'):
+            setattr(self, name, getattr(self, name)[rows])
+        self.games = len(self.active)
+        self.rows = np.arange(self.games)
+
+    def alive_role(self, role):
+        return self.alive & (self.roles == role)
+
+    def pick(self, mask):
+        """One uniformly random column per game among `mask`; -1 where the row has none."""
+        keys = self.rng.random(mask.shape)
+        keys[~mask] = -1.0
+        choice = keys.argmax(axis=1)
+        return np.where(mask.any(axis=1), choice, -1)
+
+    def pick_each(self, candidates, voters):
+        """For every voter, a random candidate of their game other than themselves (-1 if none).
+
+        Rejection sampling: every voter draws a column and keeps it if it is a candidate; only the
+        misses draw again, so a pass costs O(games x players) and few passes are needed.
+        """
+        n = self.players
+        others = candidates.sum(axis=1, keepdims=True) - candidates
+        todo = voters & (others > 0)
+        target = self.rng.integers(0, n, size=voters.shape, dtype=np.int16)
+        hit = np.take_along_axis(candidates, target, axis=1) & (target != np.arange(n, dtype=np.int16))
+        target[~(todo & hit)] = -1
+        gi, vi = np.nonzero(todo & ~hit)
+        while gi.size:
+            j = self.rng.integers(0, n, size=gi.size, dtype=np.int16)
+            hit = candidates[gi, j] & (j != vi)
+            target[gi[hit], vi[hit]] = j[hit]
+            gi, vi = gi[~hit], vi[~hit]
+        return target
+
+
+class RandomPolicy:
+    """Uniformly random choices among what the rules allow; each voter skips with `skip`."""
+
+    name = 'random'
+
+    def __init__(self, skip=0.1):
+        self.skip = skip
+
+    def kill(self, b):
+        return b.pick(b.alive & (b.roles != KILLER))
+
+    def save(self, b):
+        return b.pick(b.alive)
+
+    def check(self, b, detective):
+        mask = b.alive & ~b.cleared & ~b.exposed
+        # a detective does not check themselves
+        mask[b.rows[detective >= 0], detective[detective >= 0]] = False
+        return b.pick(mask)
+
+    def vote(self, b):
+        killers = b.roles == KILLER
+        town = b.pick_each(b.alive, b.alive & ~killers)
+        bloc = b.pick_each(b.alive & ~killers, b.alive & killers)
+        target = np.where(killers, bloc, town)
+        return self._skips(b, target)
+
+    def _skips(self, b, target):
+        if self.skip > 0:
+            target[b.rng.random(target.shape) < self.skip] = -1
+        return target
+
+
+class InformedPolicy(RandomPolicy):
+    """Players use what detectives make public.
+
+    Killers kill a public detective first and vote together for one civilian; the doctor guards a
+    public detective; the town votes for an exposed killer with probability `trust` and otherwise
+    picks randomly among players nobody has cleared.
+    """
+
+    name = 'informed'
+
+    def __init__(self, skip=0.1, trust=0.8):
+        super().__init__(skip)
+        self.trust = trust
+
+    def kill(self, b):
+        public = b.pick(b.alive & b.revealed)
+        return np.where(public >= 0, public, super().kill(b))
+
+    def save(self, b):
+        public = b.pick(b.alive & b.revealed)
+        return np.where(public >= 0, public, super().save(b))
+
+    def vote(self, b):
+        killers = b.roles == KILLER
+        suspects = b.alive & ~b.cleared
+        town = b.pick_each(suspects, b.alive & ~killers)
+        # fall back to any alive player when everyone else has been cleared
+        town = np.where(town >= 0, town, b.pick_each(b.alive, b.alive & ~killers))
+        exposed = b.pick(b.alive & b.exposed)
+        follow = (exposed[:, None] >= 0) & (b.rng.random(town.shape) < self.trust)
+        town = np.where(follow, exposed[:, None], town)
+        bloc = b.pick(b.alive & ~killers)
+        target = np.where(killers, bloc[:, None], town)
+        return self._skips(b, target)
+
+
+POLICIES = {policy.name: policy for policy in (RandomPolicy, InformedPolicy)}
+
+
+def _night(b, policy):
+    n = b.players
+    b.rounds[b.active] += 1
+    # one check per night by the first alive detective that has not used theirs
+    ready = b.alive_role(DETECTIVE) & ~b.checked & b.active[:, None]
+    detective = np.where(ready.any(axis=1), ready.argmax(axis=1), -1)
+    checks = policy.check(b, detective)
+    g = b.rows[(detective >= 0) & (checks >= 0)]
+    if g.size:
+        b.checked[g, detective[g]] = True
+        found = b.roles[g, checks[g]] == KILLER
+        b.exposed[g[found], checks[g][found]] = True
+        b.revealed[g[found], detective[g][found]] = True
+        b.cleared[g[~found], checks[g][~found]] = True
+    kill = policy.kill(b)
+    has_kill = b.active & (kill >= 0)
+    target = np.clip(kill, 0, n - 1)
+    has_kill &= b.alive[b.rows, target] & (b.roles[b.rows, target] != KILLER)
+    doctor = b.alive_role(DOCTOR).any(axis=1)
+    save = policy.save(b)
+    killed = has_kill & ~(doctor & (save == kill))
+    b.alive[b.rows[killed], kill[killed]] = False
+
+
+def _vote(b, policy):
+    n = b.players
+    target = policy.vote(b)
+    voters = b.alive & b.active[:, None]
+    bucket = np.where(target >= 0, target, n)
+    # killers may not vote for killers: such a vote is refused, not counted as a skip
+    voters &= ~((b.roles == KILLER) & (target >= 0) & (np.take_along_axis(b.roles, np.clip(target, 0, n - 1), axis=1) == KILLER))
+    index = (b.rows[:, None] * (n + 1) + bucket)[voters]
+    counts = np.bincount(index, minlength=b.games * (n + 1)).reshape(b.games, n + 1)
+    skips, votes = counts[:, n], counts[:, :n]
+    max_votes = votes.max(axis=1)
+    top = (votes == max_votes[:, None]).sum(axis=1)
+    # same outcome as engine.vote_outcome: no votes, a tie, or skips >= the leader all keep everyone
+    out = b.active & (max_votes > 0) & (top == 1) & (skips < max_votes)
+    b.alive[b.rows[out], votes.argmax(axis=1)[out]] = False
+
+
+def _check_wins(b):
+    killers = b.alive_role(KILLER).sum(axis=1)
+    others = b.alive.sum(axis=1) - killers
+    civilians = b.active & (killers == 0)
+    won = b.active & ~civilians & (killers >= others)
+    b.winner[civilians] = CIVILIANS
+    b.winner[won] = KILLERS
+    b.active &= ~(civilians | won)
+
+
+def play_batch(games, players, settings, policy, rng, max_rounds=None):
+    """Play `games` games to the end (or `max_rounds`); returns (winner codes, rounds played)."""
+    b = Batch(games, players, settings, rng)
+    max_rounds = max_rounds or MAX_ROUNDS_PER_PLAYER * players
+    winners = np.zeros(games, dtype=np.int8)
+    rounds = np.zeros(games, dtype=np.int32)
+    # original game number of each row still being played
+    index = np.arange(games)
+    while b.games and b.rounds.max() < max_rounds:
+        _night(b, policy)
+        _check_wins(b)
+        if b.active.any():
+            _vote(b, policy)
+            _check_wins(b)
+        done = ~b.active
+        if done.any():
+            # finished games leave the arrays so later rounds only pay for the games still running
+            winners[index[done]] = b.winner[done]
+            rounds[index[done]] = b.rounds[done]
+            index = index[b.active]
+            b.keep(b.active)
+    rounds[index] = b.rounds
+    return winners, rounds
+
+
+def _report(players, settings, policy, winners, rounds, elapsed):
+    games = len(winners)
+    killer_rate = float((winners == KILLERS).mean())
+    civilian_rate = float((winners == CIVILIANS).mean())
+    return {
+        'players': players,
+        'settings': {key: int(settings.get(key, 0)) for key in ('killCount', 'doctorCount', 'detectiveCount')},
+        'policy': policy.name,
+        'games': games,
+        'killer_win_rate': round(killer_rate, 4),
+        'civilian_win_rate': round(civilian_rate, 4),
+        'unfinished_rate': round(float((winners == NOBODY).mean()), 4),
+        # 95% confidence half-width of the killer win rate
+        'ci95': round(1.96 * math.sqrt(max(killer_rate * (1 - killer_rate), 1e-12) / games), 4),
+        'rounds': {
+            'mean': round(float(rounds.mean()), 2),
+            'p50': int(np.percentile(rounds, 50)),
+            'p90': int(np.percentile(rounds, 90)),
+            'max': int(rounds.max()),
+        },
+        'elapsed_s': round(elapsed, 3),
+    }
+
+
+def simulate(players, settings, games=100_000, policy=None, seed=None, max_rounds=None, batch=BATCH_GAMES):
+    """Win rates and game length over `games` simulated games for one settings combination."""
+    _require_numpy()
+    policy = policy or InformedPolicy()
+    rng = np.random.default_rng(seed)
+    started = time.perf_counter()
+    winners, rounds = [], []
+    left = games
+    while left > 0:
+        size = min(batch, left)
+        batch_winners, batch_rounds = play_batch(size, players, settings, policy, rng, max_rounds)
+        winners.append(batch_winners)
+        rounds.append(batch_rounds)
+        left -= size
+    return _report(players, settings, policy, np.concatenate(winners), np.concatenate(rounds), time.perf_counter() - started)
+
+
+def combinations(players, max_doctors=2, max_detectives=2):
+    """Settings worth simulating: 1 killer up to (but not including) half the room, 0-2 doctors and detectives."""
+    for killers in range(1, max(1, (players - 1) // 2) + 1):
+        for doctors in range(max_doctors + 1):
+            for detectives in range(max_detectives + 1):
+                if killers + doctors + detectives <= players:
+                    yield {'killCount': killers, 'doctorCount': doctors, 'detectiveCount': detectives}
+
+
+def sweep(players, games=20_000, policy=None, seed=None):
+    """`simulate` every combination for a room size, the most balanced first (both sides win about
+    equally often and few games stall)."""
+    rng = random.Random(seed)
+    results = [simulate(players, settings, games, policy, rng.randrange(2 ** 32)) for settings in combinations(players)]
+    results.sort(key=lambda r: abs(r['killer_win_rate'] - r['civilian_win_rate']) + r['unfinished_rate'])
+    return results
+
+
+def play_reference(players, settings, rnd, skip=0.1, max_rounds=None):
+    """One RandomPolicy game through `engine.HeadlessGame`; returns (winner, rounds)."""
+    game = engine.HeadlessGame.new(players, settings, rnd)
+    roles = game.roles
+    max_rounds = max_rounds or MAX_ROUNDS_PER_PLAYER * players
+    while game.winner is None and game.rounds < max_rounds:
+        alive = game.alive_ids()
+        victims = [pid for pid in alive if roles[pid] != 'Killer']
+        doctors = game.alive_ids('Doctor')
+        game.night(kill=rnd.choice(victims) if victims else None,
+                   save=rnd.choice(alive) if doctors else None, saved_by=doctors[0] if doctors else None)
+        if game.winner is not None:
+            break
+        alive = game.alive_ids()
+        votes = {}
+        for voter in alive:
+            choices = [pid for pid in alive if pid != voter and engine.can_target(roles[voter], roles[pid])]
+            target = rnd.choice(choices) if choices else None
+            votes[voter] = None if rnd.random() < skip else target
+        game.vote(votes)
+    return game.winner, game.rounds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--players', type=int, default=8)
+    parser.add_argument('--killers', type=int, default=1)
+    parser.add_argument('--doctors', type=int, default=1)
+    parser.add_argument('--detectives', type=int, default=0)
+    parser.add_argument('--games', type=int, default=100_000)
+    parser.add_argument('--policy', choices=sorted(POLICIES), default='informed')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--sweep', action='store_true', help='simulate every role combination for the room size')
+    parser.add_argument('--check', type=int, default=0, metavar='GAMES',
+                        help='also play this many RandomPolicy games through the engine and compare win rates')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+    _require_numpy()
+
+    policy = POLICIES[args.policy]()
+    settings = {'killCount': args.killers, 'doctorCount': args.doctors, 'detectiveCount': args.detectives}
+    if args.sweep:
+        results = sweep(args.players, args.games, policy, args.seed)
+    else:
+        results = [simulate(args.players, settings, args.games, policy, args.seed)]
+    if args.check:
+        rnd = random.Random(args.seed)
+        outcomes = [play_reference(args.players, settings, rnd) for _ in range(args.check)]
+        vectorized = simulate(args.players, settings, args.games, RandomPolicy(), args.seed)
+        reference = sum(1 for won, _ in outcomes if won == 'Killers') / args.check
+        results.append({'check': {'engine_killer_win_rate': round(reference, 4),
+                                  'engine_rounds_mean': round(sum(r for _, r in outcomes) / args.check, 2),
+                                  'vectorized_killer_win_rate': vectorized['killer_win_rate'],
+                                  'vectorized_rounds_mean': vectorized['rounds']['mean']}})
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for r in results:
+        if 'check' in r:
+            c = r['check']
+            print(f"check: killers win {c['engine_killer_win_rate']:.1%} (engine) vs {c['vectorized_killer_win_rate']:.1%} (vectorized), "
+                  f"rounds {c['engine_rounds_mean']} vs {c['vectorized_rounds_mean']}")
+            continue
+        s = r['settings']
+        print(f"{s['killCount']}K {s['doctorCount']}D {s['detectiveCount']}Det: killers win {r['killer_win_rate']:6.1%} "
+              f"(±{r['ci95']:.1%}), unfinished {r['unfinished_rate']:5.1%}, rounds mean {r['rounds']['mean']:5.2f} "
+              f"p90 {r['rounds']['p90']}  [{r['games']} games, {r['elapsed_s']}s]")
+
+
+if __name__ == '__main__':
+    main()
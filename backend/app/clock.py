@@ -0,0 +1,147 @@
+"""Time source for game flow: timestamps sent to players, phase deadlines and the waits between them.
+
+Everything in a game that depends on time (phase timers, grace periods, countdown timestamps)
+goes through a `Clock`, so a test or simulation can replace the real one with a `VirtualClock`
+and play complete games without waiting: virtual time only moves when the clock is advanced,
+and with `autojump` it skips straight to the next deadline whenever the game has nothing left
+to do at the current instant.
+
+    clock = VirtualClock(autojump=True)
+    main.use_clock(clock)   # before any timer is armed
+    ...                     # a 10-round game now finishes in milliseconds
+"""
+
+import asyncio
+import heapq
+import itertools
+import time
+
+# consecutive idle passes of the event loop before virtual time may move on
+SETTLE_ROUNDS = 3
+
+
+class Clock:
+    """The real clock: wall time for timestamps, monotonic time for deadlines, asyncio sleeps."""
+
+    def time(self):
+        return time.time()
+
+    def monotonic(self):
+        return time.monotonic()
+
+    async def sleep(self, delay):
+        await asyncio.sleep(delay)
+
+
+class VirtualClock(Clock):
+    """A clock whose time only moves when advanced.
+
+    `sleep()` parks the caller until virtual time reaches its deadline. `advance(seconds)` and
+    `run_until(predicate)` move time forward deadline by deadline, letting the event loop settle
+    in between so that work a wakeup triggers (handlers, emits, the next phase's timer) is done
+    before time moves again. `idle()`, if given, tells whether anything is still in flight
+    (e.g. queued room handlers); without it the loop is considered settled after a few empty
+    passes. With `autojump=True` a background task does the advancing by itself whenever the
+    loop has settled and someone is sleeping.
+    """
+
+    def __init__(self, start=None, autojump=False, idle=None, settle_rounds=SETTLE_ROUNDS):
+        # wall-clock time at virtual zero; fixed starts make timestamps reproducible
+        self.epoch = time.time() if start is None else start
+        self.idle = idle
+        self.autojump = autojump
+        self.settle_rounds = max(1, settle_rounds)
+        self._now = 0.0
+        # (deadline, seq, future)
+        self._sleepers = []
+        self._seq = itertools.count()
+        self._jumper = None
+        self._sleeping = None
+        # statistics
+        self.jumps = 0
+
+    def time(self):
+        return self.epoch + self._now
+
+    def monotonic(self):
+        return self._now
+
+    async def sleep(self, delay):
+        if delay <= 0:
+            await asyncio.sleep(0)
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._sleepers, (self._now + delay, next(self._seq), future))
+        if self.autojump:
+            self._start_jumper()
+        await future
+
+    def next_deadline(self):
+        """Virtual time of the earliest pending sleep, or None."""
+        while self._sleepers and self._sleepers[0][2].done():
+            # cancelled sleeps are dropped lazily
+            heapq.heappop(self._sleepers)
+        return self._sleepers[0][0] if self._sleepers else None
+
+    async def settle(self):
+        """Let the event loop run until nothing is left to do at the current virtual time."""
+        quiet = 0
+        while quiet < self.settle_rounds:
+            await asyncio.sleep(0)
+            quiet = quiet + 1 if self.idle is None or self.idle() else 0
+
+    async def advance(self, seconds):
+        """Move virtual time forward by `seconds`, waking every sleep that falls due on the way."""
+        target = self._now + max(0.0, seconds)
+        await self.settle()
+        while True:
+            deadline = self.next_deadline()
+            if deadline is None or deadline > target:
+                break
+            self._jump(deadline)
+            await self.settle()
+        self._now = max(self._now, target)
+
+    async def run_until(self, predicate=None, limit=None):
+        """Jump from deadline to deadline until `predicate()` holds, nobody is sleeping or `limit`
+        virtual seconds have passed. Returns the virtual seconds that elapsed."""
+        started = self._now
+        await self.settle()
+        while predicate is None or not predicate():
+            deadline = self.next_deadline()
+            if deadline is None or (limit is not None and deadline - started > limit):
+                break
+            self._jump(deadline)
+            await self.settle()
+        return self._now - started
+
+    def close(self):
+        """Stop the autojump task (e.g. before the event loop is closed)."""
+        if self._jumper is not None:
+            self._jumper.cancel()
+            self._jumper = None
+
+    def _jump(self, deadline):
+        self._now = max(self._now, deadline)
+        self.jumps += 1
+        while self._sleepers and self._sleepers[0][0] <= self._now:
+            _, _, future = heapq.heappop(self._sleepers)
+            if not future.done():
+                future.set_result(None)
+
+    def _start_jumper(self):
+        if self._sleeping is not None and not self._sleeping.done():
+            self._sleeping.set_result(None)
+        if self._jumper is None or self._jumper.done():
+            self._jumper = asyncio.get_running_loop().create_task(self._autojump())
+
+    async def _autojump(self):
+        while True:
+            await self.settle()
+            deadline = self.next_deadline()
+            if deadline is None:
+                # nothing to wake: park until the next sleep() arrives
+                self._sleeping = asyncio.get_running_loop().create_future()
+                await self._sleeping
+                continue
+            self._jump(deadline)
@@ -0,0 +1,193 @@
+"""Game rules without I/O: role assignment, night and vote outcomes, win checks.
+
+The Socket.IO handlers in main.py decide *when* things happen (phases, timers, who may act) and
+tell players about it; the functions here decide *what* happens, from plain values, and never
+emit, sleep or touch a room. `HeadlessGame` strings them together into a complete game that can
+be played without a server, which is what the balance simulator is checked against.
+
+    game = HeadlessGame.new(8, {'killCount': 2, 'doctorCount': 1}, random.Random(1))
+    game.night(kill='p3', save='p3')   # saved
+    game.vote({'p0': 'p5', 'p1': 'p5', 'p2': None})
+    game.winner                        # None until one side has won
+"""
+
+import random
+
+# settings used when the host never changed them (or sent something unparseable)
+DEFAULT_SETTINGS = {
+    'killCount': 1, 'doctorCount': 1, 'detectiveCount': 0,
+    'killerDuration': 120, 'doctorDuration': 120, 'votingDuration': 120,
+}
+
+
+def normalize_settings(settings):
+    """Host settings as ints, with defaults for anything missing."""
+    settings = settings or {}
+    try:
+        return {key: int(settings.get(key, default)) for key, default in DEFAULT_SETTINGS.items()}
+    except Exception:
+        return {'killCount': 1, 'doctorCount': 0, 'detectiveCount': 0}
+
+
+def role_list(total_players, settings):
+    """The roles dealt for a game of `total_players`, special roles first (before shuffling)."""
+    roles = []
+    # Add killers
+    k = int(settings.get('killCount', 1)) if settings else 1
+    roles += ['Killer'] * min(k, total_players)
+    # Doctors
+    d = int(settings.get('doctorCount', 0)) if settings else 0
+    roles += ['Doctor'] * min(d, max(0, total_players - len(roles)))
+    # Detectives
+    det = int(settings.get('detectiveCount', 0)) if settings else 0
+    roles += ['Detective'] * min(det, max(0, total_players - len(roles)))
+    # Remaining civilians
+    remaining = total_players - len(roles)
+    roles += ['Civilian'] * max(0, remaining)
+    return roles
+
+
+def assign_roles(players, settings, rnd):
+    """Copies of the player dicts with a shuffled 'role' each."""
+    roles = role_list(len(players), settings)
+    rnd.shuffle(roles)
+    assigned = []
+    for p, r in zip(players, roles):
+        np = dict(p)
+        np['role'] = r
+        assigned.append(np)
+    return assigned
+
+
+def night_outcome(kill_target, save_target, save_valid=True):
+    """('killed' | 'saved' | 'none', target id) for the killers' and doctor's choices.
+
+    A save only counts when it names the victim and came from a doctor who is still alive.
+    """
+    if kill_target and save_target and kill_target == save_target and save_valid:
+        return 'saved', kill_target
+    if kill_target:
+        return 'killed', kill_target
+    return 'none', None
+
+
+def tally_votes(votes):
+    """Count a round's votes: ({target id: votes}, skips, total ballots). A None vote is a skip."""
+    counts = {}
+    skip_count = 0
+    total_votes = 0
+    for v in votes.values():
+        total_votes += 1
+        if v is None:
+            # count skips/abstains
+            skip_count += 1
+        else:
+            # count actual votes
+            counts[v] = counts.get(v, 0) + 1
+    return counts, skip_count, total_votes
+
+
+def vote_outcome(votes):
+    """Decide a vote. Returns a dict with the tally and either `eliminated` (a player id) or a `reason`:
+
+    - no_votes:       nobody voted for a player
+    - tie:            two or more players share the most votes
+    - skips_majority: at least as many skips as the leader has votes
+    """
+    counts, skip_count, total_votes = tally_votes(votes)
+    outcome = {'counts': counts, 'skip_count': skip_count, 'total': total_votes,
+               'max_votes': 0, 'top': [], 'eliminated': None, 'reason': None}
+    if not counts:
+        outcome['reason'] = 'no_votes'
+        return outcome
+    # find max votes for any single player
+    max_votes = max(counts.values())
+    top = [pid for pid, c in counts.items() if c == max_votes]
+    outcome['max_votes'] = max_votes
+    outcome['top'] = top
+    if len(top) > 1:
+        outcome['reason'] = 'tie'
+    elif skip_count >= max_votes:
+        # skips that outnumber or equal the highest vote count block the elimination
+        outcome['reason'] = 'skips_majority'
+    else:
+        outcome['eliminated'] = top[0]
+    return outcome
+
+
+def winner(killers, others):
+    """'Civilians' once no killer is alive, 'Killers' once they match the rest, else None."""
+    if killers == 0:
+        return 'Civilians'
+    if killers >= others:
+        return 'Killers'
+    return None
+
+
+def can_target(actor_role, target_role):
+    """Killers may not kill or vote out another killer; everyone else may pick anyone."""
+    return not (actor_role == 'Killer' and target_role == 'Killer')
+
+
+class HeadlessGame:
+    """A whole game as plain data: who has which role, who is alive, and who has won.
+
+    Each round is `night()` followed, while nobody has won, by `vote()`, mirroring the server's
+    phase order (the win check runs after the night summary and again after the vote).
+    """
+
+    def __init__(self, roles):
+        # player id -> role, and the ids still alive
+        self.roles = dict(roles)
+        self.alive = set(self.roles)
+        self.rounds = 0
+        self.winner = None
+        # detectives that have used their one check, and what they found (player id -> role)
+        self.checked = {}
+
+    @classmethod
+    def new(cls, players, settings, rnd=None):
+        """Deal a game for `players` (a count or a list of player ids)."""
+        if isinstance(players, int):
+            players = [f'p{i}' for i in range(players)]
+        assigned = assign_roles([{'id': pid} for pid in players], settings, rnd or random.Random())
+        return cls({p['id']: p['role'] for p in assigned})
+
+    def alive_ids(self, role=None):
+        return [pid for pid in self.roles if pid in self.alive and (role is None or self.roles[pid] == role)]
+
+    def alive_count(self, role=None):
+        return len(self.alive_ids(role))
+
+    def check(self, detective, target):
+        """A detective's one-time check; returns the target's role (None when not allowed)."""
+        if detective not in self.alive or self.roles.get(detective) != 'Detective' or detective in self.checked:
+            return None
+        self.checked[detective] = target
+        return self.roles.get(target)
+
+    def night(self, kill=None, save=None, saved_by=None):
+        """Resolve a night and return (result, target) as `night_outcome`."""
+        self.rounds += 1
+        if kill is not None and not can_target('Killer', self.roles.get(kill)):
+            kill = None
+        save_valid = saved_by is None or (saved_by in self.alive and self.roles.get(saved_by) == 'Doctor')
+        result, target = night_outcome(kill, save, save_valid)
+        if result == 'killed':
+            self.alive.discard(target)
+        self._check()
+        return result, target
+
+    def vote(self, votes):
+        """Resolve a vote ({voter id: target id or None}); only alive voters count."""
+        ballots = {vid: target for vid, target in votes.items() if vid in self.alive and (
+            target is None or can_target(self.roles.get(vid), self.roles.get(target)))}
+        outcome = vote_outcome(ballots)
+        if outcome['eliminated'] is not None:
+            self.alive.discard(outcome['eliminated'])
+        self._check()
+        return outcome
+
+    def _check(self):
+        killers = self.alive_count('Killer')
+        self.winner = winner(killers, len(self.alive) - killers)
@@ -0,0 +1,384 @@
+"""Event-sourced game journal: room state survives a restart or redeploy.
+
+Every journaled `RoomState` mutation (join, leave, settings, readiness, role assignment, phase
+changes, night actions, votes, eliminations, resets) is appended to an on-disk log as
+`[op, *args]`, together with the room's phase deadlines as absolute wall-clock timestamps
+('timer' / 'timer_done' entries fed by the scheduler). Appends only touch memory; a background
+task writes them in batches on a worker thread, like the chat writer.
+
+The log is compacted per room: once a room has enough new entries (or has been dirty for a
+while) its full state is written as a snapshot and its older entries are deleted in the same
+transaction, so replay reads at most one snapshot plus a short tail per room. Rooms that no
+longer exist (or emptied) are dropped from the journal the same way.
+
+On startup `load()` returns, per room, the latest snapshot, the entries after it and the pending
+deadlines; `rebuild_room()` turns that back into a `RoomState`, and `replay()` does both for
+every room.
+"""
+
+import asyncio
+import gc
+import json
+import os
+import sqlite3
+import time
+
+from . import logs
+from .state import RoomState
+
+# write-behind: appended entries are committed at most this many seconds later
+JOURNAL_FLUSH_INTERVAL = float(os.environ.get('JOURNAL_FLUSH_INTERVAL', 0.1))
+# a room is snapshotted (and its log truncated) after this many entries...
+JOURNAL_SNAPSHOT_EVERY = int(os.environ.get('JOURNAL_SNAPSHOT_EVERY', 200))
+# ...or once it has had unsnapshotted entries for this many seconds
+JOURNAL_SNAPSHOT_INTERVAL = float(os.environ.get('JOURNAL_SNAPSHOT_INTERVAL', 30))
+
+_log = logs.get('journal')
+
+
+def _dumps(value):
+    return json.dumps(value, separators=(',', ':'), default=str)
+
+
+def _loads_all(documents):
+    # one decoder call for a whole table is several times faster than one per row
+    return json.loads('[' + ','.join(documents) + ']')
+
+
+class RoomEntry:
+    """What the journal holds for one room: snapshot (or None), entries after it, pending deadlines."""
+
+    __slots__ = ('snapshot', 'events', 'timers')
+
+    def __init__(self):
+        self.snapshot = None
+        self.events = []
+        # kind -> [due (epoch ms), step name, extra args]
+        self.timers = {}
+
+
+def rebuild_room(room, entry):
+    """Rebuild a `RoomState` from its snapshot plus the journaled mutations since."""
+    state = RoomState.from_record(entry.snapshot) if entry.snapshot else RoomState(room)
+    for op, args in entry.events:
+        state.apply(op, args)
+    # the replayed changes are already part of the state clients will be sent on rejoin
+    state.take_update()
+    return state
+
+
+class GameJournal:
+    """Append-only room journal with per-room snapshots in a SQLite file.
+
+    `record(room, op, args)` is the `RoomState.journal` hook. `snapshot_fn(room)` returns the
+    `to_record()` of a live room, or None when the room is gone and should be dropped. Without a
+    path (or before `open()`) every call is a no-op.
+    """
+
+    def __init__(self, path, snapshot_fn=None, flush_interval=JOURNAL_FLUSH_INTERVAL,
+                 snapshot_every=JOURNAL_SNAPSHOT_EVERY, snapshot_interval=JOURNAL_SNAPSHOT_INTERVAL):
+        self.path = path
+        self.snapshot_fn = snapshot_fn
+        self.flush_interval = flush_interval
+        self.snapshot_every = max(1, snapshot_every)
+        self.snapshot_interval = snapshot_interval
+        self._conn = None
+        self._seq = 0
+        # (seq, room, entry json) not yet committed
+        self._pending = []
+        # room -> [entries since its last snapshot, monotonic time of the first]
+        self._dirty = {}
+        # room -> {kind: [due, step, args]}, mirrored into each snapshot
+        self._timers = {}
+        self._task = None
+        self._wakeup = None
+        self._closing = False
+        # statistics
+        self.records = 0
+        self.flushes = 0
+        self.rows_written = 0
+        self.snapshots_written = 0
+        self.rooms_dropped = 0
+        self.errors = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.load_ms = 0.0
+        self.replay_ms = 0.0
+        self.replayed_rooms = 0
+        self.replayed_events = 0
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    @property
+    def is_open(self):
+        return self._conn is not None
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    # --- lifecycle ---
+
+    def open(self):
+        if not self.enabled or self.is_open:
+            return
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS journal (
+                seq INTEGER PRIMARY KEY,
+                room TEXT NOT NULL,
+                entry TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_journal_room_seq ON journal (room, seq);
+            CREATE TABLE IF NOT EXISTS journal_snapshots (
+                room TEXT PRIMARY KEY,
+                seq INTEGER NOT NULL,
+                snapshot TEXT NOT NULL
+            );
+        ''')
+        row = conn.execute('SELECT MAX(m) FROM (SELECT MAX(seq) AS m FROM journal '
+                           'UNION ALL SELECT MAX(seq) FROM journal_snapshots)').fetchone()
+        self._seq = row[0] or 0
+        self._conn = conn
+
+    def start(self):
+        if not self.is_open or self.running:
+            return
+        self._closing = False
+        self._wakeup = asyncio.Event()
+        if self._pending:
+            self._wakeup.set()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Flush, snapshot every dirty room (so the next startup replays snapshots only) and close."""
+        if not self.is_open:
+            return
+        if self.running:
+            self._closing = True
+            self._wakeup.set()
+            try:
+                await self._task
+            except Exception as e:
+                _log.error('writer task failed during shutdown', error=e)
+        self._task = None
+        try:
+            self.flush_sync(snapshot_all=True)
+        except Exception as e:
+            self.errors += 1
+            _log.error('final flush failed', error=e)
+        self._conn.close()
+        self._conn = None
+
+    # --- appending ---
+
+    def record(self, room, op, args):
+        if self._conn is None:
+            return
+        self._seq += 1
+        self.records += 1
+        self._pending.append((self._seq, room, _dumps([op, *args])))
+        if op == 'timer':
+            kind, due, step, extra = args
+            self._timers.setdefault(room, {})[kind] = [due, step, extra]
+        elif op == 'timer_done':
+            timers = self._timers.get(room)
+            if timers is not None:
+                timers.pop(args[0], None)
+                if not timers:
+                    del self._timers[room]
+        dirty = self._dirty.get(room)
+        if dirty is None:
+            self._dirty[room] = [1, time.monotonic()]
+        else:
+            dirty[0] += 1
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def drop(self, room):
+        """Snapshot `room` on the next flush (dropping it if `snapshot_fn` says it is gone)."""
+        if self._conn is not None:
+            self._dirty[room] = [self.snapshot_every, time.monotonic()]
+
+    # --- replay ---
+
+    def load(self):
+        """Read the journal back: {room: RoomEntry}. Every loaded room is re-snapshotted on the next flush."""
+        if not self.is_open:
+            return {}
+        started = time.perf_counter()
+        rooms = {}
+        snapshot_seq = {}
+        rows = self._conn.execute('SELECT room, seq, snapshot FROM journal_snapshots').fetchall()
+        for (room, seq, _), data in zip(rows, _loads_all(row[2] for row in rows)):
+            entry = rooms[room] = RoomEntry()
+            entry.snapshot = data['state']
+            entry.timers = data['timers']
+            snapshot_seq[room] = seq
+        rows = [row for row in self._conn.execute('SELECT room, seq, entry FROM journal ORDER BY seq')
+                if row[1] > snapshot_seq.get(row[0], 0)]
+        for (room, _, _), (op, *args) in zip(rows, _loads_all(row[2] for row in rows)):
+            entry = rooms.get(room)
+            if entry is None:
+                entry = rooms[room] = RoomEntry()
+            if op == 'timer':
+                kind, due, step, extra = args
+                entry.timers[kind] = [due, step, extra]
+            elif op == 'timer_done':
+                entry.timers.pop(args[0], None)
+            else:
+                entry.events.append((op, args))
+        events = len(rows)
+        now = time.monotonic()
+        for room in rooms:
+            self._dirty[room] = [self.snapshot_every, now]
+        self.load_ms = (time.perf_counter() - started) * 1000
+        self.replayed_rooms = len(rooms)
+        self.replayed_events = events
+        return rooms
+
+    def replay(self):
+        """Load and rebuild every room: {room: (RoomState, pending deadlines)}. Rooms that fail to rebuild are skipped."""
+        enabled = gc.isenabled()
+        # replay allocates a great many small objects at once; collecting midway only slows it down
+        gc.disable()
+        try:
+            started = time.perf_counter()
+            rooms = {}
+            for room, entry in self.load().items():
+                try:
+                    rooms[room] = (rebuild_room(room, entry), entry.timers)
+                except Exception as e:
+                    self.errors += 1
+                    _log.error('could not rebuild room', room=room, error=e)
+            self.replay_ms = (time.perf_counter() - started) * 1000
+        finally:
+            if enabled:
+                gc.enable()
+        return rooms
+
+    # --- writing ---
+
+    async def _run(self):
+        while True:
+            try:
+                # dirty rooms are snapshotted after `snapshot_interval` even if nothing else happens
+                await asyncio.wait_for(self._wakeup.wait(), self.snapshot_interval if self._dirty else None)
+            except asyncio.TimeoutError:
+                pass
+            if not self._closing:
+                await asyncio.sleep(self.flush_interval)
+            self._wakeup.clear()
+            rows, snapshots = self._take()
+            if rows or snapshots:
+                started = time.perf_counter()
+                try:
+                    await asyncio.to_thread(self._write, rows, snapshots)
+                except Exception as e:
+                    self.errors += 1
+                    _log.warning('flush failed, will retry', entries=len(rows), error=e)
+                    self._requeue(rows, snapshots)
+                    if not self._closing:
+                        await asyncio.sleep(self.flush_interval)
+                        self._wakeup.set()
+                else:
+                    self._record_flush(started, rows, snapshots)
+            if self._closing:
+                return
+
+    def flush_sync(self, snapshot_all=False):
+        """Write everything queued right now on the calling thread."""
+        rows, snapshots = self._take(snapshot_all)
+        if not rows and not snapshots:
+            return
+        started = time.perf_counter()
+        self._write(rows, snapshots)
+        self._record_flush(started, rows, snapshots)
+
+    def _take(self, snapshot_all=False):
+        """Queued entries plus the snapshots now due; runs on the event loop, which owns the room state."""
+        rows, self._pending = self._pending, []
+        now = time.monotonic()
+        due = [room for room, (count, since) in self._dirty.items()
+               if snapshot_all or count >= self.snapshot_every or now - since >= self.snapshot_interval]
+        snapshots = []
+        for room in due:
+            del self._dirty[room]
+            try:
+                state = self.snapshot_fn(room) if self.snapshot_fn else None
+                data = None if state is None else _dumps({'state': state, 'timers': self._timers.get(room, {})})
+            except Exception as e:
+                self.errors += 1
+                _log.error('snapshot failed', room=room, error=e)
+                continue
+            if data is None:
+                self._timers.pop(room, None)
+            # covers every entry of the room up to the current sequence number
+            snapshots.append((room, self._seq, data))
+        if snapshots and rows:
+            # entries superseded by a snapshot in the same batch need not be written at all
+            covered = {room for room, _, _ in snapshots}
+            rows = [row for row in rows if row[1] not in covered]
+        return rows, snapshots
+
+    def _requeue(self, rows, snapshots):
+        self._pending = rows + self._pending
+        now = time.monotonic()
+        for room, _, _ in snapshots:
+            self._dirty.setdefault(room, [self.snapshot_every, now])
+
+    def _write(self, rows, snapshots):
+        conn = self._conn
+        conn.execute('BEGIN')
+        try:
+            if rows:
+                conn.executemany('INSERT INTO journal (seq, room, entry) VALUES (?, ?, ?)', rows)
+            for room, seq, data in snapshots:
+                if data is None:
+                    conn.execute('DELETE FROM journal_snapshots WHERE room = ?', (room,))
+                else:
+                    conn.execute('INSERT INTO journal_snapshots (room, seq, snapshot) VALUES (?, ?, ?) '
+                                 'ON CONFLICT(room) DO UPDATE SET seq = excluded.seq, snapshot = excluded.snapshot',
+                                 (room, seq, data))
+                conn.execute('DELETE FROM journal WHERE room = ? AND seq <= ?', (room, seq))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _record_flush(self, started, rows, snapshots):
+        elapsed = (time.perf_counter() - started) * 1000
+        self.flushes += 1
+        self.rows_written += len(rows)
+        dropped = sum(1 for _, _, data in snapshots if data is None)
+        self.snapshots_written += len(snapshots) - dropped
+        self.rooms_dropped += dropped
+        self.last_flush_ms = elapsed
+        self.max_flush_ms = max(self.max_flush_ms, elapsed)
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'open': self.is_open,
+            'running': self.running,
+            'seq': self._seq,
+            'queue_depth': len(self._pending),
+            'dirty_rooms': len(self._dirty),
+            'rooms_with_deadlines': len(self._timers),
+            'records': self.records,
+            'flushes': self.flushes,
+            'rows_written': self.rows_written,
+            'snapshots_written': self.snapshots_written,
+            'rooms_dropped': self.rooms_dropped,
+            'errors': self.errors,
+            'last_flush_ms': round(self.last_flush_ms, 3),
+            'max_flush_ms': round(self.max_flush_ms, 3),
+            'load_ms': round(self.load_ms, 3),
+            'replay_ms': round(self.replay_ms, 3),
+            'replayed_rooms': self.replayed_rooms,
+            'replayed_events': self.replayed_events,
+        }
@@ -0,0 +1,282 @@
+"""Structured logging that never writes to the console from the event loop.
+
+Every part of the server logs under a category (`game`, `connect`, `chat`, `journal`, ...), one
+stdlib logger each below `mafia`. A record carries its message plus keyword fields (`room`,
+`sid`, counts...); the handler only puts it on a bounded queue, and a listener thread formats it
+(text or one JSON object per line) and writes it to stderr. When the queue is full the record is
+dropped and counted instead of blocking the caller.
+
+Per category there is a level and, for the chatty ones, a sampling rate: `connect=0.05` keeps one
+in twenty connect/disconnect lines (warnings and errors are never sampled out). Debug output can
+also be switched on for single rooms: records that name one of `debug_rooms` pass at DEBUG
+whatever their category's level. python-socketio's and engine.io's own loggers are the `socketio`
+and `engineio` categories (WARNING unless configured, since they log every packet).
+
+Configured from the environment at import and changed at runtime with `configure()` (see
+`POST /admin/logging`):
+
+- `LOG_LEVEL`:  default level (info)
+- `LOG_LEVELS`: per category, e.g. `game=debug,connect=warning,engineio=info`
+- `LOG_SAMPLE`: per category sampling rates, e.g. `connect=0.1`
+- `LOG_DEBUG_ROOMS`: comma-separated rooms logged at DEBUG
+- `LOG_FORMAT`: `text` (default) or `json`
+
+    log = logs.get('game')
+    log.info('votes resolved', room=room, eliminated=pid, votes=max_votes)
+"""
+
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+ROOT = 'mafia'
+# records waiting for the writer thread before new ones are dropped
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+# categories that stay quiet unless configured otherwise
+QUIET = {'socketio': logging.WARNING, 'engineio': logging.WARNING}
+
+_root = logging.getLogger(ROOT)
+_loggers = {}
+# category -> kept fraction of records below WARNING
+_sample = {}
+_debug_rooms = frozenset()
+_default_level = logging.INFO
+_format = 'text'
+_handler = None
+_listener = None
+
+
+def _level(value):
+    if isinstance(value, int):
+        return value
+    level = logging.getLevelName(str(value).upper())
+    if not isinstance(level, int):
+        raise ValueError(f'unknown log level: {value}')
+    return level
+
+
+def _pairs(spec):
+    """'a=1,b=2' -> {'a': '1', 'b': '2'}"""
+    pairs = {}
+    for item in (spec or '').split(','):
+        if '=' in item:
+            key, value = item.split('=', 1)
+            pairs[key.strip()] = value.strip()
+    return pairs
+
+
+class CategoryLogger:
+    """Logger of one category. `debug()` ... `error()` take a message and keyword fields; a `room`
+    field also decides whether the room's debug switch applies."""
+
+    __slots__ = ('category', 'logger')
+
+    def __init__(self, category):
+        self.category = category
+        self.logger = logging.getLogger(f'{ROOT}.{category}')
+
+    def enabled(self, level, room=None):
+        """Whether a record at `level` (about `room`) would pass the level checks."""
+        if self.logger.isEnabledFor(level):
+            return True
+        return level >= logging.DEBUG and room is not None and room in _debug_rooms
+
+    def sample(self, level, room=None):
+        """`enabled()` plus this category's sampling roll: True when a record should be emitted.
+        Use it to skip gathering fields for a record that would be dropped anyway."""
+        if not self.enabled(level, room):
+            return False
+        rate = _sample.get(self.category)
+        return rate is None or level >= logging.WARNING or random.random() < rate
+
+    def emit(self, level, msg, fields, exc_info=None):
+        """Log without checks (after `sample()` said yes)."""
+        rate = _sample.get(self.category)
+        if rate is not None and level < logging.WARNING:
+            fields['sampled'] = rate
+        record = self.logger.makeRecord(self.logger.name, level, '', 0, msg, None, exc_info, extra={
+            'category': self.category, 'fields': fields})
+        # straight to the handlers: `sample()` already applied the level (room debug switch included)
+        for handler in _root.handlers:
+            if level >= handler.level:
+                handler.handle(record)
+
+    def log(self, level, msg, **fields):
+        if self.sample(level, fields.get('room')):
+            self.emit(level, msg, fields)
+
+    def debug(self, msg, **fields):
+        # the common case (debug off, no debug rooms) is settled by the first check
+        if (self.logger.isEnabledFor(logging.DEBUG) or _debug_rooms) and self.sample(logging.DEBUG, fields.get('room')):
+            self.emit(logging.DEBUG, msg, fields)
+
+    def info(self, msg, **fields):
+        if self.sample(logging.INFO, fields.get('room')):
+            self.emit(logging.INFO, msg, fields)
+
+    def warning(self, msg, **fields):
+        if self.sample(logging.WARNING, fields.get('room')):
+            self.emit(logging.WARNING, msg, fields)
+
+    def error(self, msg, **fields):
+        if self.sample(logging.ERROR, fields.get('room')):
+            self.emit(logging.ERROR, msg, fields)
+
+    def exception(self, msg, **fields):
+        """ERROR with the current exception's traceback."""
+        if self.sample(logging.ERROR, fields.get('room')):
+            self.emit(logging.ERROR, msg, fields, exc_info=sys.exc_info())
+
+
+def get(category):
+    logger = _loggers.get(category)
+    if logger is None:
+        logger = _loggers.setdefault(category, CategoryLogger(category))
+    return logger
+
+
+def stdlib(category):
+    """The plain `logging.Logger` of a category, for libraries that take one (python-socketio)."""
+    return get(category).logger
+
+
+class _Formatter(logging.Formatter):
+    def format(self, record):
+        fields = getattr(record, 'fields', None) or {}
+        category = getattr(record, 'category', None) or record.name.rpartition('.')[2]
+        msg = record.getMessage()
+        exc = self.formatException(record.exc_info) if record.exc_info else None
+        ts = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f'.{int(record.msecs):03d}Z'
+        if _format == 'json':
+            doc = {'ts': ts, 'level': record.levelname.lower(), 'cat': category, 'msg': msg}
+            doc.update(fields)
+            if exc:
+                doc['exc'] = exc
+            return json.dumps(doc, separators=(',', ':'), default=str)
+        line = f'{ts} {record.levelname:<7} {category} {msg}'
+        if fields:
+            line += ' ' + ' '.join(f'{key}={value}' for key, value in fields.items())
+        return line + ('\n' + exc if exc else '')
+
+
+class _DroppingQueueHandler(QueueHandler):
+    """Queues records as they are (formatting happens on the listener thread) and drops them when
+    the queue is full. With the listener stopped it writes synchronously instead."""
+
+    def __init__(self, q, target):
+        super().__init__(q)
+        self.target = target
+        self.dropped = 0
+        self.direct = False
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def emit(self, record):
+        if self.direct:
+            self.target.handle(record)
+            return
+        self.enqueue(record)
+
+
+def _install():
+    global _handler
+    target = logging.StreamHandler(sys.stderr)
+    target.setFormatter(_Formatter())
+    _handler = _DroppingQueueHandler(queue.Queue(maxsize=max(1, LOG_QUEUE_SIZE)), target)
+    # written directly until start(): nothing logged during import or startup is lost
+    _handler.direct = True
+    _root.addHandler(_handler)
+    _root.propagate = False
+
+
+def start():
+    """Start the writer thread; from now on records are queued (idempotent)."""
+    global _listener
+    if _listener is not None:
+        return
+    _listener = QueueListener(_handler.queue, _handler.target)
+    _listener.start()
+    _handler.direct = False
+
+
+def stop():
+    """Write out everything queued and stop the writer thread; later records are written directly."""
+    global _listener
+    if _listener is None:
+        return
+    _handler.direct = True
+    _listener.stop()
+    _listener = None
+
+
+def configure(levels=None, sample=None, debug_rooms=None, default=None, format=None):
+    """Change logging at runtime. `levels` / `sample` update the given categories (a level or rate
+    of None resets that category); `debug_rooms` replaces the set of rooms logged at DEBUG."""
+    global _default_level, _debug_rooms, _format
+    # validate everything first so a bad value changes nothing
+    if format is not None and format not in ('text', 'json'):
+        raise ValueError(f'unknown log format: {format}')
+    default = None if default is None else _level(default)
+    levels = {category: None if level is None else _level(level) for category, level in (levels or {}).items()}
+    sample = {category: None if rate is None else float(rate) for category, rate in (sample or {}).items()}
+    if format is not None:
+        _format = format
+    if default is not None:
+        _default_level = default
+        _root.setLevel(default)
+    for category, level in levels.items():
+        get(category).logger.setLevel(QUIET.get(category, logging.NOTSET) if level is None else level)
+    for category, rate in sample.items():
+        if rate is None or rate >= 1:
+            _sample.pop(category, None)
+        else:
+            _sample[category] = max(0.0, rate)
+    if debug_rooms is not None:
+        _debug_rooms = frozenset(debug_rooms)
+
+
+def settings():
+    """Current configuration and writer counters."""
+    levels = {category: logging.getLevelName(logger.logger.getEffectiveLevel()).lower()
+              for category, logger in sorted(_loggers.items())}
+    return {
+        'default': logging.getLevelName(_default_level).lower(),
+        'levels': levels,
+        'sample': dict(_sample),
+        'debug_rooms': sorted(_debug_rooms),
+        'format': _format,
+        'queued': _handler.queue.qsize(),
+        'dropped': _handler.dropped,
+        'writer_running': _listener is not None,
+    }
+
+
+def _from_env():
+    for category, level in QUIET.items():
+        get(category).logger.setLevel(level)
+    # SOCKETIO_DEBUG=1 (the old switch) still turns on socketio/engineio packet logging
+    if os.environ.get('SOCKETIO_DEBUG', '').lower() in ('1', 'true', 'yes'):
+        configure(levels={'socketio': 'info', 'engineio': 'info'})
+    configure(
+        default=os.environ.get('LOG_LEVEL', 'info'),
+        levels=_pairs(os.environ.get('LOG_LEVELS')),
+        sample=_pairs(os.environ.get('LOG_SAMPLE')),
+        debug_rooms=[room.strip() for room in os.environ.get('LOG_DEBUG_ROOMS', '').split(',') if room.strip()],
+        format=os.environ.get('LOG_FORMAT', 'text'),
+    )
+
+
+_install()
+_from_env()
@@ -1,17 +1,112 @@
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, RedirectResponse, StreamingResponse
 
+import functools
+import hmac
+import json
+import logging
+import random
 import sqlite3
 import os
+import signal
+import threading
 import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from urllib.parse import parse_qs
 
 # import python-socketio ASGI
 import socketio
 import asyncio
 
+from . import engine, logs, metrics, profiling
+from .actor import RoomActors
+from .clock import Clock, VirtualClock
+from .journal import GameJournal
+from .scheduler import PhaseScheduler
+from .sharding import ShardMap
+from .state import RoomState
+from .state_backend import create_backend
+from .watchdog import LoopWatchdog
+
+# log categories (see logs.py): levels, sampling and per-room debug are set per category
+_log_chat = logs.get('chat')
+_log_connect = logs.get('connect')
+_log_lobby = logs.get('lobby')
+_log_game = logs.get('game')
+_log_journal = logs.get('journal')
+_log_drain = logs.get('drain')
+
+
+@asynccontextmanager
+async def lifespan(app):
+    started = time.perf_counter()
+    # nothing touches the disk at import time: the chat schema is checked (and migrated) on a worker
+    # thread while the journal is replayed here, and the server only listens once both are done
+    logs.start()
+    schema = asyncio.create_task(_timed('init_db_ms', asyncio.to_thread(init_db)))
+    # bring back the rooms that were running when the process last stopped
+    game_journal.open()
+    _restore_rooms()
+    _startup_stats['restore_ms'] = round((time.perf_counter() - started) * 1000, 2)
+    await schema
+    # background workers need a running loop, so they are started here rather than at import time
+    message_writer.start()
+    chat_compactor.start()
+    game_journal.start()
+    scheduler.start()
+    if state_backend.shared:
+        # room events forwarded to this worker by the others, and rooms a draining worker gave up
+        state_backend.subscribe(f'worker:{state_backend.worker_id}', _on_forwarded_call)
+        state_backend.subscribe('rooms_released', _on_rooms_released)
+    await _timed('state_backend_ms', state_backend.start())
+    _install_drain_signal()
+    loop_watchdog.start()
+    _startup_stats['startup_ms'] = round((time.perf_counter() - started) * 1000, 2)
+    _startup_stats['ready'] = True
+    try:
+        yield
+    finally:
+        await loop_watchdog.stop()
+        await scheduler.stop()
+        # pending deadlines stay in the journal and are re-armed on the next start
+        await game_journal.stop()
+        await state_backend.stop()
+        await chat_compactor.stop()
+        # drain any queued chat writes before the process exits
+        await message_writer.stop()
+        db_pool.close_all()
+        # write out queued log lines before the process exits
+        logs.stop()
+
+
+# startup timings (see /stats/startup); `ready` turns true once the lifespan startup is done
+_startup_stats = {'ready': False}
+
+
+async def _timed(key, awaitable):
+    started = time.perf_counter()
+    try:
+        return await awaitable
+    finally:
+        _startup_stats[key] = round((time.perf_counter() - started) * 1000, 2)
+
+
+app = FastAPI(lifespan=lifespan)
 
-app = FastAPI()
+
+@app.middleware('http')
+async def route_room_requests(request: Request, call_next):
+    """With room sharding on, send `/rooms/{id}/...` calls for rooms owned elsewhere to their worker."""
+    if shards.enabled:
+        parts = request.url.path.split('/', 3)
+        if len(parts) == 4 and parts[1] == 'rooms' and parts[2] and not shards.is_local(parts[2]):
+            url = shards.url_for(parts[2]) + request.url.path
+            if request.url.query:
+                url += '?' + request.url.query
+            return RedirectResponse(url, status_code=307)
+    return await call_next(request)
 
 # Allow CORS for frontend dev
 app.add_middleware(
@@ -25,7 +120,7 @@ app.add_middleware(
 
 @app.get("/")
 async def read_root():
-    return {"message": "Mafia backend is running!"}
+    return {"message": "Mafia backend is running!", "ready": _startup_stats['ready']}
 
 
 # Add HEAD support for uptime monitors (e.g., UptimeRobot free plan)
@@ -34,27 +129,239 @@ async def root_head():
     return {}
 
 
-# in-memory room player list
+# event-loop watchdog (see watchdog.py): heartbeat period, how long the loop may be stuck before its
+# stack is sampled and logged, and how much lag over a window takes the worker out of rotation
+LOOP_WATCHDOG_INTERVAL = float(os.environ.get('LOOP_WATCHDOG_INTERVAL', 0.05))
+LOOP_STALL_THRESHOLD_MS = int(os.environ.get('LOOP_STALL_THRESHOLD_MS', 250))
+READY_LAG_WINDOW = float(os.environ.get('READY_LAG_WINDOW', 10))
+READY_LAG_RATIO = float(os.environ.get('READY_LAG_RATIO', 0.5))
+LOOP_LAG_SECONDS = metrics.histogram('event_loop_lag_seconds', 'How late the event loop woke the watchdog heartbeat',
+                                     buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0))
+LOOP_STALLS = metrics.counter('event_loop_stalls_total', 'Times the event loop was stuck for longer than LOOP_STALL_THRESHOLD_MS')
+
+
+def _on_loop_lag(lag):
+    LOOP_LAG_SECONDS.observe(lag)
+    if lag >= loop_watchdog.threshold:
+        LOOP_STALLS.inc()
+
+
+loop_watchdog = LoopWatchdog(interval=LOOP_WATCHDOG_INTERVAL, threshold=LOOP_STALL_THRESHOLD_MS / 1000,
+                             ready_window=READY_LAG_WINDOW, ready_ratio=READY_LAG_RATIO, on_lag=_on_loop_lag)
+
+
+def _readiness():
+    """Why this worker should not get new traffic right now (None when it should)."""
+    if not _startup_stats['ready']:
+        return 'starting'
+    if _drain_state is not None:
+        return 'draining'
+    if loop_watchdog.saturated():
+        return 'event loop saturated'
+    return None
+
+
+# readiness for load balancers: unlike `HEAD /` (liveness) this fails while starting, draining, or
+# when the event loop has been lagging for most of the last READY_LAG_WINDOW seconds
+@app.get("/ready")
+async def ready():
+    reason = _readiness()
+    body = {'ready': reason is None, 'reason': reason, 'lag_ms': round(loop_watchdog.lag * 1000, 2)}
+    return JSONResponse(body, status_code=200 if reason is None else 503)
+
+
+@app.head("/ready")
+async def ready_head():
+    return JSONResponse({}, status_code=200 if _readiness() is None else 503)
+
+
+# token required by moderator/admin endpoints; when unset those endpoints are disabled
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+
+
+def require_admin(request: Request):
+    """FastAPI dependency guarding admin endpoints (`Authorization: Bearer <token>` or `X-Admin-Token`)."""
+    auth = request.headers.get('authorization') or ''
+    token = auth[7:] if auth.lower().startswith('bearer ') else request.headers.get('x-admin-token')
+    if not ADMIN_TOKEN or not token or not hmac.compare_digest(token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail='admin token required')
+
+
+# in-memory rooms: room id -> RoomState (roster, host, phase, per-round actions)
 _rooms = {}
-# room metadata (e.g., host id)
-_room_meta = {}
+# where room leases, snapshots and cross-worker messages live (STATE_BACKEND=memory|sqlite[:path]);
+# with a shared backend several uvicorn workers serve the same rooms, each room run by its owner
+state_backend = create_backend(os.environ.get('STATE_BACKEND'))
+# room-affinity sharding (SHARD_WORKERS / SHARD_SELF): the alternative to a shared backend,
+# where rooms are pinned to workers by hashing the room id and clients are sent to the owner
+shards = ShardMap.from_env()
+if shards.enabled and state_backend.shared:
+    raise RuntimeError('SHARD_WORKERS and a shared STATE_BACKEND are alternatives; configure one of them')
+# room id -> (owning worker id, monotonic expiry) for rooms run elsewhere
+_room_owners = {}
+# room id -> claim in flight (see `_room_owner`)
+_room_claims = {}
+# sockets on this worker whose room runs on another worker: sid -> room id (for disconnect)
+_forwarded_sids = {}
+# reverse index for connected sockets: sid -> (room id, player id), kept by join/leave/disconnect
+_sid_index = {}
 # grace window before removing a disconnected player (seconds)
-GRACE_SECONDS = 8
+GRACE_SECONDS = float(os.environ.get('GRACE_SECONDS', 8))
+# time source of game flow: deadlines, countdown timestamps and time sync (see `use_clock`)
+clock = Clock()
+# per-room mailboxes: socket events and timer expirations of a room are handled one at a time
+room_actors = RoomActors(flush=lambda room, deferred: _flush_deferred(room, deferred))
+# every phase deadline, grace-period removal and room reset, keyed by (room, kind); expired
+# timers are delivered through the room's mailbox, and game deadlines are journaled
+scheduler = PhaseScheduler(clock=clock, dispatch=room_actors.post, observer=lambda event, timer: _journal_timer(event, timer))
+
+
+def use_clock(new_clock):
+    """Run game flow on `new_clock`, e.g. a `VirtualClock` so tests play whole games instantly.
+
+    Must be called before any timer is armed. A virtual clock without its own `idle` check waits
+    for the room mailboxes and timer callbacks to drain before it lets time move on.
+    """
+    global clock
+    scheduler.use_clock(new_clock)
+    clock = new_clock
+    if isinstance(new_clock, VirtualClock) and new_clock.idle is None:
+        new_clock.idle = lambda: room_actors.idle() and scheduler.idle()
+    return new_clock
 
 
 # --- Simple SQLite persistence for messages ---
-DB_PATH = os.path.join(os.path.dirname(__file__), 'chat.db')
+DB_PATH = os.environ.get('CHAT_DB_PATH') or os.path.join(os.path.dirname(__file__), 'chat.db')
+
+# connection pragmas applied once per pooled connection
+DB_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-16000',
+    'PRAGMA mmap_size=67108864',
+    'PRAGMA busy_timeout=5000',
+)
+
+
+DB_SECONDS = metrics.histogram('chat_db_seconds', 'Chat database call latency (on worker threads) by operation', ('op',))
+
+
+def _timed_db(op):
+    """Record the decorated database call's latency in chat_db_seconds{op}."""
+    def decorate(fn):
+        child = DB_SECONDS.labels(op)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                child.observe(time.perf_counter() - started)
+        return wrapper
+    return decorate
+
+
+class ConnectionPool:
+    """Long-lived SQLite connections, one per thread.
+
+    sqlite3 connections are cheap to use but not to open, and must not be shared between threads
+    while a statement is running. Each thread (the event loop thread and the worker threads used
+    by the chat writer) lazily gets its own connection, configured once with WAL and the pragmas
+    above, and keeps it until `close_all()`.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._conns = []
+
+    def get(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            for pragma in DB_PRAGMAS:
+                try:
+                    conn.execute(pragma)
+                except sqlite3.DatabaseError:
+                    pass
+            self._local.conn = conn
+            with self._lock:
+                self._conns.append(conn)
+        return conn
+
+    def size(self):
+        with self._lock:
+            return len(self._conns)
+
+    def close_all(self):
+        with self._lock:
+            conns, self._conns = self._conns, []
+        for conn in conns:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        # threads that still hold a reference will reconnect on next use
+        self._local = threading.local()
+
+
+db_pool = ConnectionPool(DB_PATH)
+
+
+def _journal_path():
+    """GAME_JOURNAL: unset for `journal.db` next to the chat database, `off`, or a file path."""
+    spec = os.environ.get('GAME_JOURNAL')
+    if spec == 'off':
+        return None
+    if state_backend.shared:
+        # workers of a shared backend hand rooms over through the room records they publish there
+        # (see `_adopt_room`), not a local journal
+        if spec:
+            raise RuntimeError('GAME_JOURNAL cannot be used with a shared STATE_BACKEND')
+        return None
+    if spec:
+        return spec
+    name = f'journal-{shards.self_name}.db' if shards.enabled else 'journal.db'
+    return os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), name)
+
+
+def _journal_snapshot(room):
+    state = _rooms.get(room)
+    if state is None or not _room_is_live(state):
+        return None
+    return state.to_record()
+
+
+# crash recovery: room state transitions and game deadlines are appended to an on-disk journal,
+# compacted with per-room snapshots, and replayed on startup
+game_journal = GameJournal(_journal_path(), snapshot_fn=_journal_snapshot)
+# how long players of a restored room have to reconnect before they are removed
+JOURNAL_RESTORE_GRACE = float(os.environ.get('JOURNAL_RESTORE_GRACE', 30))
 
 
 def get_db_conn():
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Return this thread's pooled connection. Callers must not close it."""
+    return db_pool.get()
+
+
+# switching an existing database to incremental auto-vacuum needs one full VACUUM; only do it while it is small
+VACUUM_CONVERT_MAX_PAGES = int(os.environ.get('VACUUM_CONVERT_MAX_PAGES', 25000))
 
 
 def init_db():
     conn = get_db_conn()
     cur = conn.cursor()
+    # freed pages are returned to the OS in small steps by the compactor instead of a blocking full VACUUM
+    if cur.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        cur.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        if cur.execute('PRAGMA page_count').fetchone()[0] <= VACUUM_CONVERT_MAX_PAGES:
+            cur.execute('VACUUM')
+        else:
+            _log_chat.warning('chat.db is too large to convert to incremental auto_vacuum at startup; run VACUUM offline')
     cur.execute('''
     CREATE TABLE IF NOT EXISTS messages (
         id TEXT PRIMARY KEY,
@@ -62,279 +369,1226 @@ def init_db():
         sender_id TEXT,
         sender_name TEXT,
         text TEXT,
-        ts INTEGER
+        ts INTEGER,
+        epoch INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+    # chat history is keyed by (room, epoch): ending a game bumps the room's epoch, which retires the
+    # old game's rows in O(1); the compactor deletes retired epochs later in small batches
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS chat_rooms (
+        room TEXT PRIMARY KEY,
+        epoch INTEGER NOT NULL DEFAULT 0,
+        last_active INTEGER NOT NULL
+    )
+    ''')
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS chat_retired (
+        room TEXT NOT NULL,
+        epoch INTEGER NOT NULL,
+        retired_at INTEGER NOT NULL,
+        PRIMARY KEY (room, epoch)
+    )
+    ''')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_chat_rooms_last_active ON chat_rooms (last_active)')
+    columns = {r[1] for r in cur.execute('PRAGMA table_info(messages)').fetchall()}
+    if 'epoch' not in columns:
+        # databases created before per-game epochs: everything stored so far belongs to epoch 0
+        cur.execute('ALTER TABLE messages ADD COLUMN epoch INTEGER NOT NULL DEFAULT 0')
+        cur.execute('INSERT OR IGNORE INTO chat_rooms (room, epoch, last_active) SELECT room, 0, ? FROM messages GROUP BY room', (int(time.time()),))
+    # history reads are always by room and epoch in time order; (ts, id) makes the keyset cursor unique
+    cur.execute('DROP INDEX IF EXISTS idx_messages_room_ts')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_messages_room_epoch_ts ON messages (room, epoch, ts, id)')
+    # time-range exports across rooms walk this instead of sorting the whole table
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_messages_ts ON messages (ts, id)')
+    # full-text index over chat (all namespaces, including __killers/__doctors), kept in sync by triggers
+    has_fts = cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'").fetchone()
+    cur.execute('''
+    CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+        text, sender_name,
+        content='messages', content_rowid='rowid',
+        tokenize='unicode61 remove_diacritics 2'
     )
     ''')
+    cur.execute('''
+    CREATE TRIGGER IF NOT EXISTS messages_fts_ai AFTER INSERT ON messages BEGIN
+        INSERT INTO messages_fts (rowid, text, sender_name) VALUES (new.rowid, new.text, new.sender_name);
+    END
+    ''')
+    cur.execute('''
+    CREATE TRIGGER IF NOT EXISTS messages_fts_ad AFTER DELETE ON messages BEGIN
+        INSERT INTO messages_fts (messages_fts, rowid, text, sender_name) VALUES ('delete', old.rowid, old.text, old.sender_name);
+    END
+    ''')
+    cur.execute('''
+    CREATE TRIGGER IF NOT EXISTS messages_fts_au AFTER UPDATE ON messages BEGIN
+        INSERT INTO messages_fts (messages_fts, rowid, text, sender_name) VALUES ('delete', old.rowid, old.text, old.sender_name);
+        INSERT INTO messages_fts (rowid, text, sender_name) VALUES (new.rowid, new.text, new.sender_name);
+    END
+    ''')
+    if not has_fts:
+        # index whatever history existed before the FTS table was introduced
+        cur.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
     conn.commit()
-    conn.close()
+    # init_db runs off the loop (in the lifespan), so the chat path never has to read an epoch
+    _update_chat_epochs(read_chat_epochs())
+
+
+# current chat epoch per stored room name (room, room__killers, room__doctors), for rooms whose
+# chat has been retired at least once; every other room is at epoch 0. Loaded by init_db() and
+# kept by retire_chat_history() and the compactor, so looking one up never touches the database.
+_chat_epochs = {}
+
+
+def chat_epoch(room):
+    return _chat_epochs.get(room, 0)
+
+
+def read_chat_epochs(rooms=None):
+    """Stored epochs of `rooms` (of every room past epoch 0 when None): {room: epoch}."""
+    conn = get_db_conn()
+    if rooms is None:
+        return dict(conn.execute('SELECT room, epoch FROM chat_rooms WHERE epoch > 0').fetchall())
+    rooms = list(rooms)
+    found = dict(conn.execute(f"SELECT room, epoch FROM chat_rooms WHERE room IN ({','.join('?' * len(rooms))})", rooms).fetchall())
+    return {room: found.get(room, 0) for room in rooms}
+
+
+def _update_chat_epochs(epochs):
+    for room, epoch in epochs.items():
+        if epoch:
+            _chat_epochs[room] = epoch
+        else:
+            _chat_epochs.pop(room, None)
+
+
+def _message_row(room, message, epoch=0):
+    sender = message.get('from', {}) or {}
+    return (str(message.get('id')), room, str(sender.get('id')), sender.get('name'), message.get('text'), int(message.get('ts') or time.time()), epoch)
+
+
+@_timed_db('write')
+def save_messages(rows, retired=()):
+    """Write a batch of message rows and epoch retirements in a single transaction.
+
+    `retired` holds (room, old_epoch, new_epoch) tuples; retiring only moves the room's epoch
+    pointer and records the old epoch for the compactor, so it costs the same for any history size.
+    """
+    conn = get_db_conn()
+    now = int(time.time())
+    try:
+        cur = conn.cursor()
+        if rows:
+            # upsert rather than INSERT OR REPLACE: REPLACE deletes without firing the FTS sync triggers
+            cur.executemany('INSERT INTO messages (id, room, sender_id, sender_name, text, ts, epoch) VALUES (?, ?, ?, ?, ?, ?, ?) '
+                            'ON CONFLICT(id) DO UPDATE SET room = excluded.room, sender_id = excluded.sender_id, '
+                            'sender_name = excluded.sender_name, text = excluded.text, ts = excluded.ts, epoch = excluded.epoch', rows)
+            touched = {(row[1], row[6]) for row in rows}
+            cur.executemany('INSERT INTO chat_rooms (room, epoch, last_active) VALUES (?, ?, ?) '
+                            'ON CONFLICT(room) DO UPDATE SET last_active = excluded.last_active, epoch = MAX(epoch, excluded.epoch)',
+                            [(room, epoch, now) for room, epoch in touched])
+        for room, old_epoch, new_epoch in retired:
+            cur.execute('INSERT INTO chat_rooms (room, epoch, last_active) VALUES (?, ?, ?) '
+                        'ON CONFLICT(room) DO UPDATE SET epoch = MAX(epoch, excluded.epoch), last_active = excluded.last_active',
+                        (room, new_epoch, now))
+            cur.execute('INSERT OR IGNORE INTO chat_retired (room, epoch, retired_at) VALUES (?, ?, ?)', (room, old_epoch, now))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
 
 
 def save_message(room, message):
+    save_messages([_message_row(room, message, chat_epoch(room))])
+
+
+# write-behind tuning: flush when this many rows are queued, or after this many seconds, whichever comes first
+CHAT_FLUSH_BATCH = int(os.environ.get('CHAT_FLUSH_BATCH', 200))
+CHAT_FLUSH_INTERVAL = float(os.environ.get('CHAT_FLUSH_INTERVAL', 0.25))
+
+
+class MessageWriter:
+    """Write-behind queue for chat messages.
+
+    Handlers call `enqueue()` which only appends to an in-memory list; a single background task
+    flushes batches with `executemany` in one transaction on a worker thread so the event loop
+    never waits on SQLite. Epoch retirements go through the same queue so they are committed in
+    order with the inserts around them. When the writer is not running (e.g. the module was
+    imported without the ASGI lifespan) writes fall back to the synchronous path.
+    """
+
+    def __init__(self, batch_size=CHAT_FLUSH_BATCH, interval=CHAT_FLUSH_INTERVAL):
+        self.batch_size = max(1, batch_size)
+        self.interval = interval
+        self._pending = []
+        self._inflight = []
+        self._retired = []
+        self._task = None
+        self._wakeup = None
+        self._full = None
+        self._closing = False
+        # flush statistics
+        self.flushes = 0
+        self.rows_written = 0
+        self.errors = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if self.running:
+            return
+        self._closing = False
+        self._wakeup = asyncio.Event()
+        self._full = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the background task and flush everything still queued."""
+        if not self.running:
+            self._flush_sync()
+            return
+        self._closing = True
+        self._wakeup.set()
+        self._full.set()
+        try:
+            await self._task
+        except Exception as e:
+            _log_chat.error('writer task failed during shutdown', error=e)
+        self._task = None
+        # anything that raced in after the final flush (or was requeued on error)
+        self._flush_sync()
+
+    def enqueue(self, room, message):
+        row = _message_row(room, message, chat_epoch(room))
+        if not self.running:
+            save_messages([row])
+            return
+        self._pending.append(row)
+        self._wakeup.set()
+        if len(self._pending) >= self.batch_size:
+            self._full.set()
+
+    def retire(self, retirements):
+        """Queue (room, old_epoch, new_epoch) retirements, dropping queued rows of the retired epochs."""
+        retired = {(room, old_epoch) for room, old_epoch, _ in retirements}
+        self._pending = [row for row in self._pending if (row[1], row[6]) not in retired]
+        if not self.running:
+            save_messages([], retired=retirements)
+            return
+        self._retired.extend(retirements)
+        self._wakeup.set()
+
+    def pending_for(self, room, epoch):
+        """Queued (not yet committed) rows for a room's epoch, oldest first, so reads can see their own writes."""
+        return [row for row in self._inflight + self._pending if row[1] == room and row[6] == epoch]
+
+    def stats(self):
+        return {
+            'running': self.running,
+            'queue_depth': len(self._pending),
+            'inflight': len(self._inflight),
+            'pending_retirements': len(self._retired),
+            'batch_size': self.batch_size,
+            'interval': self.interval,
+            'flushes': self.flushes,
+            'rows_written': self.rows_written,
+            'errors': self.errors,
+            'last_flush_ms': round(self.last_flush_ms, 3),
+            'max_flush_ms': round(self.max_flush_ms, 3),
+            'avg_flush_ms': round(self.total_flush_ms / self.flushes, 3) if self.flushes else 0.0,
+        }
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            # give the batch a chance to fill up unless it is already full or we are shutting down
+            if not self._closing and len(self._pending) < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._full.wait(), timeout=self.interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._wakeup.clear()
+            self._full.clear()
+            await self._flush()
+            if self._closing and not self._pending and not self._retired:
+                return
+
+    def _take(self):
+        rows, retired = self._pending, self._retired
+        self._pending, self._retired = [], []
+        return rows, retired
+
+    def _record(self, started, count):
+        elapsed = (time.perf_counter() - started) * 1000
+        self.flushes += 1
+        self.rows_written += count
+        self.last_flush_ms = elapsed
+        self.max_flush_ms = max(self.max_flush_ms, elapsed)
+        self.total_flush_ms += elapsed
+
+    async def _flush(self):
+        rows, retired = self._take()
+        if not rows and not retired:
+            return
+        self._inflight = rows
+        started = time.perf_counter()
+        try:
+            await asyncio.to_thread(save_messages, rows, retired)
+        except Exception as e:
+            # keep the batch for the next attempt rather than dropping chat history
+            self._inflight = []
+            self.errors += 1
+            _log_chat.warning('flush failed, will retry', rows=len(rows), error=e)
+            self._pending = rows + self._pending
+            self._retired = retired + self._retired
+            if not self._closing:
+                await asyncio.sleep(self.interval)
+                self._wakeup.set()
+            return
+        self._inflight = []
+        self._record(started, len(rows))
+
+    def _flush_sync(self):
+        rows, retired = self._take()
+        if not rows and not retired:
+            return
+        started = time.perf_counter()
+        save_messages(rows, retired)
+        self._record(started, len(rows))
+
+
+message_writer = MessageWriter()
+
+
+MESSAGE_COLUMNS = ('id', 'room', 'sender_id', 'sender_name', 'text', 'ts')
+# hard cap on a single history page
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(message):
+    """Opaque keyset cursor for a message: its (ts, id) position in the room's history."""
+    return f"{message['ts']}:{message['id']}"
+
+
+def decode_cursor(cursor):
+    ts, sep, mid = (cursor or '').partition(':')
+    if not sep:
+        raise ValueError(f"invalid cursor: {cursor!r}")
+    return int(ts), mid
+
+
+@_timed_db('read')
+def get_messages_page(room, limit=50, before=None, after=None):
+    """Keyset-paginated history for a room, returned in chronological order.
+
+    `before`/`after` are (ts, id) tuples (see `decode_cursor`). With neither, the newest `limit`
+    messages are returned. Each page is a single range scan on idx_messages_room_epoch_ts, so cost is
+    O(limit) regardless of how much history the room has. Returns (messages, has_more), where
+    has_more says whether further rows exist beyond the page in the direction of travel.
+    """
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    epoch = chat_epoch(room)
+    cols = ', '.join(MESSAGE_COLUMNS)
+    if after is not None:
+        sql = f'SELECT {cols} FROM messages WHERE room = ? AND epoch = ? AND (ts, id) > (?, ?) ORDER BY ts ASC, id ASC LIMIT ?'
+        params = (room, epoch, after[0], after[1], limit + 1)
+    elif before is not None:
+        sql = f'SELECT {cols} FROM messages WHERE room = ? AND epoch = ? AND (ts, id) < (?, ?) ORDER BY ts DESC, id DESC LIMIT ?'
+        params = (room, epoch, before[0], before[1], limit + 1)
+    else:
+        sql = f'SELECT {cols} FROM messages WHERE room = ? AND epoch = ? ORDER BY ts DESC, id DESC LIMIT ?'
+        params = (room, epoch, limit + 1)
+    rows = get_db_conn().execute(sql, params).fetchall()
+    msgs = [dict(r) for r in rows]
+    if after is None:
+        # newest-first from the index, flip to chronological
+        msgs.reverse()
+    # merge messages still sitting in the write-behind queue so readers see their own writes
+    queued = message_writer.pending_for(room, epoch)
+    if queued:
+        seen = {m['id'] for m in msgs}
+        for row in queued:
+            m = dict(zip(MESSAGE_COLUMNS, row))
+            key = (m['ts'], m['id'])
+            if m['id'] in seen or (after is not None and key <= after) or (before is not None and key >= before):
+                continue
+            msgs.append(m)
+        msgs.sort(key=lambda m: (m['ts'], m['id']))
+    has_more = len(msgs) > limit
+    # drop the rows furthest from the cursor
+    msgs = msgs[:limit] if after is not None else msgs[-limit:]
+    return msgs, has_more
+
+
+# per-room hot cache: how many recent messages to keep per room, and how many rooms to keep at most
+CHAT_CACHE_SIZE = int(os.environ.get('CHAT_CACHE_SIZE', 200))
+CHAT_CACHE_ROOMS = int(os.environ.get('CHAT_CACHE_ROOMS', 10000))
+
+
+class RecentMessageCache:
+    """Bounded in-memory ring buffer of the latest messages per room (public and team namespaces).
+
+    Each entry is `[deque, complete]` where `complete` means the deque holds the room's entire
+    stored history (so an empty deque is a cached "no messages" answer, which keeps the private
+    scope fallback in /rooms/{id}/messages off SQLite too). Rooms are evicted least-recently-used
+    once more than `max_rooms` are cached; an evicted room is simply reloaded on its next read.
+    """
+
+    def __init__(self, size=CHAT_CACHE_SIZE, max_rooms=CHAT_CACHE_ROOMS):
+        self.size = max(1, size)
+        self.max_rooms = max(1, max_rooms)
+        self._rooms = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def append(self, room, msg):
+        entry = self._rooms.get(room)
+        if entry is None:
+            # not cached yet: leave it cold, the next read loads it (including this message) from the db/queue
+            return
+        buf = entry[0]
+        if len(buf) == buf.maxlen:
+            entry[1] = False
+        buf.append(msg)
+        self._rooms.move_to_end(room)
+
+    def clear(self, rooms):
+        """Forget history for `rooms`; they are cached as known-empty since their rows are being purged."""
+        for room in rooms:
+            self._store(room, [], True)
+
+    def forget(self, room):
+        self._rooms.pop(room, None)
+
+    def recent(self, room, limit):
+        """Return (messages, has_more) for the newest `limit` messages, or None on a cold miss."""
+        entry = self._rooms.get(room)
+        if entry is None or limit > self.size:
+            self.misses += 1
+            return None
+        buf, complete = entry
+        self.hits += 1
+        self._rooms.move_to_end(room)
+        if limit >= len(buf):
+            return list(buf), not complete
+        return list(buf)[-limit:], True
+
+    def load(self, room):
+        """Fill the cache for `room` from SQLite (plus anything still queued for write)."""
+        msgs, has_more = get_messages_page(room, limit=self.size)
+        self._store(room, msgs, not has_more)
+
+    def _store(self, room, msgs, complete):
+        self._rooms[room] = [deque(msgs, maxlen=self.size), complete]
+        self._rooms.move_to_end(room)
+        while len(self._rooms) > self.max_rooms:
+            self._rooms.popitem(last=False)
+
+    def cached(self, room):
+        """Messages held for `room` (None when it is not cached)."""
+        entry = self._rooms.get(room)
+        return len(entry[0]) if entry is not None else None
+
+    def stats(self):
+        return {
+            'rooms': len(self._rooms),
+            'size': self.size,
+            'max_rooms': self.max_rooms,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+message_cache = RecentMessageCache()
+
+
+def record_message(room, message):
+    """Persist a chat message (write-behind) and push it into the room's hot cache."""
+    message_writer.enqueue(room, message)
+    message_cache.append(room, dict(zip(MESSAGE_COLUMNS, _message_row(room, message))))
+
+
+def retire_chat_history(rooms):
+    """End the current chat epoch for `rooms` so their history disappears immediately.
+
+    This is O(1) per room regardless of how many messages it holds: readers switch to the new
+    epoch at once and the old rows are deleted later by the compactor.
+    """
+    retirements = []
+    for room in rooms:
+        old_epoch = chat_epoch(room)
+        _chat_epochs[room] = old_epoch + 1
+        retirements.append((room, old_epoch, old_epoch + 1))
+    message_writer.retire(retirements)
+    message_cache.clear(rooms)
+
+
+# background retention: how long an inactive room's chat is kept, how often the compactor runs,
+# how many rows it deletes per transaction and how many free pages it releases per pass
+CHAT_RETENTION_SECONDS = int(os.environ.get('CHAT_RETENTION_SECONDS', 7 * 24 * 3600))
+CHAT_COMPACT_INTERVAL = float(os.environ.get('CHAT_COMPACT_INTERVAL', 600))
+CHAT_COMPACT_BATCH = int(os.environ.get('CHAT_COMPACT_BATCH', 2000))
+CHAT_VACUUM_PAGES = int(os.environ.get('CHAT_VACUUM_PAGES', 1000))
+
+
+def _base_room(room):
+    for suffix in ('__killers', '__doctors'):
+        if room.endswith(suffix):
+            return room[:-len(suffix)]
+    return room
+
+
+def _delete_rows_batch(cur, where, params, batch):
+    cur.execute(f'DELETE FROM messages WHERE rowid IN (SELECT rowid FROM messages WHERE {where} LIMIT ?)', (*params, batch))
+    return cur.rowcount
+
+
+@_timed_db('compact')
+def compact_retired_batch(batch=CHAT_COMPACT_BATCH):
+    """Delete up to `batch` rows belonging to retired epochs. Returns the number of rows deleted."""
     conn = get_db_conn()
-    cur = conn.cursor()
-    cur.execute('INSERT OR REPLACE INTO messages (id, room, sender_id, sender_name, text, ts) VALUES (?, ?, ?, ?, ?, ?)', (
-        str(message.get('id')), room, str(message.get('from', {}).get('id')), message.get('from', {}).get('name'), message.get('text'), int(message.get('ts') or time.time())
-    ))
-    conn.commit()
-    conn.close()
+    deleted = 0
+    try:
+        cur = conn.cursor()
+        for room, epoch in cur.execute('SELECT room, epoch FROM chat_retired ORDER BY retired_at LIMIT 50').fetchall():
+            n = _delete_rows_batch(cur, 'room = ? AND epoch <= ?', (room, epoch), batch - deleted)
+            deleted += n
+            if deleted >= batch:
+                break
+            # fewer rows than asked for: this epoch is fully gone
+            cur.execute('DELETE FROM chat_retired WHERE room = ? AND epoch = ?', (room, epoch))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return deleted
 
 
-def get_recent_messages(room, limit=50):
+@_timed_db('expire')
+def expire_idle_rooms_batch(cutoff, live_rooms, batch=CHAT_COMPACT_BATCH):
+    """Delete chat of rooms idle since before `cutoff` (unless still live). Returns (rows deleted, rooms dropped)."""
     conn = get_db_conn()
-    cur = conn.cursor()
-    cur.execute('SELECT id, room, sender_id, sender_name, text, ts FROM messages WHERE room = ? ORDER BY ts DESC LIMIT ?', (room, limit))
-    rows = cur.fetchall()
-    conn.close()
-    # return newest-first reversed to chronological
-    return [dict(r) for r in reversed(rows)]
+    deleted = 0
+    dropped = []
+    try:
+        cur = conn.cursor()
+        for (room,) in cur.execute('SELECT room FROM chat_rooms WHERE last_active < ? ORDER BY last_active LIMIT 50', (cutoff,)).fetchall():
+            if _base_room(room) in live_rooms:
+                continue
+            n = _delete_rows_batch(cur, 'room = ?', (room,), batch - deleted)
+            deleted += n
+            if deleted >= batch:
+                break
+            cur.execute('DELETE FROM chat_rooms WHERE room = ? AND last_active < ?', (room, cutoff))
+            cur.execute('DELETE FROM chat_retired WHERE room = ?', (room,))
+            dropped.append(room)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return deleted, dropped
+
+
+@_timed_db('vacuum')
+def incremental_vacuum(pages=CHAT_VACUUM_PAGES):
+    """Release up to `pages` free pages back to the filesystem. Returns the number released."""
+    conn = get_db_conn()
+    free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    if not free:
+        return 0
+    # executescript steps the pragma to completion; execute() would only release a single page
+    conn.executescript(f'PRAGMA incremental_vacuum({int(pages)});')
+    return free - conn.execute('PRAGMA freelist_count').fetchone()[0]
+
+
+class ChatCompactor:
+    """Background retention job: deletes retired game epochs and idle rooms' chat in small batches.
+
+    Every `interval` seconds it drains retired epochs, then expires rooms idle for longer than
+    `retention` seconds, one bounded transaction at a time on a worker thread, and finally runs
+    an incremental VACUUM step so chat.db shrinks instead of growing without bound.
+    """
+
+    def __init__(self, retention=CHAT_RETENTION_SECONDS, interval=CHAT_COMPACT_INTERVAL, batch=CHAT_COMPACT_BATCH, vacuum_pages=CHAT_VACUUM_PAGES):
+        self.retention = retention
+        self.interval = interval
+        self.batch = max(1, batch)
+        self.vacuum_pages = vacuum_pages
+        self._task = None
+        self.runs = 0
+        self.rows_deleted = 0
+        self.rooms_expired = 0
+        self.pages_released = 0
+        self.last_run_ms = 0.0
+        self.errors = 0
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        task, self._task = self._task, None
+        if task and not task.done():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except Exception as e:
+                self.errors += 1
+                _log_chat.error('compaction pass failed', error=e)
+
+    async def run_once(self):
+        started = time.perf_counter()
+        while True:
+            n = await asyncio.to_thread(compact_retired_batch, self.batch)
+            self.rows_deleted += n
+            if n < self.batch:
+                break
+        cutoff = int(time.time()) - self.retention
+        while True:
+            live = set(_rooms)
+            n, dropped = await asyncio.to_thread(expire_idle_rooms_batch, cutoff, live, self.batch)
+            self.rows_deleted += n
+            self.rooms_expired += len(dropped)
+            for room in dropped:
+                _chat_epochs.pop(room, None)
+                message_cache.forget(room)
+            if n < self.batch and len(dropped) < 50:
+                break
+        if self.vacuum_pages:
+            self.pages_released += await asyncio.to_thread(incremental_vacuum, self.vacuum_pages)
+        self.runs += 1
+        self.last_run_ms = (time.perf_counter() - started) * 1000
+
+    def stats(self):
+        return {
+            'retention_seconds': self.retention,
+            'interval': self.interval,
+            'runs': self.runs,
+            'rows_deleted': self.rows_deleted,
+            'rooms_expired': self.rooms_expired,
+            'pages_released': self.pages_released,
+            'last_run_ms': round(self.last_run_ms, 3),
+            'errors': self.errors,
+        }
+
+
+chat_compactor = ChatCompactor()
+
+
+# rows fetched per step of an export cursor, and how many exports may stream at once
+EXPORT_CHUNK_ROWS = int(os.environ.get('EXPORT_CHUNK_ROWS', 1000))
+EXPORT_CONCURRENCY = int(os.environ.get('EXPORT_CONCURRENCY', 2))
+_export_slots = None
+
+
+def _export_queries(room=None, scope=None, since=None, until=None, include_retired=False):
+    """(sql, params) statements for an export, each already in index order so SQLite never sorts."""
+    cols = 'id, room, sender_id, sender_name, text, ts, epoch'
+    bounds, bound_params = '', []
+    if since is not None:
+        bounds += ' AND ts >= ?'
+        bound_params.append(int(since))
+    if until is not None:
+        bounds += ' AND ts <= ?'
+        bound_params.append(int(until))
+    if room is None:
+        # time range across every room, walked via idx_messages_ts
+        sql = f'SELECT {cols} FROM messages WHERE 1 = 1{bounds} ORDER BY ts, id'
+        return [(sql, bound_params)]
+    scoped = {'public': [room], 'killers': [f"{room}__killers"], 'doctors': [f"{room}__doctors"]}
+    queries = []
+    # one namespace at a time so each statement is a single range scan of idx_messages_room_epoch_ts
+    for r in scoped.get(scope) or [room, f"{room}__killers", f"{room}__doctors"]:
+        if include_retired:
+            sql = f'SELECT {cols} FROM messages WHERE room = ?{bounds} ORDER BY epoch, ts, id'
+            queries.append((sql, [r, *bound_params]))
+        else:
+            sql = f'SELECT {cols} FROM messages WHERE room = ? AND epoch = ?{bounds} ORDER BY ts, id'
+            queries.append((sql, [r, chat_epoch(r), *bound_params]))
+    return queries
+
+
+async def stream_ndjson(queries, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Yield NDJSON chunks for `queries` from a server-side cursor, in constant memory.
+
+    The export gets its own read-only connection (so it reads one consistent snapshot and never
+    ties up a pooled connection) and each `fetchmany` step runs on a worker thread, one at a
+    time, so the loop is never blocked and at most `chunk_rows` rows are held in memory.
+    """
+    global _export_slots
+    if _export_slots is None:
+        _export_slots = asyncio.Semaphore(EXPORT_CONCURRENCY)
+    async with _export_slots:
+        conn = await asyncio.to_thread(sqlite3.connect, f"file:{DB_PATH}?mode=ro", uri=True, check_same_thread=False)
+        try:
+            # one read transaction for the whole export so every statement sees the same snapshot
+            await asyncio.to_thread(conn.execute, 'BEGIN')
+            for sql, params in queries:
+                cur = await asyncio.to_thread(conn.execute, sql, params)
+                names = [d[0] for d in cur.description]
+                while True:
+                    rows = await asyncio.to_thread(cur.fetchmany, chunk_rows)
+                    if not rows:
+                        break
+                    yield ''.join(json.dumps(dict(zip(names, row)), ensure_ascii=False, separators=(',', ':')) + '\n' for row in rows).encode()
+        finally:
+            await asyncio.to_thread(conn.close)
+
 
+# cap on a single page of search results
+MAX_SEARCH_PAGE = 100
 
-init_db()
+
+def _fts_query(q):
+    """Turn free text into an FTS5 query that matches all words (each quoted, so no syntax errors)."""
+    terms = [t.replace('"', '""') for t in q.split()]
+    return ' '.join(f'"{t}"' for t in terms if t)
+
+
+@_timed_db('search')
+def search_messages(q, room=None, scope=None, since=None, until=None, include_retired=False, limit=20, offset=0, raw=False):
+    """Ranked full-text search over stored chat, answered from the messages_fts index.
+
+    `room` restricts to one room; `scope` is 'public', 'killers', 'doctors' or None/'all'.
+    `since`/`until` bound the message ts. Only the current game's history is searched unless
+    `include_retired` is set. With `raw` the query is passed to FTS5 as-is (phrases, NEAR, prefix*).
+    Returns (results, has_more); results are best match first.
+    """
+    match = q if raw else _fts_query(q)
+    if not match:
+        return [], False
+    limit = max(1, min(int(limit), MAX_SEARCH_PAGE))
+    offset = max(0, int(offset))
+    where = ['messages_fts MATCH ?']
+    params = [match]
+    if room:
+        scoped = {'public': [room], 'killers': [f"{room}__killers"], 'doctors': [f"{room}__doctors"]}
+        rooms = scoped.get(scope) or [room, f"{room}__killers", f"{room}__doctors"]
+        where.append(f"m.room IN ({', '.join('?' * len(rooms))})")
+        params += rooms
+    elif scope in ('killers', 'doctors'):
+        where.append("m.room LIKE ? ESCAPE '\\'")
+        params.append(f"%\\_\\_{scope}")
+    elif scope == 'public':
+        where.append("m.room NOT LIKE ? ESCAPE '\\' AND m.room NOT LIKE ? ESCAPE '\\'")
+        params += ['%\\_\\_killers', '%\\_\\_doctors']
+    if since is not None:
+        where.append('m.ts >= ?')
+        params.append(int(since))
+    if until is not None:
+        where.append('m.ts <= ?')
+        params.append(int(until))
+    join = '' if include_retired else 'JOIN chat_rooms c ON c.room = m.room AND c.epoch = m.epoch'
+    sql = (
+        'SELECT m.id, m.room, m.sender_id, m.sender_name, m.text, m.ts, m.epoch, '
+        "bm25(messages_fts) AS score, snippet(messages_fts, 0, '[', ']', '…', 12) AS snippet "
+        f'FROM messages_fts JOIN messages m ON m.rowid = messages_fts.rowid {join} '
+        f"WHERE {' AND '.join(where)} ORDER BY score LIMIT ? OFFSET ?"
+    )
+    params += [limit + 1, offset]
+    rows = get_db_conn().execute(sql, params).fetchall()
+    results = [dict(r) for r in rows[:limit]]
+    return results, len(rows) > limit
+
+
+def get_recent_messages(room, limit=50):
+    """Chronological recent history, served from the hot cache; SQLite is only hit on a cold miss."""
+    return get_recent_messages_page(room, limit)[0]
+
+
+def get_recent_messages_page(room, limit=50):
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    cached = message_cache.recent(room, limit)
+    if cached is not None:
+        return cached
+    if limit > message_cache.size:
+        return get_messages_page(room, limit=limit)
+    message_cache.load(room)
+    return message_cache.recent(room, limit)
 
 
 # ----------------- Socket.IO server -----------------
 # Create an Async Socket.IO server and mount it on the FastAPI app via ASGI
-# Enable socketio/engineio logging to surface handshake details in uvicorn logs
-sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins='*', logger=True, engineio_logger=True)
+# (a shared state backend supplies a client manager so emits and room joins reach every worker).
+# socketio/engineio log a line per packet at INFO: they are the `socketio` / `engineio` log categories,
+# WARNING by default (LOG_LEVELS=engineio=info, or the older SOCKETIO_DEBUG=1, to troubleshoot handshakes)
+
+# Engine.IO transports accepted (SOCKETIO_TRANSPORTS=websocket|polling,websocket). Long-polling needs
+# every request of a session to reach the same worker, so serve.py sets websocket for several workers
+SOCKETIO_TRANSPORTS = [t.strip() for t in os.environ.get('SOCKETIO_TRANSPORTS', 'polling,websocket').split(',') if t.strip()]
+
+HANDLER_SECONDS = metrics.histogram('socketio_handler_seconds', 'Socket.IO event handling time, including the wait for the room mailbox', ('event',))
+STEP_SECONDS = metrics.histogram('game_step_seconds', 'Run time of game phase functions (timer callbacks and the steps they chain)', ('step',))
+EMITS = metrics.counter('socketio_emits_total', 'Socket.IO events emitted, by event name', ('event',))
+EMIT_BYTES = metrics.counter('socketio_emit_bytes_total', 'Encoded size of emitted events (counted once per emit, not per recipient)', ('event',))
+BLOCKED = metrics.counter('game_blocked_total', 'Chat messages and game actions refused', ('event',))
+
+
+class _MeteredPacket(socketio.packet.Packet):
+    """Socket.IO packet that counts outgoing events and their encoded size by event name.
+
+    A broadcast is encoded once for all its recipients, so this costs one lookup per emit.
+    """
+
+    def encode(self):
+        encoded = super().encode()
+        if self.packet_type in (socketio.packet.EVENT, socketio.packet.BINARY_EVENT) and self.data:
+            event = self.data[0]
+            # JSON is ASCII-escaped, so characters are bytes
+            size = len(encoded) if isinstance(encoded, str) else sum(len(part) for part in encoded)
+            EMITS.labels(event).inc()
+            EMIT_BYTES.labels(event).inc(size)
+        return encoded
+
+
+sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins='*', client_manager=state_backend.client_manager(),
+                           logger=logs.stdlib('socketio'), engineio_logger=logs.stdlib('engineio'), serializer=_MeteredPacket,
+                           transports=SOCKETIO_TRANSPORTS)
 socket_app = socketio.ASGIApp(sio, other_asgi_app=app)
 
 
-@sio.event
-async def connect(sid, environ, auth):
-    # Print helpful debug info for handshake troubleshooting
-    print('Socket connect:', sid)
+def _timed_step(fn):
+    """Record the decorated game phase function's run time in game_step_seconds{step}."""
+    child = STEP_SECONDS.labels(fn.__name__)
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        finally:
+            child.observe(time.perf_counter() - started)
+    return wrapper
+
+
+def _timed_handler(event, handler):
+    child = HANDLER_SECONDS.labels(event)
+
+    @functools.wraps(handler)
+    async def wrapper(*args):
+        started = time.perf_counter()
+        try:
+            return await handler(*args)
+        finally:
+            child.observe(time.perf_counter() - started)
+    return wrapper
+
+
+def _instrument_handlers():
+    """Time every registered Socket.IO handler in socketio_handler_seconds{event}."""
+    handlers = sio.handlers.get('/', {})
+    for event, handler in list(handlers.items()):
+        handlers[event] = _timed_handler(event, handler)
+
+
+async def _emit_blocked(event, message, sid):
+    """Tell `sid` that its chat message (`chat_blocked`) or action (`action_blocked`) was refused."""
+    BLOCKED.labels(event).inc()
+    await sio.emit(event, {'message': message}, room=sid)
+
+
+def _get_or_create_room(room: str) -> RoomState:
+    state = _rooms.get(room)
+    if state is None:
+        state = _rooms[room] = RoomState(room)
+        _attach_journal(state)
+    return state
+
+
+def _attach_journal(state: RoomState):
+    """Report the room's mutations to the game journal, or with a shared backend republish its record."""
+    if game_journal.is_open:
+        state.journal = game_journal.record
+    elif state_backend.shared:
+        state.journal = _record_changed
+
+
+def _record_changed(room, op, args):
+    _publish_record(room)
+
+
+def _publish_record(room):
+    state_backend.publish_record(room, functools.partial(_room_record, room))
+
+
+def _room_record(room):
+    """What the worker that takes `room` over needs (see `_adopt_room`), or None once the room is gone.
+
+    The room's `to_record()`, its pending game deadlines as the journal keeps them, and per player
+    the sockets connected through other workers: the ones on this worker go away with it.
+    """
+    state = _rooms.get(room)
+    if state is None or not _room_is_live(state):
+        return None
+    timers = {timer.kind: [_timer_due_ms(timer), timer.callback.__name__, list(timer.args[1:])]
+              for timer in scheduler.timers(room)
+              if _phase_steps.get(getattr(timer.callback, '__name__', None)) is timer.callback}
+    sids = {}
+    for p in state.players.values():
+        remote = [sid for sid in p.sids if not sio.manager.is_connected(sid, '/')]
+        if remote:
+            sids[p.id] = remote
+    return {'state': state.to_record(), 'timers': timers, 'sids': sids}
+
+
+def _adopt_room(room, record):
+    """Carry on with a room taken over from a worker that stopped or crashed, from its last record."""
     try:
-        # environ is the WSGI/ASGI environ - print common fields
-        remote = environ.get('REMOTE_ADDR') or environ.get('REMOTE_HOST')
-        origin = None
-        # headers may be bytes tuples depending on server; attempt to extract
-        headers = environ.get('headers') or environ.get('HTTP_HEADERS') or []
-        # Try to find origin header
-        for h in headers:
-            try:
-                # h might be a (b'name', b'value') tuple
-                if isinstance(h, (list, tuple)) and len(h) >= 2:
-                    name = h[0].decode() if isinstance(h[0], bytes) else str(h[0])
-                    val = h[1].decode() if isinstance(h[1], bytes) else str(h[1])
-                    if name.lower() == 'origin':
-                        origin = val
-            except Exception:
-                continue
-        print(f"  remote={remote} origin={origin}")
-        # Print a small subset of headers for visibility
-        head_preview = []
-        for h in headers[:10]:
-            try:
-                k = h[0].decode() if isinstance(h[0], bytes) else str(h[0])
-                v = h[1].decode() if isinstance(h[1], bytes) else str(h[1])
-                head_preview.append(f"{k}: {v}")
-            except Exception:
-                continue
-        if head_preview:
-            print('  headers:', head_preview)
+        state = RoomState.from_record(record['state'])
     except Exception as e:
-        print('  connect debug error:', e)
+        _log_game.error('could not rebuild room', room=room, error=e)
+        return
+    _install_room(state, record.get('timers') or {}, record.get('sids') or {})
+    _publish_record(room)
+    _log_game.info('room taken over', room=room, in_game=state.in_game, players=len(state.players))
 
 
-@sio.event
-async def disconnect(sid):
-    print('Socket disconnect:', sid)
-    # Attempt to remove the sid mapping and, if this was the player's last connection, remove them from the room
-    removed = False
-    try:
-        session = await sio.get_session(sid)
-    except Exception:
-        session = None
-    room = session.get('room') if session else None
-    player = session.get('player') if session else None
-
-    # Helper to finalize removal of a player from a room (actual deletion and emits)
-    async def _finalize_removal(room, pid, player_obj):
-        meta = _room_meta.setdefault(room, {})
-        # double-check no active sids exist for this pid
-        sids = meta.setdefault('player_sids', {})
-        lst = sids.get(pid) or []
-        if lst:
-            # player reconnected, do nothing
-            return False
-        players = _rooms.get(room, [])
-        _rooms[room] = [p for p in players if p.get('id') != pid]
-        sids.pop(pid, None)
-        # clean up any pending disconnect task entry
-        pending = meta.get('pending_disconnects', {})
-        pending.pop(pid, None)
+async def _emit_room_update(state: RoomState, players=None, skip_sid=None):
+    """Broadcast the room's pending changes as a versioned `room_patch` (or a full `room_state`)."""
+    event, payload = state.take_update(players=players)
+    if event is not None:
+        state_backend.publish_snapshot(state.room_id, state.snapshot)
+    if event == 'room_patch':
+        await sio.emit('room_patch', payload, room=state.room_id, skip_sid=skip_sid)
+    elif event == 'room_state':
+        await sio.emit('room_state', payload, room=state.room_id)
+
+
+async def _publish_room_update(state: RoomState, joiner=None):
+    """Roster-change variant of `_emit_room_update` that is coalesced per mailbox batch.
+
+    A burst of joins/leaves handled in one batch goes out as a single patch. `joiner` is a socket
+    that just joined: it is skipped by the patch and sent a full snapshot instead.
+    """
+    actor = room_actors.current(state.room_id)
+    if actor is None:
+        await _emit_room_update(state, skip_sid=joiner)
+        if joiner:
+            await sio.emit('room_state', state.snapshot(), room=joiner)
+        return
+    joiners = actor.deferred.setdefault('room_update', [])
+    if joiner:
+        joiners.append(joiner)
+
+
+async def _flush_deferred(room, deferred):
+    """Mailbox flush hook: publish what the batch's handlers deferred."""
+    joiners = deferred.get('room_update')
+    state = _rooms.get(room)
+    if joiners is None or state is None:
+        return
+    await _emit_room_update(state, skip_sid=joiners or None)
+    for sid in joiners:
+        await sio.emit('room_state', state.snapshot(), room=sid)
+
+
+# room calls other workers may forward to us, by function name
+_room_calls = {}
+
+
+def _forwardable(fn):
+    _room_calls[fn.__name__] = fn
+    return fn
+
+
+async def _room_owner(room):
+    """Id of the worker that runs `room`, leasing it to this worker if nobody holds it."""
+    if not state_backend.shared or room in _rooms:
+        return state_backend.worker_id
+    cached = _room_owners.get(room)
+    if cached is not None and cached[1] > time.monotonic():
+        return cached[0]
+    # events of a room arriving together wait for one claim, so a takeover is not raced by a fresh room
+    claim = _room_claims.get(room)
+    if claim is None:
+        claim = _room_claims[room] = asyncio.ensure_future(_claim_room(room))
+        claim.add_done_callback(lambda _: _room_claims.pop(room, None))
+    return await asyncio.shield(claim)
+
+
+async def _claim_room(room):
+    owner, record = await state_backend.claim_room(room)
+    if owner == state_backend.worker_id:
+        # another worker may have run the room (and retired its chat) since the epochs were loaded
+        _update_chat_epochs(await asyncio.to_thread(read_chat_epochs, [room, f'{room}__killers', f'{room}__doctors']))
+    if record is not None and room not in _rooms:
+        # the previous owner stopped or its lease lapsed: carry on from the record it left
+        _adopt_room(room, record)
+    _room_owners[room] = (owner, time.monotonic() + state_backend.lease / 3)
+    return owner
+
+
+async def _forward_room_call(owner, room, fn, *args):
+    await state_backend.send(f'worker:{owner}', {'room': room, 'fn': fn.__name__, 'args': list(args)})
+
+
+def _on_forwarded_call(message):
+    """Bus callback: run a room call another worker forwarded to us, in the room's mailbox."""
+    fn = _room_calls.get(message.get('fn'))
+    room = message.get('room')
+    if fn is None or not room or _drain_state == 'frozen':
+        return
+    room_actors.post(room, fn, *message.get('args', ()))
+
+
+def _on_rooms_released(message):
+    """Bus callback: a draining worker handed its rooms over; the next event of each claims it anew."""
+    worker = message.get('worker')
+    for room in message.get('rooms', ()):
+        cached = _room_owners.get(room)
+        if cached is not None and cached[0] == worker:
+            del _room_owners[room]
+
+
+def _room_handler(handler):
+    """Run a Socket.IO handler in the mailbox of the room named by `data['roomId']`.
+
+    When the room is run by another worker the event is forwarded there instead; the owner's
+    emits reach this worker's sockets through the client manager.
+    """
+    _forwardable(handler)
+
+    @functools.wraps(handler)
+    async def wrapper(sid, data):
+        room = data.get('roomId') if isinstance(data, dict) else None
+        if _drain_state == 'frozen':
+            # shutting down: the room has been snapshotted and its clients told to reconnect
+            return None
+        if not room:
+            return await handler(sid, data)
+        if not shards.is_local(room):
+            # the room is served by another shard: tell the client where to reconnect
+            await sio.emit('room_redirect', {'room': room, 'url': shards.url_for(room)}, room=sid)
+            return None
+        owner = await _room_owner(room)
+        if owner != state_backend.worker_id:
+            _forwarded_sids[sid] = room
+            await _forward_room_call(owner, room, handler, sid, data)
+            return None
+        return await room_actors.call(room, handler, sid, data)
+    return wrapper
+
+
+def _handshake_info(environ):
+    """(remote address, Origin header, first 10 headers as "name: value") from a connect environ."""
+    # environ is the WSGI/ASGI environ
+    remote = environ.get('REMOTE_ADDR') or environ.get('REMOTE_HOST')
+    origin = None
+    # headers may be bytes tuples depending on server; attempt to extract
+    headers = environ.get('headers') or environ.get('HTTP_HEADERS') or []
+    # Try to find origin header
+    for h in headers:
         try:
-            await sio.emit('player_left', {'player': player_obj}, room=room)
+            # h might be a (b'name', b'value') tuple
+            if isinstance(h, (list, tuple)) and len(h) >= 2:
+                name = h[0].decode() if isinstance(h[0], bytes) else str(h[0])
+                val = h[1].decode() if isinstance(h[1], bytes) else str(h[1])
+                if name.lower() == 'origin':
+                    origin = val
         except Exception:
-            pass
-        if meta.get('host_id') == pid:
-            remaining = _rooms.get(room, [])
-            meta['host_id'] = remaining[0].get('id') if remaining else None
+            continue
+    # a small subset of headers for visibility
+    head_preview = []
+    for h in headers[:10]:
         try:
-            # include alive role member lists for client-facing convenience
-            players = _rooms.get(room, [])
-            assigned = meta.get('assigned_roles', {})
-            eliminated = meta.get('eliminated', {}) or {}
-            alive = [p for p in players if not eliminated.get(p.get('id'))]
-            alive_role_members = {}
-            for p in alive:
-                r = assigned.get(p.get('id')) or 'Civilian'
-                alive_role_members.setdefault(r, []).append({'id': p.get('id'), 'name': p.get('name')})
-            role_counts = {k: len(v) for k, v in alive_role_members.items()}
-            await sio.emit('room_state', {'players': players, 'host_id': meta.get('host_id'), 'eliminated': meta.get('eliminated', {}), 'alive_role_members': alive_role_members, 'role_counts': role_counts}, room=room)
+            k = h[0].decode() if isinstance(h[0], bytes) else str(h[0])
+            v = h[1].decode() if isinstance(h[1], bytes) else str(h[1])
+            head_preview.append(f"{k}: {v}")
         except Exception:
-            pass
-        return True
+            continue
+    return remote, origin, head_preview
 
-    if room and player:
-        pid = player.get('id')
+
+@sio.event
+async def connect(sid, environ, auth):
+    if _drain_state is not None:
+        raise socketio.exceptions.ConnectionRefusedError({'reconnect_after_ms': DRAIN_RECONNECT_MS})
+    if shards.enabled:
+        # clients name their room in the handshake (`?room=` or auth.roomId); refuse with the owner's URL
+        room = (auth or {}).get('roomId') if isinstance(auth, dict) else None
+        room = room or (parse_qs(environ.get('QUERY_STRING') or '').get('room') or [None])[0]
+        if room and not shards.is_local(room):
+            raise socketio.exceptions.ConnectionRefusedError({'redirect': shards.url_for(room), 'room': room})
+    # the handshake headers are only scanned when the line is going to be written
+    if _log_connect.sample(logging.INFO):
         try:
-            # remove this sid from the player's sid list
-            meta = _room_meta.setdefault(room, {})
-            sids = meta.setdefault('player_sids', {})
-            lst = sids.get(pid) or []
-            if sid in lst:
-                try:
-                    lst.remove(sid)
-                except ValueError:
-                    pass
-            meta['player_sids'][pid] = lst
-            # if no more sids, schedule a delayed finalize to allow quick reconnects
-            if not lst:
-                pending = meta.setdefault('pending_disconnects', {})
-                if pid not in pending:
-                    async def _delayed():
-                        try:
-                            await asyncio.sleep(GRACE_SECONDS)
-                            # re-check and finalize
-                            await _finalize_removal(room, pid, player)
-                        except asyncio.CancelledError:
-                            # cancelled because player rejoined
-                            return
-                        except Exception:
-                            return
-                    task = asyncio.create_task(_delayed())
-                    pending[pid] = task
-                    print(f"Scheduled removal for player {pid} in room {room} in {GRACE_SECONDS}s")
-        except Exception:
-            removed = False
+            remote, origin, head_preview = _handshake_info(environ)
+            fields = {'sid': sid, 'remote': remote, 'origin': origin}
+            if _log_connect.enabled(logging.DEBUG):
+                fields['headers'] = head_preview
+            _log_connect.emit(logging.INFO, 'socket connected', fields)
+        except Exception as e:
+            _log_connect.warning('could not read handshake', sid=sid, error=e)
+
+
+async def _finalize_removal(room, pid, player_obj):
+    """Remove a disconnected player once their grace period expires (unless they reconnected)."""
+    state = _rooms.get(room)
+    if state is None:
+        return False
+    player = state.get_player(pid)
+    # double-check no active sids exist for this pid
+    if player is not None and player.sids:
+        # player reconnected, do nothing
+        return False
+    # clean up any pending grace timer (when finalizing early)
+    scheduler.cancel(room, _grace_kind(pid))
+    # removing the host promotes the next player
+    state.remove_player(pid)
+    try:
+        await sio.emit('player_left', {'player': player_obj}, room=room)
+    except Exception:
+        pass
+    try:
+        await _publish_room_update(state)
+    except Exception:
+        pass
+    _release_if_empty(state)
+    return True
 
-    # If not removed via session, search all rooms for the sid in player_sids lists
-    if not removed:
-        for r, meta in list(_room_meta.items()):
-            try:
-                sids = meta.get('player_sids', {})
-                for pid, sid_list in list(sids.items()):
-                    if sid in (sid_list or []):
-                        # find player object from _rooms
-                        players = _rooms.get(r, [])
-                        player_obj = next((p for p in players if p.get('id') == pid), {'id': pid, 'name': None})
-                        # remove this sid from the list
-                        lst = sid_list or []
-                        if sid in lst:
-                            try:
-                                lst.remove(sid)
-                            except ValueError:
-                                pass
-                        meta['player_sids'][pid] = lst
-                        # if empty, schedule delayed finalize if not already scheduled
-                        if not lst:
-                            pending = meta.setdefault('pending_disconnects', {})
-                            if pid not in pending:
-                                async def _delayed_r(rm, p, pobj):
-                                    try:
-                                        await asyncio.sleep(GRACE_SECONDS)
-                                        await _finalize_removal(rm, p, pobj)
-                                    except asyncio.CancelledError:
-                                        return
-                                    except Exception:
-                                        return
-                                task = asyncio.create_task(_delayed_r(r, pid, player_obj))
-                                pending[pid] = task
-                                print(f"Scheduled removal for player {pid} in room {r} in {GRACE_SECONDS}s")
-                        break
-                if removed:
-                    break
-            except Exception:
-                continue
 
+def _grace_kind(pid):
+    return f'grace:{pid}'
+
+
+def _schedule_removal(state: RoomState, pid, player_obj, delay=None):
+    """Start the grace window (GRACE_SECONDS unless `delay` is given) after a player's last socket dropped."""
+    room = state.room_id
+    kind = _grace_kind(pid)
+    if scheduler.is_pending(room, kind):
+        return
+    delay = GRACE_SECONDS if delay is None else delay
+    scheduler.call_later(room, kind, delay, _finalize_removal, room, pid, player_obj)
+    _log_lobby.info('removal scheduled', room=room, player=pid, delay=delay)
+
+
+def _bind_sid(sid, state: RoomState, player):
+    """Record `sid` as one of `player`'s sockets, releasing any seat it held before."""
+    key = (state.room_id, player.id)
+    if _sid_index.get(sid) != key:
+        _release_sid(sid)
+        _sid_index[sid] = key
+    player.sids.add(sid)
+
+
+@_forwardable
+def _release_sid(sid):
+    """Forget `sid`; start the grace window if it was its player's last socket. Returns the room id."""
+    entry = _sid_index.pop(sid, None)
+    if entry is None:
+        return None
+    room, pid = entry
+    state = _rooms.get(room)
+    p = state.get_player(pid) if state else None
+    if p is not None:
+        p.sids.discard(sid)
+        # if no more sids, schedule a delayed finalize to allow quick reconnects
+        if not p.sids:
+            _schedule_removal(state, p.id, p.data)
+    return room
+
+
+@sio.event
+async def disconnect(sid, reason=None):
+    _log_connect.info('socket disconnected', sid=sid, reason=reason)
+    if _drain_state == 'frozen':
+        # disconnected by drain(): keep the seat, the next process restores it
+        return
+    # if this was the player's last connection, they are removed from the room after the grace window
+    entry = _sid_index.get(sid)
+    room = await room_actors.call(entry[0], _release_sid, sid) if entry else None
+    forwarded = _forwarded_sids.pop(sid, None)
+    if room is None and forwarded:
+        # the socket's room runs on another worker, which holds its sid mapping
+        owner = await _room_owner(forwarded)
+        if owner != state_backend.worker_id:
+            await _forward_room_call(owner, forwarded, _release_sid, sid)
     try:
         # best-effort leave any rooms this sid may still be in
-        sio.leave_room(sid, room or '')
+        await sio.leave_room(sid, room or '')
     except Exception:
         pass
 
 
 @sio.on('join_room')
+@_room_handler
 async def handle_join(sid, data):
     room = data.get('roomId')
     player = data.get('player')
     if not room or not player:
         return
-    meta = _room_meta.setdefault(room, {})
+    if _drain_state is not None:
+        await sio.emit('join_rejected', {'message': 'Server is restarting, reconnecting shortly',
+                                         'reconnect_after_ms': DRAIN_RECONNECT_MS}, room=sid)
+        return
+    state = _get_or_create_room(room)
+    # players of a running game may come back (reconnect, server restart)
+    returning = state.in_game and state.get_player(player.get('id')) is not None
     # If a game is already in progress, reject new joins (per new rules)
-    if meta.get('in_game'):
+    if state.in_game and not returning:
         try:
             await sio.emit('join_rejected', {'message': 'Game already in progress'}, room=sid)
         except Exception:
             pass
         return
-    # add player to in-memory room list
-    lst = _rooms.setdefault(room, [])
-    # avoid duplicates
-    if not any(p.get('id') == player.get('id') for p in lst):
-        lst.append(player)
-    # ensure room metadata exists
-    meta = _room_meta.setdefault(room, {})
+    # add player to the room roster (duplicates are ignored)
+    p = state.add_player(player)
+    pid = p.id
     # cancel any pending disconnect removal for this player (they reconnected)
+    scheduler.cancel(room, _grace_kind(pid))
+    # track every sid of the player so we can support multiple tabs per player
+    if pid:
+        _bind_sid(sid, state, p)
+    # if no host assigned yet, the first player becomes host
+    if not state.host_id:
+        state.set_host(pid)
     try:
-        pid = player.get('id')
-        pending = meta.get('pending_disconnects', {})
-        if pid and pending and pid in pending:
-            task = pending.pop(pid, None)
-            if task:
-                try:
-                    task.cancel()
-                except Exception:
-                    pass
-    except Exception:
-        pass
-    # map player id -> list of sids so we can support multiple tabs per player
-    sids = meta.setdefault('player_sids', {})
-    try:
-        pid = player.get('id')
-        if pid:
-            lst = sids.setdefault(pid, [])
-            if sid not in lst:
-                lst.append(sid)
-            sids[pid] = lst
-    except Exception:
+        await sio.save_session(sid, {'room': room, 'player': player})
+    except KeyError:
+        # the socket is connected to another worker (this event was forwarded): no local session
         pass
-    # if no host assigned yet, the first player becomes host
-    if not meta.get('host_id'):
-        meta['host_id'] = player.get('id')
-    await sio.save_session(sid, {'room': room, 'player': player})
     await sio.enter_room(sid, room)
     # broadcast to room
     await sio.emit('player_joined', {'player': player}, room=room)
-    # also emit a room_state update (players + host)
-    # include alive role members in room_state updates
-    try:
-        players = _rooms.get(room, [])
-        assigned = meta.get('assigned_roles', {})
-        eliminated = meta.get('eliminated', {}) or {}
-        alive = [p for p in players if not eliminated.get(p.get('id'))]
-        alive_role_members = {}
-        for p in alive:
-            r = assigned.get(p.get('id')) or 'Civilian'
-            alive_role_members.setdefault(r, []).append({'id': p.get('id'), 'name': p.get('name')})
-        role_counts = {k: len(v) for k, v in alive_role_members.items()}
-        await sio.emit('room_state', {'players': players, 'host_id': meta.get('host_id'), 'eliminated': meta.get('eliminated', {}), 'alive_role_members': alive_role_members, 'role_counts': role_counts}, room=room)
-    except Exception:
-        try:
-            await sio.emit('room_state', {'players': _rooms.get(room, []), 'host_id': meta.get('host_id'), 'eliminated': meta.get('eliminated', {})}, room=room)
-        except Exception:
-            pass
+    # existing members get the delta; the joining socket gets a full versioned snapshot
+    await _publish_room_update(state, joiner=sid)
+    if returning:
+        await _resume_player(sid, state, p)
+
+
+async def _resume_player(sid, state: RoomState, player):
+    """Bring a socket rejoining a running game up to date: its role, team chat and the current phase timer."""
+    role = player.role
+    if role:
+        await sio.emit('your_role', {'role': role, 'description': ROLE_DESCRIPTIONS.get(role)}, room=sid)
+    team_room = state.killer_room if role == 'Killer' else state.doctor_room if role == 'Doctor' else None
+    if team_room:
+        await sio.enter_room(sid, team_room)
+    if state.phase_info:
+        await sio.emit('phase', state.phase_info, room=sid)
+
+
+@sio.on('request_room_state')
+@_room_handler
+async def handle_request_room_state(sid, data):
+    """Send a full room_state snapshot to a client that saw a gap in room_patch versions."""
+    state = _rooms.get((data or {}).get('roomId'))
+    if state is None:
+        return
+    await sio.emit('room_state', state.snapshot(), room=sid)
 
 
 @sio.on('time_sync')
@@ -343,42 +1597,33 @@ async def handle_time_sync(sid, data):
     Client should compute RTT and clock offset using the round-trip measurement.
     """
     try:
-        now = int(time.time() * 1000)
+        now = int(clock.time() * 1000)
         await sio.emit('time_sync_response', {'server_ts': now}, room=sid)
     except Exception:
         pass
 
 
 @sio.on('leave_room')
+@_room_handler
 async def handle_leave(sid, data):
     room = data.get('roomId')
     player = data.get('player')
     if room and player:
-        lst = _rooms.get(room, [])
-        _rooms[room] = [p for p in lst if p.get('id') != player.get('id')]
-        sio.leave_room(sid, room)
+        state = _rooms.get(room)
+        if state is not None:
+            # removing the host promotes the next player
+            p = state.remove_player(player.get('id'))
+            for psid in p.sids if p is not None else ():
+                _sid_index.pop(psid, None)
+        await sio.leave_room(sid, room)
         await sio.emit('player_left', {'player': player}, room=room)
-        # update room metadata: if host left, promote next player (if any)
-        meta = _room_meta.get(room, {})
-        if meta.get('host_id') == player.get('id'):
-            remaining = _rooms.get(room, [])
-            meta['host_id'] = remaining[0].get('id') if remaining else None
-            try:
-                players = _rooms.get(room, [])
-                assigned = meta.get('assigned_roles', {})
-                eliminated = meta.get('eliminated', {}) or {}
-                alive = [p for p in players if not eliminated.get(p.get('id'))]
-                alive_role_members = {}
-                for p in alive:
-                    r = assigned.get(p.get('id')) or 'Civilian'
-                    alive_role_members.setdefault(r, []).append({'id': p.get('id'), 'name': p.get('name')})
-                role_counts = {k: len(v) for k, v in alive_role_members.items()}
-                await sio.emit('room_state', {'players': players, 'host_id': meta.get('host_id'), 'eliminated': meta.get('eliminated', {}), 'alive_role_members': alive_role_members, 'role_counts': role_counts}, room=room)
-            except Exception:
-                await sio.emit('room_state', {'players': _rooms.get(room, []), 'host_id': meta.get('host_id')}, room=room)
+        if state is not None:
+            await _publish_room_update(state)
+            _release_if_empty(state)
 
 
 @sio.on('send_message')
+@_room_handler
 async def handle_message(sid, data):
     room = data.get('roomId')
     message = data.get('message')
@@ -386,20 +1631,21 @@ async def handle_message(sid, data):
     scope = data.get('scope') or 'public'
     if not room or not message:
         return
-    meta = _room_meta.get(room, {})
-    phase = meta.get('phase')
+    state = _rooms.get(room)
+    phase = state.phase if state else None
 
-    # block messaging from eliminated players
     try:
         sender_id = message.get('from', {}).get('id')
-        if sender_id and meta.get('eliminated', {}).get(sender_id):
-            try:
-                await sio.emit('chat_blocked', {'message': 'You are dead and cannot send messages.'}, room=sid)
-            except Exception:
-                pass
-            return
     except Exception:
-        pass
+        sender_id = None
+
+    # block messaging from eliminated players
+    if sender_id and state and state.is_eliminated(sender_id):
+        try:
+            await _emit_blocked('chat_blocked', 'You are dead and cannot send messages.', sid)
+        except Exception:
+            pass
+        return
 
     # Night restrictions: all chat (public and private) is closed during explicit night phases
     night_phases = ('night_start', 'killer', 'doctor', 'pre_night')
@@ -407,36 +1653,30 @@ async def handle_message(sid, data):
         # Only block public chat during explicit night phases; allow scoped team chat (killers/doctors)
         if scope == 'public':
             try:
-                await sio.emit('chat_blocked', {'message': 'Public chat is closed during the night phase.'}, room=sid)
+                await _emit_blocked('chat_blocked', 'Public chat is closed during the night phase.', sid)
             except Exception:
                 pass
             return
 
     # handle scoped/team messages separately: killers/doctors private rooms
-    try:
-        sender_id = message.get('from', {}).get('id')
-    except Exception:
-        sender_id = None
-
     if scope in ('killers', 'doctors'):
         # only allow players with the matching assigned role to send scoped messages
-        assigned = meta.get('assigned_roles', {})
         required_role = 'Killer' if scope == 'killers' else 'Doctor'
-        if not sender_id or assigned.get(sender_id) != required_role:
+        if not sender_id or not state or state.role_of(sender_id) != required_role:
             try:
-                await sio.emit('chat_blocked', {'message': 'You are not authorized to send to that team chat.'}, room=sid)
+                await _emit_blocked('chat_blocked', 'You are not authorized to send to that team chat.', sid)
             except Exception:
                 pass
             return
-        # determine canonical private room name (persist there even if meta hasn't stored it yet)
+        # determine canonical private room name (persist there even if state hasn't stored it yet)
         canonical_private = f"{room}__killers" if scope == 'killers' else f"{room}__doctors"
         # persist private message under the canonical private room namespace so it can be fetched later
         try:
-            save_message(canonical_private, message)
+            record_message(canonical_private, message)
         except Exception:
             pass
         # emit to the socket.io private room if server has registered it, else emit to the canonical room
-        private_room = meta.get('killer_room') if scope == 'killers' else meta.get('doctor_room')
+        private_room = state.killer_room if scope == 'killers' else state.doctor_room
         emit_room = private_room or canonical_private
         try:
             await sio.emit('new_message', {'message': message}, room=emit_room)
@@ -446,51 +1686,38 @@ async def handle_message(sid, data):
 
     # Daytime or public messages: save and broadcast publicly
     try:
-        save_message(room, message)
+        record_message(room, message)
     except Exception:
         pass
     await sio.emit('new_message', {'message': message}, room=room)
 
 
 def _assign_roles_to_players(players, settings, seed=None):
-    import random
-    rnd = random.Random(seed)
-    total_players = len(players)
-    roles = []
-    # Add killers
-    k = int(settings.get('killCount', 1)) if settings else 1
-    roles += ['Killer'] * min(k, total_players)
-    # Doctors
-    d = int(settings.get('doctorCount', 0)) if settings else 0
-    roles += ['Doctor'] * min(d, max(0, total_players - len(roles)))
-    # Detectives
-    det = int(settings.get('detectiveCount', 0)) if settings else 0
-    roles += ['Detective'] * min(det, max(0, total_players - len(roles)))
-    # Remaining civilians
-    remaining = total_players - len(roles)
-    roles += ['Civilian'] * max(0, remaining)
-    rnd.shuffle(roles)
-    assigned = []
-    for p, r in zip(players, roles):
-        np = dict(p)
-        np['role'] = r
-        assigned.append(np)
-    return assigned
+    return engine.assign_roles(players, settings, random.Random(seed))
+
+
+ROLE_DESCRIPTIONS = {
+    'Killer': 'Secretly selects one player to eliminate each night. Killers know each other and coordinate in private chat.',
+    'Doctor': 'Each night chooses one player to protect from being eliminated. If you save the targeted player, they survive the night.',
+    'Detective': 'Can investigate one player to learn if they are a Killer. Use this information wisely and avoid revealing too early.',
+    'Civilian': 'No special powers. Participate in discussion and voting to identify Killers.'
+}
 
 
 @sio.on('set_settings')
+@_room_handler
 async def handle_set_settings(sid, data):
     room = data.get('roomId')
     settings = data.get('settings')
     if not room or not isinstance(settings, dict):
         return
-    meta = _room_meta.setdefault(room, {})
+    state = _get_or_create_room(room)
     # ensure only the current host can change settings
     try:
-        session = await sio.get_session(sid)
-        player = session.get('player') if session else None
-        pid = player.get('id') if player else None
-        if pid and meta.get('host_id') and pid != meta.get('host_id'):
+        # the sid index (kept by the worker running the room) says which player this socket is
+        entry = _sid_index.get(sid)
+        pid = entry[1] if entry else None
+        if pid and state.host_id and pid != state.host_id:
             # not host, ignore
             try:
                 await sio.emit('settings_rejected', {'message': 'Only the host may change settings'}, room=sid)
@@ -499,7 +1726,7 @@ async def handle_set_settings(sid, data):
             return
     except Exception:
         pass
-    # persist settings in room meta (will be used on game start)
+    # persist settings in room state (will be used on game start)
     # enforce duration rules: default minimal durations (seconds)
     DEFAULTS = {'killerDuration': 120, 'doctorDuration': 120, 'votingDuration': 120}
     incoming = dict(settings)
@@ -518,7 +1745,7 @@ async def handle_set_settings(sid, data):
         incoming = {'killCount': 1, 'doctorCount': 1, 'detectiveCount': 0, 'killerDuration': DEFAULTS['killerDuration'], 'doctorDuration': DEFAULTS['doctorDuration'], 'votingDuration': DEFAULTS['votingDuration']}
 
     # If existing settings are present, do not allow decreasing durations below current set or default
-    existing = meta.get('settings', {}) or {}
+    existing = state.settings or {}
     MAX_DURATION = 300
     for key in ('killerDuration', 'doctorDuration', 'votingDuration'):
         min_allowed = max(DEFAULTS[key], int(existing.get(key, DEFAULTS[key])))
@@ -529,85 +1756,62 @@ async def handle_set_settings(sid, data):
         if incoming.get(key, DEFAULTS[key]) > MAX_DURATION:
             incoming[key] = MAX_DURATION
 
-    meta['settings'] = incoming
+    state.set_settings(incoming)
     try:
-        await sio.emit('settings_updated', {'settings': meta['settings']}, room=room)
+        await sio.emit('settings_updated', {'settings': state.settings}, room=room)
     except Exception:
         pass
 
 
 @sio.on('player_ready')
+@_room_handler
 async def handle_player_ready(sid, data):
     """Mark a player as ready. When all current players are ready, assign roles and start the game."""
     room = data.get('roomId')
     player = data.get('player')
     if not room or not player:
         return
-    meta = _room_meta.setdefault(room, {})
-    ready = meta.setdefault('ready', {})
+    state = _get_or_create_room(room)
     pid = player.get('id')
     if not pid:
         return
-    ready[pid] = True
+    if state.get_player(pid) is None:
+        return
+    state.set_ready(pid)
     # broadcast ready state to room (list of ready player ids)
-    await sio.emit('ready_state', {'ready': list(ready.keys())}, room=room)
+    await sio.emit('ready_state', {'ready': state.ready_ids()}, room=room)
 
     # Check if all current lobby players are ready
-    players = _rooms.get(room, [])
-    player_ids = [p.get('id') for p in players]
-    all_ready = all((pid in ready and ready.get(pid)) for pid in player_ids) and len(player_ids) > 0
-    if all_ready:
-        # schedule a non-blocking start sequence: countdown, assign roles, deliver roles privately, then begin night/day orchestration
+    players = state.player_list()
+    if state.all_ready() and not state.in_game:
+        # start sequence: countdown, assign roles, deliver roles privately, then hand night/day orchestration to the scheduler
         async def start_sequence():
-            meta = _room_meta.setdefault(room, {})
             # small countdown (3..1) emitted each second so clients can show it
             try:
                 # Emit a single prestart event with start timestamp and duration so clients can sync the countdown
                 prestart_duration = 3
-                prestart_start = int(time.time() * 1000)
+                prestart_start = int(clock.time() * 1000)
                 await sio.emit('prestart', {'duration': prestart_duration, 'start_ts': prestart_start}, room=room)
             except Exception:
                 pass
 
-            # assign roles according to host settings stored in meta
-            settings = meta.get('settings', {}) or {}
+            # assign roles according to host settings stored in the room state
             # normalize numeric settings to ints (safeguard against string inputs)
-            try:
-                settings = {
-                    'killCount': int(settings.get('killCount', 1)),
-                    'doctorCount': int(settings.get('doctorCount', 1)),
-                    'detectiveCount': int(settings.get('detectiveCount', 0)),
-                    'killerDuration': int(settings.get('killerDuration', 120)),
-                    'doctorDuration': int(settings.get('doctorDuration', 120)),
-                    'votingDuration': int(settings.get('votingDuration', 120)),
-                }
-            except Exception:
-                settings = {'killCount': 1, 'doctorCount': 0, 'detectiveCount': 0}
+            settings = engine.normalize_settings(state.settings)
             assigned = _assign_roles_to_players(players, settings)
-            # store assigned roles in meta and mark in-game
-            # reset eliminated mapping so previous game's deaths do not persist
-            meta['assigned_roles'] = {p.get('id'): p.get('role') for p in assigned}
-            meta['in_game'] = True
-            meta['phase'] = 'pre_night'
-            meta['eliminated'] = {}
-
             # prepare private rooms for killers and doctors
             killer_room = f"{room}__killers"
             doctor_room = f"{room}__doctors"
-            meta['killer_room'] = killer_room
-            meta['doctor_room'] = doctor_room
+            # store assigned roles and mark in-game
+            # (assigning also revives everyone so previous game's deaths do not persist)
+            state.start_game(assigned, killer_room, doctor_room)
 
             # send private role and instructions to each player using stored sids
-            sids = meta.get('player_sids', {})
-            role_descriptions = {
-                'Killer': 'Secretly selects one player to eliminate each night. Killers know each other and coordinate in private chat.',
-                'Doctor': 'Each night chooses one player to protect from being eliminated. If you save the targeted player, they survive the night.',
-                'Detective': 'Can investigate one player to learn if they are a Killer. Use this information wisely and avoid revealing too early.',
-                'Civilian': 'No special powers. Participate in discussion and voting to identify Killers.'
-            }
+            role_descriptions = ROLE_DESCRIPTIONS
             for p in assigned:
                 pid = p.get('id')
-                psids = sids.get(pid) or []
+                member = state.get_player(pid)
+                psids = list(member.sids) if member else []
                 for psid in psids:
                     try:
                         # send role and description privately to all active tabs for this player
@@ -624,23 +1828,14 @@ async def handle_player_ready(sid, data):
                             except Exception:
                                 pass
                     except Exception as e:
-                        print(f"[player_ready] error sending role to {pid}: {e}")
+                        _log_game.error('could not send role', room=room, player=pid, error=e)
 
             # broadcast roles assigned (public roster only)
             public_players = [{'id': p.get('id'), 'name': p.get('name')} for p in assigned]
             # include the normalized settings the host applied so clients can display them
             # also emit a room_state update that contains alive_role_members so clients have teammate lists
             try:
-                players_now = _rooms.get(room, [])
-                assigned_map = meta.get('assigned_roles', {})
-                eliminated = meta.get('eliminated', {}) or {}
-                alive = [p for p in players_now if not eliminated.get(p.get('id'))]
-                alive_role_members = {}
-                for p in alive:
-                    r = assigned_map.get(p.get('id')) or 'Civilian'
-                    alive_role_members.setdefault(r, []).append({'id': p.get('id'), 'name': p.get('name')})
-                role_counts = {k: len(v) for k, v in alive_role_members.items()}
-                await sio.emit('room_state', {'players': public_players, 'host_id': meta.get('host_id'), 'eliminated': meta.get('eliminated', {}), 'alive_role_members': alive_role_members, 'role_counts': role_counts}, room=room)
+                await _emit_room_update(state, players=public_players)
             except Exception:
                 await sio.emit('roles_assigned', {'players': public_players, 'role_descriptions': role_descriptions, 'settings': settings}, room=room)
             try:
@@ -649,66 +1844,65 @@ async def handle_player_ready(sid, data):
                 pass
 
             # short pause to allow client to show role card, then start night
-            await asyncio.sleep(3)
-            # start night
-            await _start_night_sequence(room)
+            scheduler.call_later(room, 'prestart', 3, _start_night_sequence, room)
 
-        # schedule the start sequence without blocking the event loop
-        asyncio.create_task(start_sequence())
+        await start_sequence()
 
 
+@_timed_step
 async def _start_night_sequence(room: str):
     """Orchestrate night phases: announce night, run killer phase, run doctor phase, resolve night, then start day and voting."""
-    meta = _room_meta.setdefault(room, {})
-    meta['phase'] = 'night_start'
-    start_ts = int(time.time() * 1000)
+    state = _rooms.get(room)
+    if state is None:
+        return
+    start_ts = int(clock.time() * 1000)
+    info = {'phase': 'night_start', 'message': "Night time - Everyone close your eyes", 'duration': 5, 'start_ts': start_ts}
+    state.enter_phase('night_start', info)
     # announce night and give players a little longer to close eyes per game flow
-    await sio.emit('phase', {'phase': 'night_start', 'message': "Night time - Everyone close your eyes", 'duration': 5, 'start_ts': start_ts}, room=room)
+    await sio.emit('phase', info, room=room)
     # wait 5s then start killer phase
-    await asyncio.sleep(5)
+    scheduler.call_later(room, 'night_start', 5, _end_night_start, room)
+
+
+@_timed_step
+async def _end_night_start(room: str):
+    state = _rooms.get(room)
+    if state is None:
+        return
     # use configured duration if present
-    meta = _room_meta.setdefault(room, {})
-    settings = meta.get('settings', {}) or {}
+    settings = state.settings or {}
     killer_dur = int(settings.get('killerDuration', 120))
     await _start_killer_phase(room, duration=killer_dur)
 
 
+@_timed_step
 async def _start_killer_phase(room: str, duration: int = 120):
-    meta = _room_meta.setdefault(room, {})
-    meta['phase'] = 'killer'
-    # reset per-round actions tracker
-    meta['actions'] = meta.get('actions', {})
-    meta['actions']['killer'] = {}
-    meta['night_kill'] = None
-    # clear any previous doctor save or doctor actions so stale data doesn't carry between rounds
-    meta['doctor_save'] = None
-    try:
-        meta['actions']['doctor'] = {}
-    except Exception:
-        meta.setdefault('actions', {})['doctor'] = {}
+    state = _rooms.get(room)
+    if state is None:
+        return
     # notify everyone that killer phase has started (public notification + timer)
-    start_ts = int(time.time() * 1000)
-    await sio.emit('phase', {'phase': 'killer', 'message': 'Night has fallen — Killers, choose your target', 'duration': duration, 'start_ts': start_ts}, room=room)
+    start_ts = int(clock.time() * 1000)
+    info = {'phase': 'killer', 'message': 'Night has fallen — Killers, choose your target', 'duration': duration, 'start_ts': start_ts}
+    # entering the phase resets per-round actions and any previous doctor save so stale data doesn't carry between rounds
+    state.enter_phase('killer', info)
+    await sio.emit('phase', info, room=room)
     # also notify killer private room so killers get private chat context
-    if meta.get('killer_room'):
-        await sio.emit('phase', {'phase': 'killer', 'message': 'Killer, open your eyes and choose a target', 'duration': duration, 'start_ts': start_ts}, room=meta.get('killer_room'))
+    if state.killer_room:
+        await sio.emit('phase', {'phase': 'killer', 'message': 'Killer, open your eyes and choose a target', 'duration': duration, 'start_ts': start_ts}, room=state.killer_room)
+
+    _log_game.debug('killer phase started', room=room, duration=duration)
+    scheduler.call_later(room, 'killer', duration, _end_killer_phase, room)
 
-    async def killer_timer():
-        try:
-            print(f"[killer_timer] Starting timer for room {room}, duration {duration}s")
-            await asyncio.sleep(duration)
-            print(f"[killer_timer] Timer expired for room {room}, proceeding to doctor phase")
-        except asyncio.CancelledError:
-            print(f"[killer_timer] Timer cancelled for room {room}")
-            return
-        # timer expired, proceed to doctor phase (or skip doctor if none alive)
-        await _start_doctor_phase(room)
 
-    task = asyncio.create_task(killer_timer())
-    meta['killer_task'] = task
+@_timed_step
+async def _end_killer_phase(room: str):
+    _log_game.debug('killer phase timed out', room=room)
+    # timer expired, proceed to doctor phase (or skip doctor if none alive)
+    await _start_doctor_phase(room)
 
 
 @sio.on('killer_action')
+@_room_handler
 async def handle_killer_action(sid, data):
     room = data.get('roomId')
     player = data.get('player')
@@ -717,102 +1911,83 @@ async def handle_killer_action(sid, data):
     skip = bool(data.get('skip')) or (('targetId' in data) and data.get('targetId') is None)
     if not room or not player:
         return
-    meta = _room_meta.setdefault(room, {})
+    state = _rooms.get(room)
     # only accept during killer phase
-    if meta.get('phase') != 'killer':
+    if state is None or state.phase != 'killer':
         return
     # identify actor and block eliminated players from acting
     pid = player.get('id')
-    if meta.get('eliminated', {}).get(pid):
+    if state.is_eliminated(pid):
         try:
-            await sio.emit('action_blocked', {'message': 'You are eliminated and cannot act.'}, room=sid)
+            await _emit_blocked('action_blocked', 'You are eliminated and cannot act.', sid)
         except Exception:
             pass
         return
-    # ensure per-round actions tracker exists
-    actions = meta.setdefault('actions', {})
-    killer_actions = actions.setdefault('killer', {})
     # if this killer (or any killer in the room) already acted this round, block further actions
-    if killer_actions:
+    if state.killer_actions:
         try:
-            await sio.emit('action_blocked', {'message': 'A kill has already been recorded this round.'}, room=sid)
+            await _emit_blocked('action_blocked', 'A kill has already been recorded this round.', sid)
         except Exception:
             pass
         return
-    pid = player.get('id')
-    assigned = meta.get('assigned_roles', {})
-    if assigned.get(pid) != 'Killer':
+    if state.role_of(pid) != 'Killer':
         return
     # record the chosen kill (and actor) and cancel killer timer for early move to doctor
     if skip:
-        meta['night_kill'] = {'target': None, 'by': pid, 'skipped': True}
-        killer_actions[pid] = None
+        state.record_kill(pid, None, True)
     else:
         # Prevent killers from targeting other killers
-        assigned = meta.get('assigned_roles', {})
-        if target_id and assigned.get(target_id) == 'Killer':
+        if target_id and not engine.can_target('Killer', state.role_of(target_id)):
             try:
-                await sio.emit('action_blocked', {'message': 'Killers cannot target other Killers.'}, room=sid)
+                await _emit_blocked('action_blocked', 'Killers cannot target other Killers.', sid)
             except Exception:
                 pass
             return
-        meta['night_kill'] = {'target': target_id, 'by': pid}
-        killer_actions[pid] = target_id
+        state.record_kill(pid, target_id)
     try:
         await sio.emit('action_accepted', {'action': 'killer', 'targetId': target_id}, room=sid)
     except Exception:
         pass
-    task = meta.pop('killer_task', None)
-    if task and not task.done():
-        task.cancel()
+    scheduler.cancel(room, 'killer')
     # after a killer action, if there are no alive doctors, skip doctor phase
-    print(f"[killer_action] Checking for alive doctors in room {room}")
-    players = _rooms.get(room, [])
-    assigned = meta.get('assigned_roles', {})
-    alive_players = [p for p in players if not meta.get('eliminated', {}).get(p.get('id'))]
-    # count alive doctors
-    alive_doctors = sum(1 for p in alive_players if assigned.get(p.get('id')) == 'Doctor')
-    print(f"[killer_action] Found {alive_doctors} alive doctors")
+    alive_doctors = state.alive_count('Doctor')
+    _log_game.debug('killer acted', room=room, alive_doctors=alive_doctors)
     if alive_doctors <= 0:
-        print(f"[killer_action] No doctors, skipping to resolve_night")
         # directly resolve night (doctor phase skipped)
         await _resolve_night_and_start_day(room)
     else:
-        print(f"[killer_action] Starting doctor phase")
-        settings = meta.get('settings', {}) or {}
+        settings = state.settings or {}
         doctor_dur = int(settings.get('doctorDuration', 120))
         await _start_doctor_phase(room, duration=doctor_dur)
 
 
+@_timed_step
 async def _start_doctor_phase(room: str, duration: int = 120):
-    meta = _room_meta.setdefault(room, {})
-    meta['phase'] = 'doctor'
-    meta['doctor_save'] = None
+    state = _rooms.get(room)
+    if state is None:
+        return
     # notify everyone that doctor phase has started (public notification + timer)
-    start_ts = int(time.time() * 1000)
-    await sio.emit('phase', {'phase': 'doctor', 'message': 'Doctor: choose someone to save', 'duration': duration, 'start_ts': start_ts}, room=room)
+    start_ts = int(clock.time() * 1000)
+    info = {'phase': 'doctor', 'message': 'Doctor: choose someone to save', 'duration': duration, 'start_ts': start_ts}
+    # entering the phase also resets the doctor's save and per-round actions
+    state.enter_phase('doctor', info)
+    await sio.emit('phase', info, room=room)
     # also notify doctor private room so doctors get private chat context
-    if meta.get('doctor_room'):
-        await sio.emit('phase', {'phase': 'doctor', 'message': 'Doctor, choose someone to save', 'duration': duration, 'start_ts': start_ts}, room=meta.get('doctor_room'))
+    if state.doctor_room:
+        await sio.emit('phase', {'phase': 'doctor', 'message': 'Doctor, choose someone to save', 'duration': duration, 'start_ts': start_ts}, room=state.doctor_room)
 
-    async def doctor_timer():
-        try:
-            print(f"[doctor_timer] Starting timer for room {room}, duration {duration}s")
-            await asyncio.sleep(duration)
-            print(f"[doctor_timer] Timer expired for room {room}, scheduling resolve_night task")
-        except asyncio.CancelledError:
-            print(f"[doctor_timer] Timer cancelled for room {room}")
-            return
-        # timer expired, schedule resolve night as a separate task
-        asyncio.create_task(_resolve_night_and_start_day(room))
+    _log_game.debug('doctor phase started', room=room, duration=duration)
+    scheduler.call_later(room, 'doctor', duration, _end_doctor_phase, room)
 
-    task = asyncio.create_task(doctor_timer())
-    meta['doctor_task'] = task
-    # reset doctor actions container for new round
-    meta['actions']['doctor'] = {}
+
+@_timed_step
+async def _end_doctor_phase(room: str):
+    _log_game.debug('doctor phase timed out', room=room)
+    await _resolve_night_and_start_day(room)
 
 
 @sio.on('doctor_action')
+@_room_handler
 async def handle_doctor_action(sid, data):
     room = data.get('roomId')
     player = data.get('player')
@@ -820,118 +1995,106 @@ async def handle_doctor_action(sid, data):
     skip = bool(data.get('skip')) or (('targetId' in data) and data.get('targetId') is None)
     if not room or not player:
         return
-    meta = _room_meta.setdefault(room, {})
-    if meta.get('phase') != 'doctor':
+    state = _rooms.get(room)
+    if state is None or state.phase != 'doctor':
         return
     pid = player.get('id')
-    assigned = meta.get('assigned_roles', {})
-    if assigned.get(pid) != 'Doctor':
+    if state.role_of(pid) != 'Doctor':
         return
     # block eliminated doctors from acting
-    if meta.get('eliminated', {}).get(pid):
+    if state.is_eliminated(pid):
         try:
-            await sio.emit('action_blocked', {'message': 'You are eliminated and cannot act.'}, room=sid)
+            await _emit_blocked('action_blocked', 'You are eliminated and cannot act.', sid)
         except Exception:
             pass
         return
     # per-round action enforcement
-    actions = meta.setdefault('actions', {})
-    doctor_actions = actions.setdefault('doctor', {})
-    if doctor_actions.get(pid):
+    if state.doctor_actions.get(pid):
         try:
-            await sio.emit('action_blocked', {'message': 'You have already acted this round.'}, room=sid)
+            await _emit_blocked('action_blocked', 'You have already acted this round.', sid)
         except Exception:
             pass
         return
     # record doctor save target and which doctor performed the save (support skip)
     if skip:
-        meta['doctor_save'] = {'target': None, 'by': pid, 'skipped': True}
-        doctor_actions[pid] = None
+        state.record_save(pid, None, True)
     else:
-        meta['doctor_save'] = {'target': target_id, 'by': pid}
-        doctor_actions[pid] = target_id
+        state.record_save(pid, target_id)
     try:
         await sio.emit('action_accepted', {'action': 'doctor', 'targetId': target_id}, room=sid)
     except Exception:
         pass
-    task = meta.pop('doctor_task', None)
-    if task and not task.done():
-        task.cancel()
+    scheduler.cancel(room, 'doctor')
     await _resolve_night_and_start_day(room)
 
 
 @sio.on('detective_action')
+@_room_handler
 async def handle_detective_action(sid, data):
     room = data.get('roomId')
     player = data.get('player')
     target_id = data.get('targetId')
     if not room or not player or not target_id:
         return
-    meta = _room_meta.setdefault(room, {})
+    state = _rooms.get(room)
     # only accept during detective phase (we'll treat detective action during night while phase in 'killer' or 'doctor')
     # allow detective to act anytime during night phases
-    if meta.get('phase') not in ('killer', 'doctor', 'night_start', 'pre_night'):
+    if state is None or state.phase not in ('killer', 'doctor', 'night_start', 'pre_night'):
         return
     pid = player.get('id')
-    assigned = meta.get('assigned_roles', {})
-    if assigned.get(pid) != 'Detective':
+    if state.role_of(pid) != 'Detective':
         return
     # block eliminated detective from acting
-    if meta.get('eliminated', {}).get(pid):
+    if state.is_eliminated(pid):
         try:
-            await sio.emit('action_blocked', {'message': 'You are eliminated and cannot act.'}, room=sid)
+            await _emit_blocked('action_blocked', 'You are eliminated and cannot act.', sid)
         except Exception:
             pass
         return
-    # per-round / one-time enforcement for detective
-    actions = meta.setdefault('actions', {})
-    detective_actions = actions.setdefault('detective', {})
     # If detective already used their ability (treat as one-time), block
-    if detective_actions.get(pid):
+    if state.detective_actions.get(pid):
         try:
-            await sio.emit('action_blocked', {'message': 'Detective ability already used.'}, room=sid)
+            await _emit_blocked('action_blocked', 'Detective ability already used.', sid)
         except Exception:
             pass
         return
     # Determine if target is a killer
-    role = assigned.get(target_id)
+    role = state.role_of(target_id)
     is_killer = (role == 'Killer')
     # record detective use
-    meta['detective_check'] = {'target': target_id, 'by': pid}
-    detective_actions[pid] = target_id
-    # send result privately to detective
-    sids = meta.get('player_sids', {})
-    psid = sids.get(pid)
+    state.record_check(pid, target_id)
+    # send result privately to detective (all of their tabs)
+    psids = list(state.get_player(pid).sids)
     try:
-        await sio.emit('detective_result', {'targetId': target_id, 'is_killer': is_killer, 'role': role}, room=psid)
+        await sio.emit('detective_result', {'targetId': target_id, 'is_killer': is_killer, 'role': role}, room=psids)
         await sio.emit('action_accepted', {'action': 'detective', 'targetId': target_id}, room=sid)
     except Exception:
         pass
 
 
+@_timed_step
 async def _resolve_night_and_start_day(room: str):
-    print(f"[resolve_night] *** FUNCTION START *** for room {room}")
-    meta = _room_meta.setdefault(room, {})
-    killed = meta.get('night_kill')
-    saved = meta.get('doctor_save')
-    print(f"[resolve_night] killed={killed}, saved={saved}")
+    state = _rooms.get(room)
+    if state is None:
+        return
+    killed = state.night_kill
+    saved = state.doctor_save
+    _log_game.debug('resolving night', room=room, killed=killed, saved=saved)
     killed_player = None
     saved_player = None
     saved_by = None
 
     # find player objects
-    players = _rooms.get(room, [])
-    id_to_player = {p.get('id'): p for p in players}
     if killed:
         # killed may be a dict with target/by or just an id (legacy)
         ktarget = killed.get('target') if isinstance(killed, dict) else killed
-        killed_player = id_to_player.get(ktarget)
+        killed_player = state.get_player(ktarget)
     if saved:
         starget = saved.get('target') if isinstance(saved, dict) else saved
-        saved_player = id_to_player.get(starget)
+        saved_player = state.get_player(starget)
         sb = saved.get('by') if isinstance(saved, dict) else None
         if sb:
-            saved_by = id_to_player.get(sb)
+            saved_by = state.get_player(sb)
 
     # Validate that the doctor save was performed by an alive Doctor. If the saving doctor is no longer alive
     # or no longer has the Doctor role, ignore the save to avoid stale saves from prior rounds.
@@ -939,157 +2102,114 @@ async def _resolve_night_and_start_day(room: str):
     try:
         if saved and isinstance(saved, dict):
             sb_id = saved.get('by')
-            if sb_id:
-                # assigned roles mapping indicates each player's role
-                assigned_roles = meta.get('assigned_roles', {})
-                # doctor must still be alive (not in eliminated) and still assigned as 'Doctor'
-                if assigned_roles.get(sb_id) == 'Doctor' and not meta.get('eliminated', {}).get(sb_id):
-                    saved_valid = True
+            # doctor must still be alive (not eliminated) and still assigned as 'Doctor'
+            if sb_id and state.role_of(sb_id) == 'Doctor' and not state.is_eliminated(sb_id):
+                saved_valid = True
     except Exception:
         saved_valid = False
 
     # determine outcome by comparing targeted ids
-    outcome = {'result': 'none', 'player': None}
     ktarget = killed.get('target') if isinstance(killed, dict) else killed
     starget = saved.get('target') if isinstance(saved, dict) else saved
-    if ktarget and starget and ktarget == starget and saved_valid:
-        # doctor saved the victim (only if the save came from a live doctor)
-        outcome['result'] = 'saved'
-        outcome['player'] = saved_player
-    elif ktarget:
-        outcome['result'] = 'killed'
-        outcome['player'] = killed_player
+    # the doctor saves the victim only if the save came from a live doctor
+    result, _ = engine.night_outcome(ktarget, starget, saved_valid)
+    outcome = {'result': result, 'player': saved_player if result == 'saved' else killed_player if result == 'killed' else None}
 
     # broadcast night resolution to all players
-    if outcome['result'] == 'killed' and outcome['player']:
-        await sio.emit('night_result', {'result': 'killed', 'player': {'id': outcome['player'].get('id'), 'name': outcome['player'].get('name'), 'role': meta.get('assigned_roles', {}).get(outcome['player'].get('id'))}}, room=room)
+    victim = outcome['player']
+    if outcome['result'] == 'killed' and victim:
+        await sio.emit('night_result', {'result': 'killed', 'player': {'id': victim.id, 'name': victim.name, 'role': victim.role}}, room=room)
         # mark eliminated (keep player in the players list so UIs can show them as dead)
-        meta.setdefault('eliminated', {})[outcome['player'].get('id')] = True
-    elif outcome['result'] == 'saved' and outcome['player']:
-        payload = {'result': 'saved', 'player': {'id': outcome['player'].get('id'), 'name': outcome['player'].get('name')}}
+        state.eliminate(victim.id)
+    elif outcome['result'] == 'saved' and victim:
+        payload = {'result': 'saved', 'player': victim.public()}
         if saved_by:
-            payload['saved_by'] = {'id': saved_by.get('id'), 'name': saved_by.get('name')}
+            payload['saved_by'] = saved_by.public()
         await sio.emit('night_result', payload, room=room)
     else:
         await sio.emit('night_result', {'result': 'none'}, room=room)
 
-    # cleanup private rooms tasks
-    try:
-        kt = meta.pop('killer_task', None)
-        if kt and not kt.done():
-            kt.cancel()
-    except Exception:
-        pass
-    try:
-        dt = meta.pop('doctor_task', None)
-        if dt and not dt.done():
-            dt.cancel()
-    except Exception:
-        pass
+    # the night is over: drop any night phase deadline still pending
+    scheduler.cancel(room, 'killer')
+    scheduler.cancel(room, 'doctor')
 
-    # Begin day: signal players to open eyes, give a short window before showing night summary
-    start_ts = int(time.time() * 1000)
-    meta['phase'] = 'day_start'
-    await sio.emit('phase', {'phase': 'day_start', 'message': 'Day time - Open your eyes', 'duration': 5, 'start_ts': start_ts}, room=room)
-    print(f"[resolve_night] Day start phase emitted, sleeping for 5s...")
-    # small pause for clients to show day transition
-    try:
-        await asyncio.sleep(5)
-        print(f"[resolve_night] Day start sleep completed, preparing night summary...")
-    except asyncio.CancelledError:
-        print(f"[resolve_night] TASK CANCELLED during sleep, but continuing anyway...")
-    except Exception as e:
-        print(f"[resolve_night] ERROR during sleep: {e}")
-        print(f"[resolve_night] Continuing despite error...")
-
-    # Always show night summary first so players know what happened during the night
-    # send a concise night summary that clients can display for 5s
+    # send a concise night summary that clients can display for 5s (shown after the day transition)
     summary = {}
-    if outcome['result'] == 'killed' and outcome['player']:
-        summary['message'] = f"{outcome['player'].get('name')} was killed last night"
-        summary['killed'] = {'id': outcome['player'].get('id'), 'name': outcome['player'].get('name'), 'role': meta.get('assigned_roles', {}).get(outcome['player'].get('id'))}
+    if outcome['result'] == 'killed' and victim:
+        summary['message'] = f"{victim.name} was killed last night"
+        summary['killed'] = {'id': victim.id, 'name': victim.name, 'role': victim.role}
         summary['doctor_saved'] = False
-    elif outcome['result'] == 'saved' and outcome['player']:
-        summary['message'] = f"Doctor saved {outcome['player'].get('name')} last night"
-        summary['saved'] = {'id': outcome['player'].get('id'), 'name': outcome['player'].get('name')}
+    elif outcome['result'] == 'saved' and victim:
+        summary['message'] = f"Doctor saved {victim.name} last night"
+        summary['saved'] = victim.public()
         if saved_by:
-            summary['saved_by'] = {'id': saved_by.get('id'), 'name': saved_by.get('name')}
+            summary['saved_by'] = saved_by.public()
         summary['doctor_saved'] = True
     else:
         summary['message'] = 'No one died last night'
         summary['doctor_saved'] = False
 
+    # Begin day: signal players to open eyes, give a short window before showing night summary
+    start_ts = int(clock.time() * 1000)
+    info = {'phase': 'day_start', 'message': 'Day time - Open your eyes', 'duration': 5, 'start_ts': start_ts}
+    state.enter_phase('day_start', info)
+    await sio.emit('phase', info, room=room)
+    # small pause for clients to show day transition
+    scheduler.call_later(room, 'day_start', 5, _show_night_summary, room, summary)
+
+
+@_timed_step
+async def _show_night_summary(room: str, summary: dict):
+    """Second step of night resolution: show what happened during the night."""
+    state = _rooms.get(room)
+    if state is None:
+        return
     # allow public chat again; send updated room state and players list before summary (include alive_role_members)
-    try:
-        players_now = _rooms.get(room, [])
-        assigned_map = meta.get('assigned_roles', {})
-        eliminated = meta.get('eliminated', {}) or {}
-        alive = [p for p in players_now if not eliminated.get(p.get('id'))]
-        alive_role_members = {}
-        for p in alive:
-            r = assigned_map.get(p.get('id')) or 'Civilian'
-            alive_role_members.setdefault(r, []).append({'id': p.get('id'), 'name': p.get('name')})
-        role_counts = {k: len(v) for k, v in alive_role_members.items()}
-        await sio.emit('room_state', {'players': players_now, 'host_id': meta.get('host_id'), 'eliminated': meta.get('eliminated', {}), 'alive_role_members': alive_role_members, 'role_counts': role_counts}, room=room)
-    except Exception:
-        await sio.emit('room_state', {'players': _rooms.get(room, []), 'host_id': meta.get('host_id'), 'eliminated': meta.get('eliminated', {})}, room=room)
-    print(f"[resolve_night] About to emit night_summary: {summary}")
+    await _emit_room_update(state)
+    _log_game.info('night resolved', room=room, killed=(summary.get('killed') or {}).get('id'),
+                   saved=(summary.get('saved') or {}).get('id'))
     await sio.emit('night_summary', summary, room=room)
-    print(f"[resolve_night] Night summary emitted, sleeping for 5s...")
     # give players time to read the summary
-    try:
-        await asyncio.sleep(5)
-        print(f"[resolve_night] Night summary sleep completed")
-    except asyncio.CancelledError:
-        print(f"[resolve_night] TASK CANCELLED during night summary sleep, but continuing...")
-    except Exception as e:
-        print(f"[resolve_night] ERROR during night summary sleep: {e}")
-        print(f"[resolve_night] Continuing despite error...")
+    scheduler.call_later(room, 'night_summary', 5, _end_night_summary, room)
+
 
+@_timed_step
+async def _end_night_summary(room: str):
+    """Last step of night resolution: check win conditions, then open voting."""
+    state = _rooms.get(room)
+    if state is None:
+        return
     # Now check win conditions AFTER players have seen what happened at night
     try:
-        print(f"[resolve_night] Night summary displayed, now checking win conditions...")
         await _check_win_conditions(room)
-        print(f"[resolve_night] Win conditions checked, in_game={meta.get('in_game')}")
-        if not meta.get('in_game'):
+        if not state.in_game:
             # Game ended as a result of win condition; don't proceed to voting
-            print(f"[resolve_night] Game ended after night summary, returning")
             return
 
         # If no win condition met, start the voting phase (120s default)
-        print(f"[resolve_night] No win condition met, starting voting phase...")
-        settings = meta.get('settings', {}) or {}
+        settings = state.settings or {}
         voting_dur = int(settings.get('votingDuration', 120))
         await _start_voting_phase(room, duration=voting_dur)
-        print(f"[resolve_night] *** FUNCTION END *** voting phase started")
-    except Exception as e:
-        print(f"[resolve_night] CRITICAL ERROR in win condition check or voting start: {e}")
-        import traceback
-        traceback.print_exc()
+    except Exception:
+        _log_game.exception('win check or voting start failed', room=room)
 
 
+@_timed_step
 async def _start_voting_phase(room: str, duration: int = 120):
-    meta = _room_meta.setdefault(room, {})
-    meta['phase'] = 'voting'
-    meta['votes'] = {}
-    # reset per-round vote actions tracker
-    actions = meta.setdefault('actions', {})
-    actions['votes'] = {}
-    start_ts = int(time.time() * 1000)
-    await sio.emit('phase', {'phase': 'voting', 'message': 'Cast your vote: who do you think is a killer?', 'duration': duration, 'start_ts': start_ts}, room=room)
-
-    async def voting_timer():
-        try:
-            await asyncio.sleep(duration)
-        except asyncio.CancelledError:
-            return
-        await _resolve_votes(room)
+    state = _rooms.get(room)
+    if state is None:
+        return
+    start_ts = int(clock.time() * 1000)
+    info = {'phase': 'voting', 'message': 'Cast your vote: who do you think is a killer?', 'duration': duration, 'start_ts': start_ts}
+    # entering the phase resets per-round votes
+    state.enter_phase('voting', info)
+    await sio.emit('phase', info, room=room)
 
-    task = asyncio.create_task(voting_timer())
-    meta['voting_task'] = task
+    scheduler.call_later(room, 'voting', duration, _resolve_votes, room)
 
 
 @sio.on('cast_vote')
+@_room_handler
 async def handle_cast_vote(sid, data):
     room = data.get('roomId')
     voter = data.get('player')
@@ -1097,250 +2217,164 @@ async def handle_cast_vote(sid, data):
     target = data.get('targetId') if 'targetId' in data else None
     if not room or not voter:
         return
-    meta = _room_meta.setdefault(room, {})
-    if meta.get('phase') != 'voting':
+    state = _rooms.get(room)
+    if state is None or state.phase != 'voting':
         return
     vid = voter.get('id')
     # block eliminated players from voting
-    if meta.get('eliminated', {}).get(vid):
+    if state.is_eliminated(vid):
         try:
-            await sio.emit('action_blocked', {'message': 'You are eliminated and cannot vote.'}, room=sid)
+            await _emit_blocked('action_blocked', 'You are eliminated and cannot vote.', sid)
         except Exception:
             pass
         return
-    # record the vote in both the canonical votes mapping and the per-round actions tracker
     # Prevent killers from voting for other killers
-    assigned = meta.get('assigned_roles', {})
-    if target is not None and assigned.get(vid) == 'Killer' and assigned.get(target) == 'Killer':
+    if target is not None and not engine.can_target(state.role_of(vid), state.role_of(target)):
         try:
-            await sio.emit('action_blocked', {'message': 'Killers cannot vote for other Killers.'}, room=sid)
+            await _emit_blocked('action_blocked', 'Killers cannot vote for other Killers.', sid)
         except Exception:
             pass
         return
 
-    prev = meta.setdefault('votes', {}).get(vid)
-    meta.setdefault('votes', {})[vid] = target
-    actions = meta.setdefault('actions', {})
-    vote_actions = actions.setdefault('votes', {})
-    vote_actions[vid] = target
+    # record the vote (a later vote replaces the earlier one)
+    prev = state.cast_vote(vid, target)
     try:
         await sio.emit('vote_cast', {'by': vid, 'targetId': target, 'previous': prev}, room=room)
         await sio.emit('action_accepted', {'action': 'vote', 'targetId': target, 'previous': prev}, room=sid)
     except Exception:
         pass
-    # optional early resolution: if all alive players have voted, resolve early
-    # determine alive (non-eliminated) players
-    all_players = _rooms.get(room, [])
-    alive_players = [p for p in all_players if not meta.get('eliminated', {}).get(p.get('id'))]
-    alive_ids = [p.get('id') for p in alive_players]
-    if all((a in meta.get('votes', {})) for a in alive_ids):
-        task = meta.pop('voting_task', None)
-        if task and not task.done():
-            task.cancel()
+    # optional early resolution: if all alive (non-eliminated) players have voted, resolve early
+    if state.all_alive_voted():
+        scheduler.cancel(room, 'voting')
         await _resolve_votes(room)
 
 
+@_timed_step
 async def _resolve_votes(room: str):
-    meta = _room_meta.setdefault(room, {})
-    votes = meta.get('votes', {})
-    
-    # count actual votes and skips
-    counts = {}
-    skip_count = 0
-    total_votes = 0
-    
-    for v in votes.values():
-        total_votes += 1
-        if v is None:
-            # count skips/abstains
-            skip_count += 1
-        else:
-            # count actual votes
-            counts[v] = counts.get(v, 0) + 1
-    
+    state = _rooms.get(room)
+    if state is None:
+        return
+    outcome = engine.vote_outcome(state.votes)
+    counts, skip_count, total_votes = outcome['counts'], outcome['skip_count'], outcome['total']
+    max_votes, top = outcome['max_votes'], outcome['top']
+
     # calculate total actual votes cast (not skips)
     actual_vote_count = total_votes - skip_count
-    
-    print(f"[resolve_votes] Room {room}: {actual_vote_count} actual votes, {skip_count} skips, {total_votes} total")
-    print(f"[resolve_votes] Vote counts: {counts}")
-    
+
+    _log_game.debug('votes counted', room=room, votes=actual_vote_count, skips=skip_count, total=total_votes, counts=counts)
+
     # If no actual votes were cast, no elimination
-    if not counts:
+    if outcome['reason'] == 'no_votes':
         await sio.emit('vote_result', {'result': 'no_votes', 'skip_count': skip_count}, room=room)
-        meta['phase'] = 'post_vote'
+        state.enter_phase('post_vote')
         # schedule next night if game still active (no elimination occurred)
         await _check_win_conditions(room)
-        if meta.get('in_game'):
-            async def _next_night_no_votes():
-                await asyncio.sleep(3)
-                m = _room_meta.setdefault(room, {})
-                if m.get('in_game') and m.get('phase') != 'ended':
-                    await _start_night_sequence(room)
-            asyncio.create_task(_next_night_no_votes())
+        if state.in_game:
+            scheduler.call_later(room, 'post_vote', 3, _next_night, room)
         return
-    
-    # find max votes for any single player
-    max_votes = max(counts.values())
-    top = [pid for pid, c in counts.items() if c == max_votes]
-    
-    # IMPORTANT: Check if skips outnumber or equal the highest vote count
-    # If skips >= max_votes, then no elimination should occur
-    eliminated = None
-    if skip_count >= max_votes:
-        print(f"[resolve_votes] Skips ({skip_count}) >= max votes ({max_votes}), no elimination")
-        eliminated = None
-    elif len(top) == 1:
-        eliminated = top[0]
-        print(f"[resolve_votes] Clear winner: {eliminated} with {max_votes} votes")
-    else:
-        # tie between multiple players: no elimination 
-        print(f"[resolve_votes] Tie between {len(top)} players with {max_votes} votes each, no elimination")
-        eliminated = None
+
+    eliminated = outcome['eliminated']
+    _log_game.info('votes resolved', room=room, eliminated=eliminated, reason=outcome['reason'], top=top,
+                   votes=max_votes, skips=skip_count)
 
     if eliminated:
-        # find player object
-        players = _rooms.get(room, [])
-        eliminated_player = next((p for p in players if p.get('id') == eliminated), None)
+        eliminated_player = state.get_player(eliminated)
         if eliminated_player:
-            role = meta.get('assigned_roles', {}).get(eliminated)
             # mark eliminated (do not remove from players list so UIs can show skull)
-            meta.setdefault('eliminated', {})[eliminated] = True
+            state.eliminate(eliminated)
             await sio.emit('vote_result', {
-                'result': 'eliminated', 
-                'player': {'id': eliminated_player.get('id'), 'name': eliminated_player.get('name'), 'role': role},
+                'result': 'eliminated',
+                'player': {'id': eliminated_player.id, 'name': eliminated_player.name, 'role': eliminated_player.role},
                 'vote_count': max_votes,
                 'skip_count': skip_count,
                 'counts': counts
             }, room=room)
-            meta['phase'] = 'post_vote'
-            # after elimination, you may want to check win conditions (not implemented)
+            state.enter_phase('post_vote')
             # check win conditions after elimination
             await _check_win_conditions(room)
             # if game still running, schedule next night cycle
-            if meta.get('in_game'):
-                async def _next_night():
-                    await asyncio.sleep(3)
-                    # re-check in case game ended in the meantime
-                    m = _room_meta.setdefault(room, {})
-                    if m.get('in_game') and m.get('phase') != 'ended':
-                        await _start_night_sequence(room)
-                asyncio.create_task(_next_night())
+            if state.in_game:
+                scheduler.call_later(room, 'post_vote', 3, _next_night, room)
             return
-    # no elimination
-    reason = 'tie' if len(top) > 1 else 'skips_majority' if skip_count >= max_votes else 'unknown'
+    # no elimination (an eliminated id that is no longer in the room has no reason)
+    reason = outcome['reason'] or 'unknown'
     await sio.emit('vote_result', {
-        'result': 'no_elimination', 
+        'result': 'no_elimination',
         'reason': reason,
-        'top': top, 
-        'counts': counts, 
+        'top': top,
+        'counts': counts,
         'skip_count': skip_count,
         'max_votes': max_votes
     }, room=room)
-    meta['phase'] = 'post_vote'
+    state.enter_phase('post_vote')
     # check win conditions and continue the game if nobody has won
     await _check_win_conditions(room)
-    if meta.get('in_game'):
-        async def _next_night_noelim():
-            await asyncio.sleep(3)
-            m = _room_meta.setdefault(room, {})
-            if m.get('in_game') and m.get('phase') != 'ended':
-                await _start_night_sequence(room)
-        asyncio.create_task(_next_night_noelim())
+    if state.in_game:
+        scheduler.call_later(room, 'post_vote', 3, _next_night, room)
+
+
+@_timed_step
+async def _next_night(room: str):
+    state = _rooms.get(room)
+    # re-check in case game ended in the meantime
+    if state is not None and state.in_game and state.phase != 'ended':
+        await _start_night_sequence(room)
 
 
+def _alive_role_summary(state):
+    """(alive killers, other alive players, alive count per role) for the win check."""
+    # alive counts per role come from the room's alive-by-role index (unknown roles count as civilians)
+    alive_roles = {'Killer': 0, 'Civilian': 0, 'Doctor': 0, 'Detective': 0}
+    alive_roles.update(state.role_counts())
+    killers = state.alive_count('Killer')
+    return killers, state.alive_count() - killers, alive_roles
+
+
+@_timed_step
 async def _check_win_conditions(room: str):
     """Simple win checks: if all killers are dead -> Civilians win; if killers >= civilians -> Killers win."""
-    print(f"[check_win_conditions] *** FUNCTION START *** for room {room}")
-    meta = _room_meta.setdefault(room, {})
-    # consider only non-eliminated players as alive
-    all_players = _rooms.get(room, [])
-    players = [p for p in all_players if not meta.get('eliminated', {}).get(p.get('id'))]
-    assigned = meta.get('assigned_roles', {})
-    # count alive roles
-    alive_roles = {'Killer': 0, 'Civilian': 0, 'Doctor': 0, 'Detective': 0}
-    for p in players:
-        rid = p.get('id')
-        r = assigned.get(rid) or 'Civilian'
-        if r in alive_roles:
-            alive_roles[r] += 1
-        else:
-            alive_roles['Civilian'] += 1
+    state = _rooms.get(room)
+    if state is None:
+        return
+    killers, others, alive_roles = _alive_role_summary(state)
 
-    killers = alive_roles.get('Killer', 0)
-    others = alive_roles.get('Civilian', 0) + alive_roles.get('Doctor', 0) + alive_roles.get('Detective', 0)
+    _log_game.debug('win check', room=room, killers=killers, others=others, alive_roles=alive_roles)
 
-    print(f"[check_win_conditions] killers={killers}, others={others}, alive_roles={alive_roles}")
-    
     # Win conditions:
     # - If no killers remain -> Civilians win
     # - If killers >= others -> Killers win
-    if killers == 0:
+    won = engine.winner(killers, others)
+    if won is not None:
+        _log_game.info('game over', room=room, winner=won, killers=killers, others=others)
+    if won == 'Civilians':
         await sio.emit('game_over', {'winner': 'Civilians'}, room=room)
-        meta['phase'] = 'ended'
         # clear in-game flag and any ready marks so lobby must re-ready to start again
-        meta['in_game'] = False
-        try:
-            meta['ready'] = {}
-        except Exception:
-            meta['ready'] = {}
+        state.end_game()
         # schedule a reset after 10s so clients can display final message, then the room is cleared
-        async def _delayed_reset_civ():
-            try:
-                await asyncio.sleep(10)
-                await _reset_room(room)
-            except Exception:
-                return
-        asyncio.create_task(_delayed_reset_civ())
+        scheduler.call_later(room, 'reset', 10, _reset_room, room)
         return
 
-    if killers >= others:
-        print(f"[check_win_conditions] Killers win condition triggered: {killers} >= {others}")
+    if won == 'Killers':
         # killers win - include alive killer names so clients can announce them
-        all_players = _rooms.get(room, [])
-        assigned = meta.get('assigned_roles', {})
-        alive_killers = [p for p in all_players if not meta.get('eliminated', {}).get(p.get('id')) and assigned.get(p.get('id')) == 'Killer']
-        killer_list = [{'id': p.get('id'), 'name': p.get('name')} for p in alive_killers]
-        print(f"[check_win_conditions] Emitting game_over: Killers win, killer_list={killer_list}")
+        killer_list = [state.get_player(pid).public() for pid in state.alive_ids('Killer')]
         await sio.emit('game_over', {'winner': 'Killers', 'killers': killer_list}, room=room)
-        meta['phase'] = 'ended'
         # clear in-game flag and any ready marks so lobby must re-ready to start again
-        meta['in_game'] = False
-        try:
-            meta['ready'] = {}
-        except Exception:
-            meta['ready'] = {}
-        async def _delayed_reset_k():
-            try:
-                await asyncio.sleep(10)
-                await _reset_room(room)
-            except Exception:
-                return
-        asyncio.create_task(_delayed_reset_k())
+        state.end_game()
+        scheduler.call_later(room, 'reset', 10, _reset_room, room)
         return
 
 
+@_timed_step
 async def _reset_room(room: str):
-    """Reset room metadata and delete room messages so clients see a fresh lobby with the same room code."""
+    """Reset room state and retire room messages so clients see a fresh lobby with the same room code."""
     try:
-        meta = _room_meta.setdefault(room, {})
-        meta['in_game'] = False
-        meta['phase'] = None
-        meta['assigned_roles'] = {}
-        meta['eliminated'] = {}
-        meta['ready'] = {}
-        meta['actions'] = {}
-        meta['votes'] = {}
-        meta.pop('killer_room', None)
-        meta.pop('doctor_room', None)
-        # clear messages from sqlite for this room and its private rooms
+        state = _rooms.get(room)
+        if state is not None:
+            state.reset_game()
+            await _emit_room_update(state)
+        # retire this game's chat for the room and its private rooms (old rows are compacted in the background)
         try:
-            conn = get_db_conn()
-            cur = conn.cursor()
-            cur.execute('DELETE FROM messages WHERE room = ?', (room,))
-            cur.execute('DELETE FROM messages WHERE room = ?', (f"{room}__killers",))
-            cur.execute('DELETE FROM messages WHERE room = ?', (f"{room}__doctors",))
-            conn.commit()
-            conn.close()
+            retire_chat_history([room, f"{room}__killers", f"{room}__doctors"])
         except Exception:
             pass
         # notify clients to reset their UI
@@ -1352,30 +2386,521 @@ async def _reset_room(room: str):
         return
 
 
+# timer callbacks that are journaled and re-armed after a restart, by name
+_phase_steps = {fn.__name__: fn for fn in (
+    _start_night_sequence, _end_night_start, _end_killer_phase, _end_doctor_phase,
+    _show_night_summary, _end_night_summary, _resolve_votes, _next_night, _reset_room,
+)}
+
+
+def _timer_due_ms(timer):
+    """Wall-clock time (epoch ms) a scheduler timer is due at."""
+    return int((clock.time() + timer.deadline - clock.monotonic()) * 1000)
+
+
+def _journal_timer(event, timer):
+    """Scheduler observer: journal game deadlines (not grace periods) as absolute wall-clock times;
+    with a shared backend, republish the room's record, which carries them."""
+    step = getattr(timer.callback, '__name__', None)
+    if _phase_steps.get(step) is not timer.callback:
+        return
+    if state_backend.shared:
+        _publish_record(timer.room)
+    if not game_journal.is_open:
+        return
+    if event == 'armed':
+        # args[0] is always the room
+        game_journal.record(timer.room, 'timer', (timer.kind, _timer_due_ms(timer), step, list(timer.args[1:])))
+    else:
+        game_journal.record(timer.room, 'timer_done', (timer.kind,))
+
+
+def _install_room(state: RoomState, timers, sids=None):
+    """Put a rebuilt room back in play: re-arm its deadlines at the recorded times, rebind the
+    sockets in `sids` ({player id: [sid]}) and remove the other players as after a disconnect
+    unless they come back within JOURNAL_RESTORE_GRACE seconds."""
+    room = state.room_id
+    _attach_journal(state)
+    _rooms[room] = state
+    now = clock.time()
+    for kind, (due, step, args) in timers.items():
+        fn = _phase_steps.get(step)
+        if fn is not None:
+            # deadlines that passed in the meantime fire right away
+            scheduler.call_later(room, kind, max(0.0, due / 1000 - now), fn, room, *args)
+    for p in state.players.values():
+        for sid in (sids or {}).get(p.id, ()):
+            _bind_sid(sid, state, p)
+        if not p.sids:
+            _schedule_removal(state, p.id, p.data, JOURNAL_RESTORE_GRACE)
+
+
+def _restore_rooms():
+    """Rebuild the journaled rooms mid-phase and re-arm their deadlines at the recorded times."""
+    replayed = game_journal.replay()
+    restored = 0
+    for room, (state, timers) in replayed.items():
+        if not _room_is_live(state):
+            # emptied rooms are dropped from the journal on its next flush
+            continue
+        # nobody is connected yet: every player gets the restore grace window
+        _install_room(state, timers)
+        restored += 1
+    if replayed:
+        _log_journal.info('rooms restored', restored=restored, replayed=len(replayed), ms=round(game_journal.replay_ms, 1))
+
+
+# graceful shutdown on SIGTERM (see `_install_drain_signal`): how long running games get to reach a phase boundary,
+# and how long clients are asked to wait before reconnecting
+DRAIN_TIMEOUT = float(os.environ.get('DRAIN_TIMEOUT', 20))
+DRAIN_RECONNECT_MS = int(os.environ.get('DRAIN_RECONNECT_MS', 3000))
+# 'draining': joins and new connections are refused; 'frozen': room events are dropped too
+_drain_state = None
+_drain_stats = {}
+
+
+def _room_settled(room, horizon):
+    """True once a room sits at a phase boundary: nothing queued in its mailbox and no game
+    transition (as opposed to a player-facing phase deadline) due within `horizon` seconds."""
+    actor = room_actors.get(room)
+    if actor is not None and (actor.task is not None or actor.queue):
+        return False
+    state = _rooms.get(room)
+    if state is None or not state.in_game:
+        return True
+    return not any(t['due_in'] <= horizon for t in scheduler.pending(room) if not t['kind'].startswith('grace:'))
+
+
+async def drain(timeout=DRAIN_TIMEOUT):
+    """Get this process ready to stop without losing games or chat.
+
+    New joins are refused, running games get up to `timeout` seconds to finish the short
+    transitions they are in (night start, summaries, ...) so they stop on a phase players can
+    resume, and then rooms are frozen: game clocks stop, queued chat is written and every room is
+    snapshotted with its remaining deadlines, to the journal or, with a shared backend, as the
+    room's record there with its lease released. Finally connected clients are told to reconnect
+    (`server_restart`) and disconnected; their seats are kept for the next process, or for the
+    worker that takes the room over when they rejoin.
+    """
+    global _drain_state
+    if _drain_state is not None:
+        return
+    _drain_state = 'draining'
+    started = time.monotonic()
+    deadline = started + timeout
+    _log_drain.info('refusing new joins, waiting for rooms to settle', timeout=timeout, rooms=len(_rooms))
+    while True:
+        remaining = deadline - time.monotonic()
+        unsettled = [room for room in list(_rooms) if not _room_settled(room, remaining)]
+        if not unsettled or remaining <= 0:
+            break
+        await asyncio.sleep(0.1)
+    _drain_state = 'frozen'
+    # pending deadlines stay journaled and are re-armed (at the same wall-clock time) on restart
+    await scheduler.stop()
+    await message_writer.stop()
+    await game_journal.stop()
+    if state_backend.shared:
+        for room in list(_rooms):
+            _publish_record(room)
+        await state_backend.hand_over()
+    sids = [sid for sid, _ in sio.manager.get_participants('/', None)]
+    for sid in sids:
+        try:
+            await sio.emit('server_restart', {'reconnect_after_ms': DRAIN_RECONNECT_MS}, room=sid)
+            await sio.disconnect(sid)
+        except Exception as e:
+            _log_drain.warning('could not notify client', sid=sid, error=e)
+    _drain_stats.update({
+        'drain_ms': round((time.monotonic() - started) * 1000, 1),
+        'rooms': len(_rooms),
+        'unsettled_rooms': len(unsettled),
+        'clients_notified': len(sids),
+    })
+    _log_drain.info('done', **_drain_stats)
+
+
+def _install_drain_signal():
+    """Run `drain()` on SIGTERM before handing the signal on to the server (uvicorn), which then
+    closes its connections and runs the lifespan shutdown. A second SIGTERM skips the wait."""
+    if threading.current_thread() is not threading.main_thread():
+        return
+    previous = signal.getsignal(signal.SIGTERM)
+    if not callable(previous):
+        # not under a server that handles SIGTERM itself: nothing would stop it after the drain
+        return
+    loop = asyncio.get_running_loop()
+
+    async def drain_then_exit(sig):
+        try:
+            await drain()
+        finally:
+            previous(sig, None)
+
+    def on_term(sig, frame):
+        if _drain_state is not None:
+            previous(sig, frame)
+            return
+        loop.call_soon_threadsafe(lambda: asyncio.ensure_future(drain_then_exit(sig)))
+
+    signal.signal(signal.SIGTERM, on_term)
+
 
 @app.get('/rooms/{room_id}/messages')
-async def room_messages(room_id: str, scope: str = None, limit: int = 50):
+async def room_messages(room_id: str, scope: str = None, limit: int = 50, before: str = None, after: str = None):
     """Return recent messages for a room. If `scope` is provided and is 'killers' or 'doctors',
     attempt to return messages stored under the private room namespace (room_id + '__killers' or '__doctors').
+
+    Older or newer history can be paged with the `before`/`after` cursors returned in `cursors`.
     """
-    target_room = room_id
+    try:
+        before_key = decode_cursor(before) if before else None
+        after_key = decode_cursor(after) if after else None
+    except ValueError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+
+    def respond(msgs, has_more):
+        cursors = {
+            'before': encode_cursor(msgs[0]) if msgs else before,
+            'after': encode_cursor(msgs[-1]) if msgs else after,
+        }
+        return JSONResponse({'messages': msgs, 'cursors': cursors, 'has_more': has_more})
+
+    def fetch(target_room):
+        if state_backend.shared and _base_room(target_room) not in _rooms:
+            # the room runs on another worker: this worker's cache and epoch may be stale
+            _update_chat_epochs(read_chat_epochs([target_room]))
+            return get_messages_page(target_room, limit=limit, before=before_key, after=after_key)
+        # the first page of history is what every lobby/game mount asks for; serve it from memory
+        if before_key is None and after_key is None:
+            return get_recent_messages_page(target_room, limit)
+        return get_messages_page(target_room, limit=limit, before=before_key, after=after_key)
+
     if scope in ('killers', 'doctors'):
         suffix = '__killers' if scope == 'killers' else '__doctors'
         candidate = f"{room_id}{suffix}"
+        msgs, has_more = fetch(candidate)
         # if no messages found for the private room, fall back to public room
-        msgs = get_recent_messages(candidate, limit=limit)
-        if msgs:
-            return JSONResponse({'messages': msgs})
+        # (only on the first page; a cursor always refers to the namespace that issued it)
+        if msgs or before_key or after_key:
+            return respond(msgs, has_more)
         # else fall back to public
-    msgs = get_recent_messages(room_id, limit=limit)
-    return JSONResponse({'messages': msgs})
+    msgs, has_more = fetch(room_id)
+    return respond(msgs, has_more)
+
+
+@app.get('/stats/chat_cache')
+async def chat_cache_stats():
+    """Hit/miss counters of the in-memory recent message cache."""
+    return JSONResponse(message_cache.stats())
+
+
+@app.get('/stats/chat_writer')
+async def chat_writer_stats():
+    """Queue depth and flush latency of the write-behind chat writer."""
+    return JSONResponse(message_writer.stats())
+
+
+@app.get('/stats/chat_retention')
+async def chat_retention_stats():
+    """Progress of the background chat compaction / retention job."""
+    return JSONResponse(chat_compactor.stats())
+
+
+@app.get('/stats/scheduler')
+async def scheduler_stats(room: str = None):
+    """Timer wheel counters; with `room`, also that room's pending deadlines (kind, seconds left)."""
+    stats = scheduler.stats()
+    if room is not None:
+        stats['room'] = room
+        stats['deadlines'] = scheduler.pending(room)
+    return JSONResponse(stats)
+
+
+def _room_is_live(state: RoomState):
+    return bool(state.players) or state.in_game
+
+
+def _drop_room(room):
+    """Forget a room this worker no longer runs: its timers, journal entry and state-backend lease."""
+    scheduler.cancel_room(room)
+    _rooms.pop(room, None)
+    _room_owners.pop(room, None)
+    game_journal.drop(room)
+    state_backend.forget_room(room)
+
+
+def _release_if_empty(state: RoomState):
+    """With a shared backend, drop a room that emptied so its lease goes to whichever worker sees it next."""
+    if state_backend.shared and not _room_is_live(state) and _rooms.get(state.room_id) is state:
+        _drop_room(state.room_id)
+
+
+@app.get('/admin/shards')
+async def shard_table(_admin=Depends(require_admin)):
+    """This worker's routing table, plus pins to it that are no longer needed (room emptied)."""
+    table = shards.table()
+    table['enabled'] = shards.enabled
+    table['rooms'] = len(_rooms)
+    table['releasable_pins'] = [room for room, worker in shards.pins.items()
+                                if worker == shards.self_name and not (room in _rooms and _room_is_live(_rooms[room]))]
+    return JSONResponse(table)
+
+
+@app.post('/admin/shards')
+async def update_shards(request: Request, dry_run: bool = False, _admin=Depends(require_admin)):
+    """Install a new routing table, e.g. `{"workers": {...with the new worker...}, "pins": {...}}`.
+
+    Rooms of this worker that hash elsewhere under the new table stay here (pinned) while they
+    have players or a game; empty ones are dropped. The response lists the pins this worker added
+    so they can be merged into the table sent to every worker. With `dry_run` nothing changes
+    and the response only reports the pins that would be needed.
+    """
+    if not shards.enabled:
+        raise HTTPException(status_code=400, detail='room sharding is not enabled on this worker')
+    body = await request.json()
+    workers = body.get('workers') if isinstance(body, dict) else None
+    if not isinstance(workers, dict) or not workers:
+        raise HTTPException(status_code=400, detail='workers must be a non-empty {name: url} object')
+    new = ShardMap(workers, shards.self_name, body.get('pins') or {})
+    pinned = {}
+    dropped = []
+    for room, state in list(_rooms.items()):
+        if new.is_local(room):
+            continue
+        if _room_is_live(state):
+            pinned[room] = shards.self_name
+        else:
+            dropped.append(room)
+    if dry_run:
+        return JSONResponse({'pinned': pinned, 'dropped': len(dropped)})
+    shards.update(new.workers, {**new.pins, **pinned})
+    for room in dropped:
+        _drop_room(room)
+    return JSONResponse({'pinned': pinned, 'dropped': len(dropped), 'table': shards.table()})
+
+
+@app.get('/stats/state_backend')
+async def state_backend_stats():
+    """Which state backend this worker uses, its worker id, owned rooms and bus counters."""
+    return JSONResponse(state_backend.stats())
+
+
+@app.get('/stats/journal')
+async def journal_stats():
+    return JSONResponse(game_journal.stats())
+
+
+@app.get('/stats/startup')
+async def startup_stats():
+    """How long the lifespan startup took: schema check, journal replay and the total."""
+    return JSONResponse(_startup_stats)
+
+
+@app.get('/stats/loop')
+async def loop_stats():
+    """Event-loop lag and the most recent stalls, with the task, room and function they happened in."""
+    return JSONResponse(loop_watchdog.stats())
+
+
+# longest CPU profile / memory diff window, and whether one is running (one at a time per worker)
+PROFILE_MAX_SECONDS = float(os.environ.get('PROFILE_MAX_SECONDS', 60))
+_profiling = asyncio.Lock()
+
+
+def _profile_window(seconds):
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        return JSONResponse({'error': f"seconds must be between 0 and {PROFILE_MAX_SECONDS:g}"}, status_code=400)
+    if _profiling.locked():
+        return JSONResponse({'error': 'a profile is already running on this worker'}, status_code=409)
+    return None
+
+
+@app.get('/admin/profile/cpu')
+async def profile_cpu(seconds: float = 10, interval: float = 0.005, all_threads: bool = False,
+                      _admin=Depends(require_admin)):
+    """Sample the event loop's stack for `seconds` and return collapsed stacks (flamegraph.pl,
+    speedscope). Samples taken while the loop is idle end in the selector's `select`."""
+    error = _profile_window(seconds)
+    if error is not None:
+        return error
+    async with _profiling:
+        # this handler runs on the loop thread, which is the one to sample
+        text = await asyncio.to_thread(profiling.sample_stacks, threading.get_ident(), seconds,
+                                       max(0.001, interval), all_threads)
+    return PlainTextResponse(text, headers={'Content-Disposition': 'attachment; filename="profile.collapsed"'})
+
+
+@app.get('/admin/profile/memory')
+async def profile_memory(seconds: float = 10, top: int = 25, frames: int = 1, _admin=Depends(require_admin)):
+    """tracemalloc snapshot diff over `seconds`: the source lines whose allocations grew the most."""
+    error = _profile_window(seconds)
+    if error is not None:
+        return error
+    async with _profiling:
+        return JSONResponse(await profiling.memory_diff(seconds, top, max(1, min(frames, 25))))
+
+
+@app.get('/admin/logging')
+async def logging_settings(_admin=Depends(require_admin)):
+    """Log levels, sampling rates and debug rooms in effect, plus the log writer's queue and drops."""
+    return JSONResponse(logs.settings())
+
+
+@app.post('/admin/logging')
+async def update_logging(request: Request, _admin=Depends(require_admin)):
+    """Change logging without a restart, e.g. `{"debug_rooms": ["ABCD"]}` for one room's game
+    details, `{"levels": {"engineio": "info"}}` or `{"sample": {"connect": 0.05}}` (null resets)."""
+    try:
+        body = await request.json()
+        logs.configure(levels=body.get('levels'), sample=body.get('sample'), debug_rooms=body.get('debug_rooms'),
+                       default=body.get('default'), format=body.get('format'))
+    except (ValueError, TypeError, AttributeError) as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+    return JSONResponse(logs.settings())
+
+
+@app.get('/admin/tasks')
+async def task_dump(_admin=Depends(require_admin)):
+    """Live asyncio tasks (room mailboxes by room, the rest by coroutine) and the pending phase
+    timers, grace removals and resets by room and kind. Timers are scheduler entries, not tasks."""
+    dump = profiling.task_summary(asyncio.all_tasks())
+    dump['timers'] = scheduler.pending_by_room()
+    return JSONResponse(dump)
+
+
+@app.get('/admin/rooms/sizes')
+async def room_sizes(top: int = 50, _admin=Depends(require_admin)):
+    """Approximate memory held by each room's state, largest first, with the room's cached chat,
+    mailbox backlog and pending timers. Walks every room on the loop: expect a few ms per 1000 rooms."""
+    sizes = []
+    for room, state in list(_rooms.items()):
+        sizes.append({
+            'room': room,
+            'state_bytes': profiling.deep_sizeof(state, skip=(game_journal,)),
+            'players': len(state.players),
+            'in_game': state.in_game,
+            'cached_messages': sum(message_cache.cached(name) or 0 for name in (room, f'{room}__killers', f'{room}__doctors')),
+            'mailbox': room_actors.queued(room),
+            'timers': len(scheduler.pending(room)),
+        })
+    sizes.sort(key=lambda r: -r['state_bytes'])
+    return JSONResponse({'rooms': len(sizes), 'state_bytes': sum(r['state_bytes'] for r in sizes), 'largest': sizes[:max(0, top)]})
+
+
+@app.get('/stats/drain')
+async def drain_stats():
+    """Graceful-shutdown status: None while serving, then 'draining' / 'frozen' (see `drain()`)."""
+    return JSONResponse({'state': _drain_state, 'timeout': DRAIN_TIMEOUT, **_drain_stats})
+
+
+# lobby settings suggestions: games simulated per role combination, largest room simulated, sweeps kept
+BALANCE_GAMES = int(os.environ.get('BALANCE_GAMES', 4000))
+BALANCE_MAX_PLAYERS = int(os.environ.get('BALANCE_MAX_PLAYERS', 30))
+BALANCE_CACHE = int(os.environ.get('BALANCE_CACHE', 64))
+# (players, policy) -> task running (or done with) balance.sweep
+_balance_sweeps = OrderedDict()
+
+
+@app.get('/balance')
+async def balance_suggestions(players: int, policy: str = 'informed'):
+    """Role counts for a room of `players`, most balanced first, from the Monte Carlo simulator.
+
+    Each room size is simulated once per worker (on a thread) and then served from memory.
+    """
+    # imported here so numpy is only loaded once somebody asks (serving games does not need it)
+    from . import balance
+    if not balance.available():
+        return JSONResponse({'error': 'the balance simulator needs numpy'}, status_code=503)
+    if policy not in balance.POLICIES:
+        return JSONResponse({'error': f"unknown policy: {policy}"}, status_code=400)
+    if not 3 <= players <= BALANCE_MAX_PLAYERS:
+        return JSONResponse({'error': f"players must be between 3 and {BALANCE_MAX_PLAYERS}"}, status_code=400)
+    key = (players, policy)
+    task = _balance_sweeps.get(key)
+    if task is None:
+        # seeded by room size so every worker suggests the same settings
+        task = asyncio.ensure_future(asyncio.to_thread(balance.sweep, players, BALANCE_GAMES, balance.POLICIES[policy](), players))
+        _balance_sweeps[key] = task
+        while len(_balance_sweeps) > BALANCE_CACHE:
+            _balance_sweeps.popitem(last=False)
+    _balance_sweeps.move_to_end(key)
+    try:
+        results = await asyncio.shield(task)
+    except Exception as e:
+        _balance_sweeps.pop(key, None)
+        return JSONResponse({'error': str(e)}, status_code=500)
+    return JSONResponse({'players': players, 'policy': policy, 'games': BALANCE_GAMES, 'results': results})
+
+
+@app.get('/stats/room_actors')
+async def room_actor_stats():
+    """Per-room mailbox counters (rooms with queued work, batch sizes, handler errors)."""
+    return JSONResponse(room_actors.stats())
+
+
+@app.get('/search')
+async def search(q: str, room: str = None, scope: str = None, since: int = None, until: int = None,
+                 include_retired: bool = False, raw: bool = False, limit: int = 20, offset: int = 0,
+                 _admin=Depends(require_admin)):
+    """Moderator full-text search across all rooms' chat (ranked, paginated with `offset`)."""
+    if scope not in (None, 'all', 'public', 'killers', 'doctors'):
+        return JSONResponse({'error': f"unknown scope: {scope}"}, status_code=400)
+    try:
+        results, has_more = await asyncio.to_thread(search_messages, q, room, scope, since, until, include_retired, limit, offset, raw)
+    except sqlite3.OperationalError as e:
+        # malformed raw FTS5 syntax
+        return JSONResponse({'error': str(e)}, status_code=400)
+    next_offset = offset + len(results) if has_more else None
+    return JSONResponse({'results': results, 'has_more': has_more, 'next_offset': next_offset})
+
+
+def _ndjson_response(queries, filename):
+    return StreamingResponse(stream_ndjson(queries), media_type='application/x-ndjson',
+                             headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+
+@app.get('/rooms/{room_id}/export')
+async def export_room(room_id: str, scope: str = None, since: int = None, until: int = None,
+                      include_retired: bool = False, _admin=Depends(require_admin)):
+    """Stream a room's chat (public and team namespaces) as NDJSON, one message per line."""
+    if scope not in (None, 'all', 'public', 'killers', 'doctors'):
+        return JSONResponse({'error': f"unknown scope: {scope}"}, status_code=400)
+    queries = _export_queries(room_id, scope, since, until, include_retired)
+    return _ndjson_response(queries, f"{room_id}.ndjson")
+
+
+@app.get('/export')
+async def export_range(since: int = None, until: int = None, _admin=Depends(require_admin)):
+    """Stream every stored message with `since <= ts <= until` as NDJSON, in time order."""
+    queries = _export_queries(since=since, until=until)
+    return _ndjson_response(queries, f"chat-{since or 0}-{until or 'now'}.ndjson")
 
 
 @app.get('/rooms/{room_id}/players')
 async def room_players(room_id: str):
-    players = _rooms.get(room_id, [])
-    meta = _room_meta.get(room_id, {})
-    return JSONResponse({'players': players, 'host_id': meta.get('host_id')})
+    state = _rooms.get(room_id)
+    if state is None and state_backend.shared:
+        # run by another worker: answer from its last published snapshot
+        snap = await state_backend.load_snapshot(room_id)
+        if snap:
+            return JSONResponse({'players': snap.get('players', []), 'host_id': snap.get('host_id'), 'version': snap.get('version', 0)})
+    if state is None:
+        return JSONResponse({'players': [], 'host_id': None, 'version': 0})
+    return JSONResponse({'players': state.player_list(), 'host_id': state.host_id, 'version': state.version})
+
+
+metrics.gauge('rooms_active', 'Rooms held by this worker', lambda: len(_rooms))
+metrics.gauge('rooms_in_game', 'Rooms with a game in progress', lambda: sum(1 for state in list(_rooms.values()) if state.in_game))
+metrics.gauge('socketio_connected_sids', 'Socket.IO connections to this worker', lambda: len(sio.manager.rooms.get('/', {}).get(None, ())))
+metrics.gauge('scheduler_pending_timers', 'Phase deadlines and grace periods waiting to fire', lambda: scheduler.stats()['pending'])
+_instrument_handlers()
+
+
+@app.get('/metrics')
+async def metrics_endpoint():
+    """Prometheus scrape target (text exposition format)."""
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
 
 
 # expose the ASGI app at the module level so uvicorn can import app
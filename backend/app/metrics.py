@@ -0,0 +1,204 @@
+"""In-process metrics in the Prometheus text exposition format (served at `GET /metrics`).
+
+Counters, gauges and histograms with optional labels, kept in plain Python objects so recording
+one is cheap enough for the per-event paths (a label lookup, a bisect and two additions, well
+under a microsecond when the labelled child is looked up once up front). Gauges can also be
+computed at scrape time from a callback, so values the app already tracks (rooms, timers) need
+no bookkeeping at all.
+
+    HANDLER = metrics.histogram('socketio_handler_seconds', 'Socket.IO handler latency', ('event',))
+    child = HANDLER.labels('join_room')     # look up once
+    child.observe(0.0012)                   # then record on every call
+
+Values recorded from worker threads (SQLite calls) are guarded by a per-child lock.
+"""
+
+import bisect
+import math
+import threading
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# latency buckets in seconds, from sub-millisecond handlers to slow database calls
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _CounterChild:
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class _HistogramChild:
+    __slots__ = ('bounds', 'counts', 'sum', '_lock')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # one slot per bucket plus +Inf; made cumulative only when rendered
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        """The child for these label values (created on first use)."""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f'{self.name} takes labels {self.labelnames}, got {values!r}')
+            child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def samples(self):
+        """(suffix, label values, extra label, value) tuples for rendering."""
+        raise NotImplementedError
+
+    def render(self, out):
+        out.append(f'# HELP {self.name} {self.help}')
+        out.append(f'# TYPE {self.name} {self.kind}')
+        for suffix, values, extra, value in self.samples():
+            out.append(f'{self.name}{suffix}{_format_labels(self.labelnames, values, extra)} {_format_value(value)}')
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._children[()].inc(amount)
+
+    def samples(self):
+        for values, child in list(self._children.items()):
+            yield '', values, None, child.value
+
+
+class Gauge(_Metric):
+    """A value read at scrape time from `fn()`: a number, or {label value(s): number} when labelled."""
+
+    kind = 'gauge'
+
+    def __init__(self, name, help, fn, labelnames=()):
+        self.fn = fn
+        super().__init__(name, help, labelnames)
+
+    def _new_child(self):
+        return None
+
+    def samples(self):
+        value = self.fn()
+        if not self.labelnames:
+            yield '', (), None, value
+            return
+        for values, v in value.items():
+            yield '', values if isinstance(values, tuple) else (values,), None, v
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.bounds = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.bounds)
+
+    def observe(self, value):
+        self._children[()].observe(value)
+
+    def samples(self):
+        for values, child in list(self._children.items()):
+            with child._lock:
+                counts, total = list(child.counts), child.sum
+            cumulative = 0
+            for bound, count in zip(self.bounds + (math.inf,), counts):
+                cumulative += count
+                yield '_bucket', values, f'le="{_format_value(float(bound))}"', cumulative
+            yield '_sum', values, None, total
+            yield '_count', values, None, cumulative
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f'metric {metric.name} is already registered')
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        """All metrics in the text exposition format."""
+        out = []
+        for metric in self._metrics.values():
+            lines = []
+            try:
+                metric.render(lines)
+                out.extend(lines)
+            except Exception as e:
+                # a failing gauge callback must not take the whole scrape down
+                out.append(f'# {metric.name} unavailable: {_escape(e)}')
+        return '\n'.join(out) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def counter(name, help, labelnames=()):
+    return REGISTRY.register(Counter(name, help, labelnames))
+
+
+def gauge(name, help, fn, labelnames=()):
+    return REGISTRY.register(Gauge(name, help, fn, labelnames))
+
+
+def histogram(name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram(name, help, labelnames, buckets))
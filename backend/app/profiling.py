@@ -0,0 +1,161 @@
+"""On-demand profiling of a live worker (served by the `/admin/profile/*` endpoints).
+
+Everything here is meant to run against a process that is serving games, so nothing is
+installed permanently and nothing blocks the event loop for long:
+
+- `sample_stacks` is a sampling CPU profiler. A plain thread reads the loop thread's current stack
+  (`sys._current_frames()`) every `interval` seconds and counts identical stacks, which costs the
+  loop nothing but the GIL hand-offs. The result is in the collapsed format flamegraph.pl,
+  speedscope and inferno read: `outer;inner;innermost <samples>` per line.
+- `memory_diff` starts tracemalloc only for the measurement window (if it was not already on) and
+  reports which source lines grew the most between the two snapshots. Allocation is slower
+  while tracing, so keep the window short.
+- `task_summary` lists live asyncio tasks grouped by what they are.
+- `deep_sizeof` estimates the memory an object graph holds, for per-room state sizes.
+
+    text = await asyncio.to_thread(sample_stacks, loop_thread_id, 10.0)
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, deque
+
+# deepest stack kept per sample (the outermost frames are dropped beyond this)
+MAX_DEPTH = 64
+
+
+def _frame_label(code):
+    return f'{os.path.basename(code.co_filename)}:{code.co_name}'
+
+
+def _collapse(frame, depth=MAX_DEPTH):
+    names = []
+    while frame is not None and len(names) < depth:
+        names.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    names.reverse()
+    return ';'.join(names)
+
+
+def sample_stacks(thread_id, seconds, interval=0.005, all_threads=False):
+    """Sample the stack of `thread_id` (every thread with `all_threads`) for `seconds`.
+
+    Returns collapsed stacks, most frequent first. With `all_threads` each stack is rooted at the
+    thread's name. Runs on the calling thread: call it through `asyncio.to_thread`.
+    """
+    me = threading.get_ident()
+    counts = Counter()
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        frames = sys._current_frames()
+        if all_threads:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in frames.items():
+                if ident != me:
+                    counts[f'{names.get(ident, ident)};{_collapse(frame)}'] += 1
+        else:
+            frame = frames.get(thread_id)
+            if frame is not None:
+                counts[_collapse(frame)] += 1
+        del frames
+        time.sleep(interval)
+    return ''.join(f'{stack} {n}\n' for stack, n in counts.most_common())
+
+
+async def memory_diff(seconds, top=25, frames=1):
+    """Where memory grew over `seconds`: the `top` source lines (or tracebacks of `frames` frames)
+    by size difference between a snapshot at the start and one at the end."""
+    started_here = not tracemalloc.is_tracing()
+    if started_here:
+        tracemalloc.start(max(1, frames))
+    try:
+        # snapshots copy every trace: taken on a thread so the loop keeps serving meanwhile
+        before = await asyncio.to_thread(tracemalloc.take_snapshot)
+        await asyncio.sleep(seconds)
+        after = await asyncio.to_thread(tracemalloc.take_snapshot)
+        traced, peak = tracemalloc.get_traced_memory()
+    finally:
+        if started_here:
+            tracemalloc.stop()
+    key = 'traceback' if frames > 1 else 'lineno'
+    stats = await asyncio.to_thread(after.compare_to, before, key)
+    return {
+        'seconds': seconds,
+        'tracing_started_here': started_here,
+        'traced_kb': round(traced / 1024, 1),
+        'peak_kb': round(peak / 1024, 1),
+        'growth_kb': round(sum(s.size_diff for s in stats) / 1024, 1),
+        'top': [{
+            'where': [f'{f.filename}:{f.lineno}' for f in s.traceback],
+            'size_diff_kb': round(s.size_diff / 1024, 1),
+            'size_kb': round(s.size / 1024, 1),
+            'count_diff': s.count_diff,
+        } for s in stats[:max(0, top)]],
+    }
+
+
+def _coro_name(task):
+    coro = task.get_coro()
+    return getattr(coro, '__qualname__', None) or type(coro).__name__
+
+
+def task_summary(tasks, sample=10):
+    """Group tasks by kind: room mailboxes by room (`room:<id>` names, see actor.py), the rest by
+    their coroutine, with a count, where they are suspended and the first `sample` task names."""
+    rooms = {}
+    kinds = {}
+    for task in tasks:
+        name = task.get_name()
+        stack = task.get_stack(limit=1)
+        at = f'{os.path.basename(stack[0].f_code.co_filename)}:{stack[0].f_lineno}' if stack else None
+        if name.startswith('room:'):
+            rooms[name[5:]] = {'coro': _coro_name(task), 'at': at, 'done': task.done()}
+            continue
+        group = kinds.setdefault(_coro_name(task), {'count': 0, 'at': Counter(), 'names': []})
+        group['count'] += 1
+        group['at'][at] += 1
+        if len(group['names']) < sample:
+            group['names'].append(name)
+    return {
+        'total': len(tasks),
+        'rooms': rooms,
+        'by_coroutine': {coro: dict(group, at=dict(group['at'].most_common()))
+                         for coro, group in sorted(kinds.items(), key=lambda item: -item[1]['count'])},
+    }
+
+
+def deep_sizeof(obj, skip=()):
+    """Approximate bytes held by `obj` and everything it references (shared objects counted once).
+
+    Follows containers, instance dicts and slots; classes, modules, functions and the objects in
+    `skip` (e.g. a journal every room points to) are not followed.
+    """
+    seen = {id(o) for o in skip}
+    total = 0
+    todo = deque([obj])
+    while todo:
+        o = todo.pop()
+        if id(o) in seen or isinstance(o, (type, type(sys), type(deep_sizeof))):
+            continue
+        seen.add(id(o))
+        total += sys.getsizeof(o, 0)
+        if isinstance(o, dict):
+            todo.extend(list(o.keys()))
+            todo.extend(list(o.values()))
+        elif isinstance(o, (list, tuple, set, frozenset, deque)):
+            todo.extend(list(o))
+        elif not isinstance(o, (str, bytes, int, float, bool)) and o is not None:
+            if hasattr(o, '__dict__'):
+                todo.append(o.__dict__)
+            for cls in type(o).__mro__:
+                slots = cls.__dict__.get('__slots__', ())
+                for attr in (slots,) if isinstance(slots, str) else slots:
+                    value = getattr(o, attr, None)
+                    if value is not None:
+                        todo.append(value)
+    return total
+
@@ -0,0 +1,309 @@
+"""Per-process deadline scheduler for game phases, grace periods and room resets.
+
+Every room used to own a handful of sleeping asyncio tasks (phase timers, next-night and
+delayed-reset closures, one grace-period task per dropped player). `PhaseScheduler` replaces
+them with a hashed timer wheel driven by a single wakeup loop: scheduling and cancelling are
+O(1) dict operations, each tick only looks at one slot, and the loop sleeps on an event when
+nothing is pending. Timers are keyed by `(room, kind)` so they can be cancelled, replaced and
+listed per room.
+"""
+
+import asyncio
+import math
+
+from . import logs
+from .clock import Clock
+
+# wheel resolution (seconds) and size; 4096 slots x 50ms covers ~200s per revolution, so the
+# usual phase deadlines (<= 120s) are found on the first pass over their slot
+SCHEDULER_TICK = 0.05
+SCHEDULER_SLOTS = 4096
+
+_log = logs.get('scheduler')
+
+
+class Timer:
+    """One pending deadline. `tick` is the absolute wheel tick it fires on."""
+
+    __slots__ = ('room', 'kind', 'deadline', 'tick', 'slot', 'callback', 'args')
+
+    def __init__(self, room, kind, deadline, tick, callback, args):
+        self.room = room
+        self.kind = kind
+        self.deadline = deadline
+        self.tick = tick
+        self.slot = None
+        self.callback = callback
+        self.args = args
+
+
+class PhaseScheduler:
+    """Hashed timer wheel owning every deadline in the process.
+
+    `call_later(room, kind, delay, callback, *args)` arms a timer, replacing any pending timer
+    with the same room and kind. When it expires the wheel hands `(room, callback, args)` to
+    `dispatch` (e.g. the room's mailbox); without one, `callback(*args)` is called and a
+    coroutine result runs as its own short-lived task so a slow callback never holds up the wheel.
+    `observer(event, timer)`, if given, is told when a timer is 'armed', 'cancelled' or 'fired'
+    (e.g. to journal deadlines); replacing a timer only reports the new one as armed. Deadlines
+    are read from and waited on through `clock` (see `clock.py`).
+    """
+
+    def __init__(self, tick=SCHEDULER_TICK, slots=SCHEDULER_SLOTS, clock=None, dispatch=None, observer=None):
+        self.tick = tick
+        self.clock = clock or Clock()
+        self.dispatch = dispatch
+        self.observer = observer
+        self._slots = [dict() for _ in range(max(1, slots))]
+        # room -> {kind: Timer}
+        self._by_room = {}
+        self._count = 0
+        self._origin = self.clock.monotonic()
+        # last tick whose slot has been processed
+        self._processed = 0
+        self._task = None
+        self._wakeup = None
+        # tick the loop is sleeping until (None while it is not sleeping on the clock), and whether
+        # that sleep has reached the clock yet
+        self._sleeping_until = None
+        self._asleep = False
+        # callbacks currently running (kept referenced until they finish)
+        self._running = set()
+        # statistics
+        self.fired = 0
+        self.cancelled = 0
+        self.errors = 0
+        self.max_lag_ms = 0.0
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if self.running:
+            return
+        self._wakeup = asyncio.Event()
+        if self._count:
+            self._wakeup.set()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the wakeup loop. Pending timers are kept (and fire once the loop is started again)."""
+        task, self._task = self._task, None
+        if task is None:
+            return
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    def use_clock(self, clock):
+        """Switch to another clock (e.g. a `VirtualClock`); only allowed while nothing is pending."""
+        if self._count:
+            raise RuntimeError('cannot change the clock while timers are pending')
+        self.clock = clock
+        self._origin = clock.monotonic()
+        self._processed = 0
+
+    # --- scheduling ---
+
+    def _tick_at(self, when):
+        return math.ceil((when - self._origin) / self.tick)
+
+    def call_later(self, room, kind, delay, callback, *args):
+        """Arm (or re-arm) the `kind` timer of `room` to run `callback(*args)` after `delay` seconds."""
+        self._cancel(room, kind)
+        if not self._count:
+            # idle wheel: nothing to catch up on, continue from the current tick
+            self._processed = max(self._processed, self._tick_at(self.clock.monotonic()) - 1)
+        deadline = self.clock.monotonic() + max(0.0, delay)
+        timer = Timer(room, kind, deadline, max(self._tick_at(deadline), self._processed + 1), callback, args)
+        timer.slot = self._slots[timer.tick % len(self._slots)]
+        timer.slot[timer] = None
+        self._by_room.setdefault(room, {})[kind] = timer
+        self._count += 1
+        if not self.running:
+            self.start()
+        elif self._count == 1 or (self._sleeping_until is not None and timer.tick < self._sleeping_until):
+            # the loop is idle, or asleep until a later slot than this timer's
+            self._wakeup.set()
+        if self.observer is not None:
+            self.observer('armed', timer)
+        return timer
+
+    def cancel(self, room, kind):
+        """Cancel the `kind` timer of `room`; returns whether one was pending."""
+        timer = self._cancel(room, kind)
+        if timer is None:
+            return False
+        if self.observer is not None:
+            self.observer('cancelled', timer)
+        return True
+
+    def _cancel(self, room, kind):
+        timers = self._by_room.get(room)
+        timer = timers.pop(kind, None) if timers else None
+        if timer is None:
+            return None
+        if not timers:
+            del self._by_room[room]
+        self._discard(timer)
+        self.cancelled += 1
+        return timer
+
+    def cancel_room(self, room):
+        """Cancel every timer of `room`; returns how many were pending."""
+        timers = self._by_room.pop(room, None) or {}
+        for timer in timers.values():
+            self._discard(timer)
+            if self.observer is not None:
+                self.observer('cancelled', timer)
+        self.cancelled += len(timers)
+        return len(timers)
+
+    def _discard(self, timer):
+        if timer.slot is not None:
+            timer.slot.pop(timer, None)
+            timer.slot = None
+            self._count -= 1
+
+    def is_pending(self, room, kind):
+        return kind in self._by_room.get(room, ())
+
+    def idle(self):
+        """True when no timer callback is running and the wakeup loop is parked on the clock (or has
+        nothing to wait for); pending timers do not count. Lets a virtual clock tell when to move on."""
+        if self._running or (self._wakeup is not None and self._wakeup.is_set()):
+            return False
+        return not self._count or self._asleep or not self.running
+
+    # --- introspection ---
+
+    def pending(self, room):
+        """Pending deadlines of one room, soonest first."""
+        now = self.clock.monotonic()
+        timers = sorted((self._by_room.get(room) or {}).values(), key=lambda t: t.deadline)
+        return [{'kind': t.kind, 'due_in': round(max(0.0, t.deadline - now), 3)} for t in timers]
+
+    def timers(self, room):
+        """The pending `Timer`s of one room (kind, deadline, callback and args)."""
+        return list((self._by_room.get(room) or {}).values())
+
+    def pending_by_room(self):
+        """Pending deadlines of every room: {room: [{'kind', 'due_in'}, ...]}."""
+        return {room: self.pending(room) for room in list(self._by_room)}
+
+    def stats(self):
+        return {
+            'running': self.running,
+            'pending': self._count,
+            'rooms': len(self._by_room),
+            'tick_ms': self.tick * 1000,
+            'slots': len(self._slots),
+            'fired': self.fired,
+            'cancelled': self.cancelled,
+            'errors': self.errors,
+            'callbacks_running': len(self._running),
+            'max_lag_ms': round(self.max_lag_ms, 2),
+        }
+
+    # --- wakeup loop ---
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            if not self._count:
+                await self._wakeup.wait()
+                continue
+            # sleep straight to the next occupied slot rather than waking on every tick
+            tick = self._next_tick()
+            delay = self._origin + tick * self.tick - self.clock.monotonic()
+            if delay > 0:
+                self._sleeping_until = tick
+                try:
+                    await self._sleep(delay)
+                finally:
+                    self._sleeping_until = None
+            self._advance(self._tick_at(self.clock.monotonic()))
+
+    def _next_tick(self):
+        """First tick after the processed one whose slot holds a timer (at most one revolution ahead)."""
+        slots = self._slots
+        for tick in range(self._processed + 1, self._processed + len(slots) + 1):
+            if slots[tick % len(slots)]:
+                return tick
+        return self._processed + len(slots)
+
+    async def _sleep(self, delay):
+        """Sleep on the clock for `delay` seconds, or until an earlier timer is armed."""
+        sleeper = asyncio.ensure_future(self._clock_sleep(delay))
+        woken = asyncio.ensure_future(self._wakeup.wait())
+        try:
+            await asyncio.wait((sleeper, woken), return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            self._asleep = False
+            sleeper.cancel()
+            woken.cancel()
+
+    async def _clock_sleep(self, delay):
+        self._asleep = True
+        await self.clock.sleep(delay)
+
+    def _advance(self, now_tick):
+        """Fire everything due up to `now_tick`, visiting each slot at most once."""
+        slots = self._slots
+        first = self._processed + 1
+        last = min(now_tick, self._processed + len(slots))
+        for tick in range(first, last + 1):
+            slot = slots[tick % len(slots)]
+            if slot:
+                due = [t for t in slot if t.tick <= now_tick]
+                for timer in due:
+                    self._expire(timer)
+        self._processed = max(self._processed, now_tick)
+
+    def _expire(self, timer):
+        self._discard(timer)
+        self.fired += 1
+        lag_ms = (self.clock.monotonic() - timer.deadline) * 1000
+        if lag_ms > self.max_lag_ms:
+            self.max_lag_ms = lag_ms
+        try:
+            if self.dispatch is not None:
+                # stays registered until it runs, so a handler queued ahead of it can still cancel it
+                self.dispatch(timer.room, self._run_dispatched, timer)
+                return
+            self._forget(timer)
+            result = timer.callback(*timer.args)
+        except Exception as e:
+            self.errors += 1
+            _log.error('timer failed', room=timer.room, kind=timer.kind, error=e)
+            return
+        if asyncio.iscoroutine(result):
+            task = asyncio.create_task(result)
+            self._running.add(task)
+            task.add_done_callback(self._callback_done)
+
+    def _run_dispatched(self, timer):
+        if self._forget(timer):
+            return timer.callback(*timer.args)
+        return None
+
+    def _forget(self, timer):
+        """Unregister an expired timer; False if it was cancelled or replaced in the meantime."""
+        timers = self._by_room.get(timer.room)
+        if timers is None or timers.get(timer.kind) is not timer:
+            return False
+        del timers[timer.kind]
+        if not timers:
+            del self._by_room[timer.room]
+        if self.observer is not None:
+            self.observer('fired', timer)
+        return True
+
+    def _callback_done(self, task):
+        self._running.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            self.errors += 1
+            _log.error('timer callback failed', error=task.exception())
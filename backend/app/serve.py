@@ -0,0 +1,81 @@
+"""Production launcher: `python -m backend.app.serve`.
+
+Runs `backend.app.main:asgi_app` under uvicorn with the fastest event loop and HTTP parser that
+are installed (uvloop and httptools when present, the pure-Python asyncio/h11 otherwise) and a
+configurable number of worker processes. Settings come from the command line or the environment:
+
+- `HOST` / `PORT` (default 0.0.0.0:8000; hosting platforms usually set `PORT`)
+- `WEB_CONCURRENCY` worker processes (default 1). Several workers need a way to share rooms:
+  `STATE_BACKEND` defaults to `sqlite` for them. They also share one port, so an Engine.IO
+  long-polling session cannot stay on its worker: `SOCKETIO_TRANSPORTS` defaults to `websocket`
+  (the bundled client connects that way). Allow `polling,websocket` only if something in front
+  of the server keeps every request of a session on the same worker.
+- With room sharding (`SHARD_WORKERS`) every shard is its own launcher process with its own
+  `SHARD_SELF` and `PORT`; several workers per shard are refused.
+- `DRAIN_TIMEOUT` seconds a worker spends draining on SIGTERM (see `main.drain()`) and
+  `SHUTDOWN_TIMEOUT` seconds it then waits for open requests before closing them.
+
+    pip install uvloop httptools   # optional, picked up automatically
+    WEB_CONCURRENCY=4 python -m backend.app.serve
+"""
+
+import argparse
+import importlib.util
+import os
+
+import uvicorn
+
+APP = 'backend.app.main:asgi_app'
+
+
+def _installed(module):
+    return importlib.util.find_spec(module) is not None
+
+
+def pick_loop():
+    return 'uvloop' if _installed('uvloop') else 'asyncio'
+
+
+def pick_http():
+    return 'httptools' if _installed('httptools') else 'h11'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--host', default=os.environ.get('HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 8000)))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('WEB_CONCURRENCY', 1)))
+    parser.add_argument('--shutdown-timeout', type=float, default=float(os.environ.get('SHUTDOWN_TIMEOUT', 5)),
+                        help='seconds to wait for open requests after the drain')
+    parser.add_argument('--reload', action='store_true', help='restart on code changes (development)')
+    args = parser.parse_args()
+
+    workers = max(1, args.workers)
+    if workers > 1 and os.environ.get('SHARD_WORKERS'):
+        # the workers would share one SHARD_SELF, port and journal while each holds its own rooms
+        parser.error('room sharding runs one worker per process: start each shard separately, '
+                     'with its own SHARD_SELF and port, instead of using --workers/WEB_CONCURRENCY > 1')
+    if workers > 1 and not args.reload:
+        # every worker must see the same rooms; the variables are inherited by the worker processes
+        os.environ.setdefault('STATE_BACKEND', 'sqlite')
+        # the workers share one port, so the polls of a long-polling session land on random workers
+        # (400 Invalid session): refuse polling outright unless a sticky load balancer is configured
+        os.environ.setdefault('SOCKETIO_TRANSPORTS', 'websocket')
+    loop, http = pick_loop(), pick_http()
+    print(f"[serve] {APP} on {args.host}:{args.port}: {workers} worker(s), loop={loop}, http={http}, "
+          f"state backend={os.environ.get('STATE_BACKEND', 'memory')}, "
+          f"transports={os.environ.get('SOCKETIO_TRANSPORTS', 'polling,websocket')}")
+    uvicorn.run(
+        APP,
+        host=args.host,
+        port=args.port,
+        workers=None if args.reload else workers,
+        reload=args.reload,
+        loop=loop,
+        http=http,
+        timeout_graceful_shutdown=args.shutdown_timeout,
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""Room-affinity sharding: each room lives on one worker picked by hashing the room id.
+
+This is the alternative to a shared state backend. Every worker keeps its rooms, timers and
+chat cache purely in memory, and requests for a room that belongs elsewhere are sent to the
+owner: HTTP calls under `/rooms/{id}/` get a 307 redirect, and Socket.IO clients are refused
+at connect time (or told on their first room event) with the owner's URL so they reconnect.
+
+Ownership uses rendezvous (highest-random-weight) hashing over the worker names, so adding a
+worker moves only the rooms the new worker wins (~1/N of them) and every worker computes the
+same answer from the same table without talking to the others. `pins` override the hash for
+rooms that must stay where they are while a game is running there (see `POST /admin/shards`).
+
+Configure with `SHARD_WORKERS="w0=http://10.0.0.5:8001,w1=http://10.0.0.5:8002"` and
+`SHARD_SELF=w0`; without them sharding is off and this worker serves every room.
+"""
+
+import hashlib
+import os
+
+# cached room -> owner decisions (cleared whenever the table changes)
+SHARD_CACHE_SIZE = 100000
+
+
+def parse_workers(spec):
+    """'w0=http://a:8001,w1=http://a:8002' -> {'w0': 'http://a:8001', 'w1': 'http://a:8002'}"""
+    workers = {}
+    for item in (spec or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        name, sep, url = item.partition('=')
+        if not sep or not name.strip() or not url.strip():
+            raise ValueError(f'bad SHARD_WORKERS entry {item!r} (expected name=url)')
+        workers[name.strip()] = url.strip().rstrip('/')
+    return workers
+
+
+def _weight(worker, room):
+    return hashlib.blake2b(f'{worker}\0{room}'.encode(), digest_size=8).digest()
+
+
+class ShardMap:
+    """The routing table: worker name -> base URL, this worker's name, and pinned rooms."""
+
+    def __init__(self, workers=None, self_name=None, pins=None):
+        self.workers = dict(workers or {})
+        self.self_name = self_name
+        self.pins = dict(pins or {})
+        self.version = 0
+        self._cache = {}
+        if self.enabled and self_name not in self.workers:
+            raise ValueError(f'SHARD_SELF {self_name!r} is not one of SHARD_WORKERS')
+
+    @classmethod
+    def from_env(cls):
+        return cls(parse_workers(os.environ.get('SHARD_WORKERS')), os.environ.get('SHARD_SELF'))
+
+    @property
+    def enabled(self):
+        return bool(self.workers) and bool(self.self_name)
+
+    def owner(self, room):
+        """Name of the worker that serves `room`."""
+        if not self.enabled:
+            return self.self_name
+        owner = self.pins.get(room)
+        if owner is not None and owner in self.workers:
+            return owner
+        owner = self._cache.get(room)
+        if owner is None:
+            owner = max(self.workers, key=lambda w: _weight(w, room))
+            if len(self._cache) >= SHARD_CACHE_SIZE:
+                self._cache.clear()
+            self._cache[room] = owner
+        return owner
+
+    def is_local(self, room):
+        return not self.enabled or self.owner(room) == self.self_name
+
+    def url_for(self, room):
+        return self.workers.get(self.owner(room))
+
+    def update(self, workers, pins=None):
+        """Install a new table (e.g. with a worker added); pins naming unknown workers are dropped."""
+        workers = dict(workers)
+        if self.self_name not in workers:
+            raise ValueError(f'the new table does not include this worker ({self.self_name!r})')
+        self.workers = workers
+        self.pins = {room: w for room, w in (pins or {}).items() if w in workers}
+        self.version += 1
+        self._cache = {}
+
+    def table(self):
+        return {'self': self.self_name, 'workers': self.workers, 'pins': self.pins, 'version': self.version}
@@ -0,0 +1,463 @@
+"""In-memory room model used by the Socket.IO handlers in main.py.
+
+A room used to be two loose dicts (`_rooms[room]` = list of client player dicts and
+`_room_meta[room]` = free-form dict); it is now one `RoomState` with explicit fields and an
+id-keyed player index, so every player lookup is O(1) and per-room memory stays small.
+
+`RoomState` also maintains an alive-by-role index (role -> alive player ids) that is updated on
+join, role assignment, elimination, leave and reset, so role counts, win checks and "has every
+alive player voted" are O(1) instead of a roster scan per event.
+
+Every client-visible change (roster, host, eliminations, alive role members) is also recorded
+in a pending patch. `take_update()` turns it into a versioned `room_patch` payload, or into a
+full `room_state` snapshot after changes that touch everyone (role assignment, game reset).
+
+Mutators marked `@_journaled` report themselves (name and arguments) to `RoomState.journal` when
+one is attached, so the game journal can rebuild a room by calling the same methods again
+(`apply`); `to_record()` / `from_record()` are the snapshots that let it compact the log.
+"""
+
+import functools
+
+ROLES = ('Killer', 'Doctor', 'Detective', 'Civilian')
+
+# names of the mutators that are journaled (and may be replayed by `RoomState.apply`)
+JOURNAL_OPS = set()
+
+
+def _journaled(method):
+    op = method.__name__
+    JOURNAL_OPS.add(op)
+
+    @functools.wraps(method)
+    def wrapper(self, *args):
+        journal = self.journal
+        if journal is None:
+            return method(self, *args)
+        # mutators called from inside this one are part of the same entry
+        self.journal = None
+        try:
+            result = method(self, *args)
+        finally:
+            self.journal = journal
+        journal(self.room_id, op, args)
+        return result
+    return wrapper
+
+
+class Player:
+    """A player in a room. `data` is the player dict exactly as the client sent it on join."""
+
+    __slots__ = ('id', 'name', 'data', 'sids', 'role', 'alive', 'ready')
+
+    def __init__(self, data: dict):
+        self.id = data.get('id')
+        self.name = data.get('name')
+        self.data = data
+        # active socket ids for this player (one per open tab)
+        self.sids = set()
+        # assigned role for the current game (None outside a game)
+        self.role = None
+        self.alive = True
+        self.ready = False
+
+    @property
+    def effective_role(self):
+        # players without an assignment count as civilians
+        return self.role or 'Civilian'
+
+    def public(self):
+        return {'id': self.id, 'name': self.name}
+
+
+class RoomState:
+    """All server-side state of one room: roster, host, game phase and per-round actions."""
+
+    __slots__ = (
+        'room_id', 'players', 'host_id', 'settings', 'in_game', 'phase', 'phase_info',
+        'killer_room', 'doctor_room',
+        'night_kill', 'doctor_save', 'detective_check',
+        'killer_actions', 'doctor_actions', 'detective_actions', 'votes',
+        'alive_by_role', 'alive_total', 'alive_voted',
+        'version', '_patch', '_patch_full', 'journal',
+    )
+
+    def __init__(self, room_id: str):
+        self.room_id = room_id
+        # player id -> Player, in join order (join order decides host promotion)
+        self.players = {}
+        self.host_id = None
+        self.settings = {}
+        self.in_game = False
+        self.phase = None
+        # the last public `phase` payload (timer start and duration), resent to players who rejoin
+        self.phase_info = None
+        # private Socket.IO rooms for team chat, set while a game is running
+        self.killer_room = None
+        self.doctor_room = None
+        # per-round decisions
+        self.night_kill = None
+        self.doctor_save = None
+        self.detective_check = None
+        self.killer_actions = {}
+        self.doctor_actions = {}
+        self.detective_actions = {}
+        self.votes = {}
+        # role -> {player id: None} of alive players (dicts used as insertion-ordered sets, in join order)
+        self.alive_by_role = {}
+        self.alive_total = 0
+        # how many alive players have a vote recorded in `votes`
+        self.alive_voted = 0
+        # room_state version (bumped on every broadcast update) and changes not yet broadcast
+        self.version = 0
+        self._patch = None
+        self._patch_full = False
+        # callable(room_id, op, args) told about every journaled mutation, or None
+        self.journal = None
+        # phase deadlines and grace-period removals live in main.scheduler, keyed by room id
+
+    # --- roster ---
+
+    def get_player(self, pid):
+        return self.players.get(pid)
+
+    @_journaled
+    def add_player(self, data: dict):
+        """Add a player (ignoring duplicates) and return their Player."""
+        pid = data.get('id')
+        player = self.players.get(pid)
+        if player is None:
+            player = Player(data)
+            self.players[pid] = player
+            self._index_add(player)
+            self._patch_list('players_added').append(data)
+        return player
+
+    @_journaled
+    def remove_player(self, pid):
+        player = self.players.pop(pid, None)
+        if player is not None:
+            self._index_discard(player)
+            added = self._patch_list('players_added')
+            # a player added and removed within the same patch never reaches the client
+            kept = [d for d in added if d.get('id') != pid]
+            if len(kept) != len(added):
+                self._patch['players_added'] = kept
+            else:
+                self._patch_list('players_removed').append(pid)
+            if self.host_id == pid:
+                self.promote_host()
+        return player
+
+    @_journaled
+    def set_host(self, pid):
+        if pid != self.host_id:
+            self.host_id = pid
+            self._pending()['host_id'] = pid
+
+    def promote_host(self):
+        """Make the longest-present player host (or nobody if the room is empty)."""
+        self.set_host(next(iter(self.players), None))
+
+    def player_list(self):
+        """Client-facing roster: the player dicts as sent by each client, in join order."""
+        return [p.data for p in self.players.values()]
+
+    def public_players(self):
+        return [p.public() for p in self.players.values()]
+
+    # --- roles / life ---
+
+    def role_of(self, pid):
+        player = self.players.get(pid)
+        return player.role if player else None
+
+    def is_eliminated(self, pid):
+        player = self.players.get(pid)
+        return player is not None and not player.alive
+
+    @_journaled
+    def eliminate(self, pid):
+        player = self.players.get(pid)
+        if player is not None and player.alive:
+            self._index_discard(player)
+            player.alive = False
+            self._patch_list('eliminated').append(pid)
+
+    def alive_players(self):
+        return [p for p in self.players.values() if p.alive]
+
+    def alive_ids(self, role=None):
+        """Alive player ids (of one role, or all), in join order within a role."""
+        if role is not None:
+            return list(self.alive_by_role.get(role, ()))
+        return [pid for members in self.alive_by_role.values() for pid in members]
+
+    def alive_count(self, role=None):
+        if role is None:
+            return self.alive_total
+        return len(self.alive_by_role.get(role, ()))
+
+    def role_counts(self):
+        return {role: len(members) for role, members in self.alive_by_role.items() if members}
+
+    def eliminated_map(self):
+        return {p.id: True for p in self.players.values() if not p.alive}
+
+    def assign_roles(self, assigned):
+        """Apply `_assign_roles_to_players` output and revive everyone for a new game."""
+        for p in self.players.values():
+            p.role = None
+            p.alive = True
+        for entry in assigned:
+            player = self.players.get(entry.get('id'))
+            if player is not None:
+                player.role = entry.get('role')
+        self._rebuild_index()
+        # everyone's role membership changed: clients get a full snapshot
+        self._patch_full = True
+
+    def alive_role_members(self):
+        players = self.players
+        return {role: [players[pid].public() for pid in members] for role, members in self.alive_by_role.items() if members}
+
+    def snapshot(self, players=None):
+        """The `room_state` payload: roster, host, eliminated map and alive members per role."""
+        return {
+            'version': self.version,
+            'players': self.player_list() if players is None else players,
+            'host_id': self.host_id,
+            'eliminated': self.eliminated_map(),
+            'alive_role_members': self.alive_role_members(),
+            'role_counts': self.role_counts(),
+        }
+
+    # --- alive-by-role index ---
+
+    def _index_add(self, player):
+        if player.alive:
+            self.alive_by_role.setdefault(player.effective_role, {})[player.id] = None
+            self.alive_total += 1
+            self._pending().setdefault('alive_added', {}).setdefault(player.effective_role, []).append(player.public())
+
+    def _index_discard(self, player):
+        if not player.alive:
+            return
+        members = self.alive_by_role.get(player.effective_role)
+        if members is not None and player.id in members:
+            del members[player.id]
+            self.alive_total -= 1
+            added = self._pending().get('alive_added', {}).get(player.effective_role)
+            kept = [m for m in added or () if m['id'] != player.id]
+            if added is not None and len(kept) != len(added):
+                self._patch['alive_added'][player.effective_role] = kept
+            else:
+                self._patch_list('alive_removed').append(player.id)
+            # a player who stops being alive no longer counts towards "everyone has voted"
+            if player.id in self.votes:
+                self.alive_voted -= 1
+
+    def _rebuild_index(self):
+        self.alive_by_role = {}
+        self.alive_total = 0
+        for p in self.players.values():
+            self._index_add(p)
+        self.alive_voted = sum(1 for pid in self.votes if self.is_alive(pid))
+
+    def is_alive(self, pid):
+        player = self.players.get(pid)
+        return player is not None and player.alive
+
+    # --- voting ---
+
+    def reset_votes(self):
+        self.votes = {}
+        self.alive_voted = 0
+
+    @_journaled
+    def cast_vote(self, vid, target):
+        """Record (or replace) a vote and return the voter's previous choice."""
+        first = vid not in self.votes
+        prev = self.votes.get(vid)
+        self.votes[vid] = target
+        if first and self.is_alive(vid):
+            self.alive_voted += 1
+        return prev
+
+    def all_alive_voted(self):
+        return self.alive_voted >= self.alive_total
+
+    # --- readiness ---
+
+    @_journaled
+    def set_ready(self, pid):
+        player = self.players.get(pid)
+        if player is not None:
+            player.ready = True
+
+    def ready_ids(self):
+        return [p.id for p in self.players.values() if p.ready]
+
+    def all_ready(self):
+        return bool(self.players) and all(p.ready for p in self.players.values())
+
+    # --- game flow ---
+
+    @_journaled
+    def set_settings(self, settings):
+        self.settings = settings
+
+    @_journaled
+    def start_game(self, assigned, killer_room, doctor_room):
+        """Assign roles (reviving everyone) and enter the pre-night phase."""
+        self.assign_roles(assigned)
+        self.in_game = True
+        self.killer_room = killer_room
+        self.doctor_room = doctor_room
+        self.enter_phase('pre_night')
+
+    @_journaled
+    def enter_phase(self, phase, info=None):
+        """Move to `phase`, clearing the per-round state it starts afresh. `info` is the public payload."""
+        self.phase = phase
+        self.phase_info = info
+        if phase == 'killer':
+            self.reset_night()
+        elif phase == 'doctor':
+            self.doctor_save = None
+            self.doctor_actions = {}
+        elif phase == 'voting':
+            self.reset_votes()
+
+    @_journaled
+    def record_kill(self, pid, target, skipped=False):
+        self.night_kill = {'target': None, 'by': pid, 'skipped': True} if skipped else {'target': target, 'by': pid}
+        self.killer_actions[pid] = None if skipped else target
+
+    @_journaled
+    def record_save(self, pid, target, skipped=False):
+        self.doctor_save = {'target': None, 'by': pid, 'skipped': True} if skipped else {'target': target, 'by': pid}
+        self.doctor_actions[pid] = None if skipped else target
+
+    @_journaled
+    def record_check(self, pid, target):
+        self.detective_check = {'target': target, 'by': pid}
+        self.detective_actions[pid] = target
+
+    @_journaled
+    def end_game(self):
+        """Game over: leave the game and clear ready marks so the lobby must re-ready."""
+        self.enter_phase('ended')
+        self.in_game = False
+        self.clear_ready()
+
+    # --- rounds ---
+
+    def reset_night(self):
+        self.killer_actions = {}
+        self.doctor_actions = {}
+        self.night_kill = None
+        self.doctor_save = None
+
+    @_journaled
+    def reset_game(self):
+        """Back to a fresh lobby with the same roster, host and settings."""
+        self.in_game = False
+        self.phase = None
+        self.killer_room = None
+        self.doctor_room = None
+        self.reset_night()
+        self.detective_check = None
+        self.detective_actions = {}
+        self.reset_votes()
+        for p in self.players.values():
+            p.role = None
+            p.alive = True
+            p.ready = False
+        self._rebuild_index()
+        self._patch_full = True
+
+    def clear_ready(self):
+        for p in self.players.values():
+            p.ready = False
+
+    # --- journal ---
+
+    def apply(self, op, args):
+        """Replay one journaled mutation."""
+        if op not in JOURNAL_OPS:
+            raise ValueError(f'not a journaled room operation: {op!r}')
+        return getattr(self, op)(*args)
+
+    def to_record(self):
+        """Everything needed to rebuild this room (JSON-serializable); see `from_record`."""
+        return {
+            'room': self.room_id,
+            'players': [[p.data, p.role, p.alive, p.ready] for p in self.players.values()],
+            'host_id': self.host_id,
+            'settings': self.settings,
+            'in_game': self.in_game,
+            'phase': self.phase,
+            'phase_info': self.phase_info,
+            'killer_room': self.killer_room,
+            'doctor_room': self.doctor_room,
+            'night_kill': self.night_kill,
+            'doctor_save': self.doctor_save,
+            'detective_check': self.detective_check,
+            'killer_actions': self.killer_actions,
+            'doctor_actions': self.doctor_actions,
+            'detective_actions': self.detective_actions,
+            'votes': self.votes,
+            'version': self.version,
+        }
+
+    @classmethod
+    def from_record(cls, record):
+        state = cls(record['room'])
+        for data, role, alive, ready in record['players']:
+            player = Player(data)
+            player.role, player.alive, player.ready = role, alive, ready
+            state.players[player.id] = player
+        for key in ('host_id', 'settings', 'in_game', 'phase', 'phase_info', 'killer_room', 'doctor_room',
+                    'night_kill', 'doctor_save', 'detective_check',
+                    'killer_actions', 'doctor_actions', 'detective_actions', 'votes', 'version'):
+            setattr(state, key, record[key])
+        state._rebuild_index()
+        state._patch = None
+        return state
+
+    # --- versioned updates ---
+
+    def _pending(self):
+        if self._patch is None:
+            self._patch = {}
+        return self._patch
+
+    def _patch_list(self, key):
+        return self._pending().setdefault(key, [])
+
+    def take_update(self, players=None):
+        """Consume changes since the last broadcast and return `(event, payload)` to emit.
+
+        Returns ('room_patch', delta) for incremental changes, ('room_state', snapshot) after a
+        change that touches every player, or (None, None) when nothing changed. Either way the
+        version is bumped, and a patch names the version it applies on top of (`base`) so a
+        client that missed one can ask for a fresh snapshot. `players` overrides the roster of
+        a full snapshot (see `snapshot`).
+        """
+        patch, full = self._patch, self._patch_full
+        self._patch, self._patch_full = None, False
+        if full:
+            self.version += 1
+            return 'room_state', self.snapshot(players=players)
+        if patch and 'alive_added' in patch:
+            patch['alive_added'] = {role: members for role, members in patch['alive_added'].items() if members}
+        changes = {k: v for k, v in (patch or {}).items() if v or k == 'host_id'}
+        if not changes:
+            return None, None
+        self.version += 1
+        delta = {'room': self.room_id, 'version': self.version, 'base': self.version - 1}
+        delta.update(changes)
+        if 'alive_added' in delta or 'alive_removed' in delta:
+            delta['role_counts'] = self.role_counts()
+        return 'room_patch', delta
@@ -0,0 +1,449 @@
+"""Where room ownership, room snapshots and cross-worker messages live.
+
+Game state is mutable and timer-driven, so each room is still run by exactly one worker process
+(its owner) inside that worker's room mailbox. What the backend adds is everything the other
+workers need to serve the same rooms:
+
+- `claim_room()` leases a room to the first worker that handles it; the lease is renewed while
+  the worker runs the room and released by `forget_room()` or on shutdown. A worker that takes over a room whose owner stopped
+  (or crashed and let its lease lapse) gets the room's last record back to rebuild it from.
+- `send()` / `subscribe()` form a small message bus. Room events that arrive on a non-owner
+  worker are forwarded to the owner, and python-socketio's `AsyncPubSubManager` rides on the
+  same bus (`SQLiteClientManager`) so emits, room joins and disconnects reach every worker.
+- `publish_snapshot()` / `load_snapshot()` keep the latest `room_state` of each room readable
+  by every worker's HTTP routes, and `publish_record()` keeps its record (`RoomState.to_record()`
+  plus pending deadlines) for the worker that takes it over next.
+
+`InProcessBackend` is the single-worker default and does no I/O. `SQLiteStateBackend` shares one
+SQLite file (WAL) between the workers of a host: `STATE_BACKEND=sqlite` or `sqlite:/path/to.db`.
+"""
+
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+from socketio.async_pubsub_manager import AsyncPubSubManager
+
+from . import logs
+
+# seconds a room stays leased to its owner without a renewal
+STATE_LEASE_SECONDS = float(os.environ.get('STATE_LEASE_SECONDS', 15))
+# how often workers poll the shared bus, and how long delivered messages are kept
+STATE_POLL_INTERVAL = float(os.environ.get('STATE_POLL_INTERVAL', 0.02))
+STATE_BUS_RETENTION = float(os.environ.get('STATE_BUS_RETENTION', 60))
+# undelivered messages kept per subscriber (e.g. broadcasts before any socket connected)
+STATE_SUBSCRIBER_BACKLOG = 10000
+
+_log = logs.get('state_backend')
+
+
+def _worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}'
+
+
+class _Subscription:
+    """Bounded per-channel inbox; the oldest message is dropped when a reader falls behind."""
+
+    def __init__(self, maxsize=STATE_SUBSCRIBER_BACKLOG):
+        self.queue = asyncio.Queue(maxsize)
+        self.dropped = 0
+
+    def put(self, message):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(message)
+
+
+class InProcessBackend:
+    """Single-worker backend: this process owns every room and nothing leaves memory."""
+
+    shared = False
+
+    def __init__(self, worker_id=None):
+        self.worker_id = worker_id or _worker_id()
+
+    def client_manager(self):
+        # python-socketio's default in-memory manager
+        return None
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def claim_room(self, room):
+        return self.worker_id, None
+
+    async def hand_over(self):
+        pass
+
+    def forget_room(self, room):
+        pass
+
+    def publish_snapshot(self, room, snapshot_fn):
+        pass
+
+    def publish_record(self, room, record_fn):
+        pass
+
+    async def load_snapshot(self, room):
+        return None
+
+    def subscribe(self, channel, callback=None):
+        raise RuntimeError('the in-process state backend has no message bus')
+
+    async def send(self, channel, message):
+        raise RuntimeError('the in-process state backend has no message bus')
+
+    def stats(self):
+        return {'backend': 'memory', 'worker_id': self.worker_id}
+
+
+class SQLiteStateBackend:
+    """Backend shared by the workers of one host through a SQLite file."""
+
+    shared = True
+
+    def __init__(self, path, worker_id=None, lease=STATE_LEASE_SECONDS, poll_interval=STATE_POLL_INTERVAL,
+                 retention=STATE_BUS_RETENTION):
+        self.path = path
+        self.worker_id = worker_id or _worker_id()
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._conns = []
+        # channel -> _Subscription (queue) or callback
+        self._subscribers = {}
+        self._last_id = None
+        self._owned = set()
+        # rooms given up by `forget_room()` whose lease is released on the next flush
+        self._released = set()
+        # room -> {'snapshot' / 'record': zero-arg callable returning what to publish on the next flush}
+        self._dirty = {}
+        self._task = None
+        self._manager = None
+        # held while leases are renewed or handed over, so a renewal cannot undo a hand-over
+        self._leases = asyncio.Lock()
+        # statistics
+        self.sent = 0
+        self.received = 0
+        self.claims = 0
+        self.snapshots_written = 0
+        self.records_written = 0
+        self.rooms_taken_over = 0
+        self.errors = 0
+        self._schema_ready = False
+
+    # --- connections / schema ---
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA busy_timeout=5000')
+            self._local.conn = conn
+            with self._lock:
+                self._conns.append(conn)
+        return conn
+
+    def _init_schema(self):
+        self._conn().executescript('''
+            CREATE TABLE IF NOT EXISTS state_rooms (
+                room TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                lease_until REAL NOT NULL,
+                snapshot TEXT,
+                record TEXT,
+                updated REAL
+            );
+            CREATE TABLE IF NOT EXISTS state_bus (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                channel TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                ts REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_state_bus_ts ON state_bus (ts);
+        ''')
+        columns = {row[1] for row in self._conn().execute('PRAGMA table_info(state_rooms)')}
+        if 'record' not in columns:
+            # state.db written before room records existed
+            self._conn().execute('ALTER TABLE state_rooms ADD COLUMN record TEXT')
+
+    def client_manager(self):
+        if self._manager is None:
+            self._manager = SQLiteClientManager(self)
+        return self._manager
+
+    # --- lifecycle ---
+
+    async def start(self):
+        if self._task is not None and not self._task.done():
+            return
+        if not self._schema_ready:
+            # the file is first opened here (in the lifespan), not when the app is imported
+            await asyncio.to_thread(self._init_schema)
+            self._schema_ready = True
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        try:
+            await asyncio.to_thread(self._write_snapshots, self._take_snapshots())
+            # hand our rooms over right away instead of waiting for the leases to lapse
+            await asyncio.to_thread(self._release_all)
+        except Exception as e:
+            _log.error('shutdown release failed', error=e)
+        with self._lock:
+            conns, self._conns = self._conns, []
+            self._local = threading.local()
+        for conn in conns:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    # --- room ownership ---
+
+    async def claim_room(self, room):
+        """Lease `room` to this worker unless another live worker holds it.
+
+        Returns `(owner, record)`: `record` is the last record another worker published for the
+        room when this claim took it over from them, None otherwise.
+        """
+        owner, record = await asyncio.to_thread(self._claim_sync, room)
+        self.claims += 1
+        if owner == self.worker_id:
+            self._owned.add(room)
+            self._released.discard(room)
+        if record is not None:
+            self.rooms_taken_over += 1
+        return owner, json.loads(record) if record else None
+
+    def _claim_sync(self, room):
+        now = time.time()
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT owner, record FROM state_rooms WHERE room = ?', (room,)).fetchone()
+            conn.execute(
+                'INSERT INTO state_rooms (room, owner, lease_until) VALUES (?, ?, ?) '
+                'ON CONFLICT(room) DO UPDATE SET owner = excluded.owner, lease_until = excluded.lease_until '
+                'WHERE state_rooms.owner = excluded.owner OR state_rooms.lease_until < ?',
+                (room, self.worker_id, now + self.lease, now),
+            )
+            owner = conn.execute('SELECT owner FROM state_rooms WHERE room = ?', (room,)).fetchone()[0]
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        taken_over = row is not None and row[0] != self.worker_id and owner == self.worker_id
+        return owner, row[1] if taken_over else None
+
+    def forget_room(self, room):
+        """Stop running a room: its lease is no longer renewed, and released on the next flush."""
+        self._owned.discard(room)
+        self._released.add(room)
+
+    def _renew_sync(self, rooms):
+        if rooms:
+            self._conn().execute(
+                'UPDATE state_rooms SET lease_until = ? WHERE owner = ? AND room IN (SELECT value FROM json_each(?))',
+                (time.time() + self.lease, self.worker_id, json.dumps(rooms)))
+
+    async def hand_over(self):
+        """Write every pending snapshot and record and release all leases now, for a worker about to
+        stop (see `main.drain`): its rooms can be taken over as soon as their players come back.
+        The other workers are told on `rooms_released` so they stop forwarding to this one."""
+        async with self._leases:
+            rooms = sorted(self._owned)
+            await asyncio.to_thread(self._write_snapshots, self._take_snapshots())
+            await asyncio.to_thread(self._release_all)
+        if rooms:
+            await self.send('rooms_released', {'worker': self.worker_id, 'rooms': rooms})
+
+    def _release_all(self):
+        self._conn().execute('UPDATE state_rooms SET lease_until = 0 WHERE owner = ?', (self.worker_id,))
+        self._owned.clear()
+
+    # --- snapshots ---
+
+    def publish_snapshot(self, room, snapshot_fn):
+        """Mark a room's snapshot stale; `snapshot_fn()` is called on the next background flush."""
+        self._dirty.setdefault(room, {})['snapshot'] = snapshot_fn
+
+    def publish_record(self, room, record_fn):
+        """Mark a room's record stale; `record_fn()` (None for a room that is gone) is called on the
+        next background flush."""
+        self._dirty.setdefault(room, {})['record'] = record_fn
+
+    def _take_snapshots(self):
+        """Serialize the dirty snapshots and records and take the rooms to release; runs on the event
+        loop, which owns the room state."""
+        dirty, self._dirty = self._dirty, {}
+        released, self._released = self._released, set()
+        now = time.time()
+        snapshots, records = [], []
+        for room, fns in dirty.items():
+            try:
+                if 'snapshot' in fns:
+                    snapshots.append((json.dumps(fns['snapshot']()), now, room, self.worker_id))
+                if 'record' in fns:
+                    record = fns['record']()
+                    records.append((None if record is None else json.dumps(record), now, room, self.worker_id))
+            except Exception as e:
+                self.errors += 1
+                _log.error('snapshot failed', room=room, error=e)
+        return snapshots, records, [(room, self.worker_id) for room in released]
+
+    def _write_snapshots(self, rows):
+        snapshots, records, released = rows
+        if not snapshots and not records and not released:
+            return
+        conn = self._conn()
+        conn.execute('BEGIN')
+        try:
+            conn.executemany('UPDATE state_rooms SET snapshot = ?, updated = ? WHERE room = ? AND owner = ?', snapshots)
+            conn.executemany('UPDATE state_rooms SET record = ?, updated = ? WHERE room = ? AND owner = ?', records)
+            conn.executemany('UPDATE state_rooms SET lease_until = 0, record = NULL WHERE room = ? AND owner = ?', released)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        self.snapshots_written += len(snapshots)
+        self.records_written += len(records)
+
+    async def load_snapshot(self, room):
+        row = await asyncio.to_thread(
+            lambda: self._conn().execute('SELECT snapshot FROM state_rooms WHERE room = ?', (room,)).fetchone())
+        return json.loads(row[0]) if row and row[0] else None
+
+    # --- message bus ---
+
+    def subscribe(self, channel, callback=None):
+        """Deliver messages of `channel` to `callback(message)`, or to a returned bounded queue."""
+        sub = callback if callback is not None else _Subscription()
+        self._subscribers[channel] = sub
+        return sub
+
+    async def send(self, channel, message):
+        payload = json.dumps(message)
+        await asyncio.to_thread(
+            lambda: self._conn().execute('INSERT INTO state_bus (channel, payload, ts) VALUES (?, ?, ?)',
+                                         (channel, payload, time.time())))
+        self.sent += 1
+
+    def _poll_sync(self):
+        conn = self._conn()
+        if self._last_id is None:
+            # start at the tail: messages sent before this worker started are not for it
+            self._last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM state_bus').fetchone()[0]
+            return []
+        rows = conn.execute('SELECT id, channel, payload FROM state_bus WHERE id > ? ORDER BY id LIMIT 1000',
+                            (self._last_id,)).fetchall()
+        if rows:
+            self._last_id = rows[-1][0]
+        return [(channel, payload) for _, channel, payload in rows if channel in self._subscribers]
+
+    def _prune_sync(self):
+        self._conn().execute('DELETE FROM state_bus WHERE ts < ?', (time.time() - self.retention,))
+
+    def _deliver(self, channel, payload):
+        sub = self._subscribers.get(channel)
+        if sub is None:
+            return
+        self.received += 1
+        message = json.loads(payload)
+        if isinstance(sub, _Subscription):
+            sub.put(message)
+        else:
+            sub(message)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        next_renew = next_prune = 0.0
+        while True:
+            try:
+                for channel, payload in await asyncio.to_thread(self._poll_sync):
+                    try:
+                        self._deliver(channel, payload)
+                    except Exception as e:
+                        self.errors += 1
+                        _log.warning('bad message', channel=channel, error=e)
+                now = loop.time()
+                if self._dirty or self._released:
+                    await asyncio.to_thread(self._write_snapshots, self._take_snapshots())
+                if now >= next_renew:
+                    async with self._leases:
+                        await asyncio.to_thread(self._renew_sync, sorted(self._owned))
+                    next_renew = now + self.lease / 3
+                if now >= next_prune:
+                    await asyncio.to_thread(self._prune_sync)
+                    next_prune = now + self.retention / 4
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                _log.error('poll failed', error=e)
+            await asyncio.sleep(self.poll_interval)
+
+    def stats(self):
+        return {
+            'backend': 'sqlite',
+            'path': self.path,
+            'worker_id': self.worker_id,
+            'owned_rooms': len(self._owned),
+            'claims': self.claims,
+            'sent': self.sent,
+            'received': self.received,
+            'snapshots_written': self.snapshots_written,
+            'records_written': self.records_written,
+            'rooms_taken_over': self.rooms_taken_over,
+            'dropped': sum(s.dropped for s in self._subscribers.values() if isinstance(s, _Subscription)),
+            'errors': self.errors,
+        }
+
+
+class SQLiteClientManager(AsyncPubSubManager):
+    """python-socketio client manager that fans emits and room changes out over the SQLite bus."""
+
+    name = 'sqlitepubsub'
+
+    def __init__(self, backend, channel='socketio', write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.backend = backend
+        self._inbox = backend.subscribe(channel)
+
+    async def _publish(self, data):
+        await self.backend.send(self.channel, data)
+
+    async def _listen(self):
+        while True:
+            yield await self._inbox.queue.get()
+
+
+def create_backend(spec):
+    """Build the backend named by `STATE_BACKEND`: 'memory' (default), 'sqlite' or 'sqlite:<path>'."""
+    spec = (spec or 'memory').strip()
+    if spec == 'memory':
+        return InProcessBackend()
+    if spec == 'sqlite' or spec.startswith('sqlite:'):
+        path = spec[len('sqlite:'):] or os.path.join(os.path.dirname(__file__), 'state.db')
+        return SQLiteStateBackend(path)
+    raise ValueError(f'unknown STATE_BACKEND {spec!r} (expected memory, sqlite or sqlite:<path>)')
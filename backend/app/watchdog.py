@@ -0,0 +1,172 @@
+"""Event-loop lag monitor.
+
+A heartbeat task sleeps for `interval` over and over and records how late each wakeup is: that
+delay is the loop lag every timer, emit and chat message in the process sees. A watcher thread
+checks the heartbeat from outside the loop, so a handler that blocks the loop (a slow disk, a
+long computation) is caught while it is still blocking: once the loop has been stuck for
+`threshold` seconds the thread samples the loop thread's stack, names the task that is running
+(room mailboxes run as `room:<id>`, see actor.py) and logs both. When the loop gets going again
+the stall's total length is logged and kept for `/stats/loop`.
+
+`saturated()` turns true when the loop spent more than `ready_ratio` of the last `ready_window`
+seconds lagging; the readiness endpoint uses it to take a sick worker out of rotation.
+"""
+
+import asyncio
+import os
+import sys
+import sysconfig
+import threading
+import time
+import traceback
+from collections import deque
+
+from . import logs
+
+# the most recent stalls kept for /stats/loop
+STALL_HISTORY = 20
+# frames under these paths are asyncio, uvicorn, socketio...: not what a stall is attributed to
+_LIBRARY_PATHS = tuple({sysconfig.get_paths()[key] for key in ('stdlib', 'platstdlib', 'purelib', 'platlib')})
+
+
+class LoopWatchdog:
+    def __init__(self, interval=0.05, threshold=0.25, ready_window=10.0, ready_ratio=0.5, stack_depth=12,
+                 on_lag=None, log=None):
+        self.interval = interval
+        self.threshold = threshold
+        self.ready_window = ready_window
+        self.ready_ratio = ready_ratio
+        self.stack_depth = stack_depth
+        # callable(lag seconds) told about every heartbeat (e.g. a metrics histogram)
+        self.on_lag = on_lag
+        # callable(message, **fields) for stalls
+        self.log = log or logs.get('watchdog').warning
+        self._loop = None
+        self._loop_thread = None
+        self._task = None
+        self._thread = None
+        self._stop = threading.Event()
+        # perf_counter time the next heartbeat is due (None while stopped)
+        self._due = None
+        # the stall being sampled by the watcher thread: {'due', 'task', 'room', 'where'}
+        self._stall = None
+        # (time, lag) of recent heartbeats, for saturation over ready_window
+        self._recent = deque()
+        self._recent_lag = 0.0
+        self.stalls = deque(maxlen=STALL_HISTORY)
+        # statistics
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self.beats = 0
+        self.stall_count = 0
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if self.running:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._stop.clear()
+        self._task = self._loop.create_task(self._beat(), name='loop-watchdog')
+        self._thread = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._thread is not None:
+            await asyncio.to_thread(self._thread.join, 1.0)
+            self._thread = None
+        self._due = None
+
+    def saturated(self):
+        """True when the loop lagged for more than `ready_ratio` of the last `ready_window` seconds."""
+        self._trim(time.perf_counter())
+        return self._recent_lag > self.ready_ratio * self.ready_window
+
+    # --- heartbeat (on the loop) ---
+
+    async def _beat(self):
+        while True:
+            self._due = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.perf_counter()
+            self._record(now, max(0.0, now - self._due))
+
+    def _record(self, now, lag):
+        self.beats += 1
+        self.lag = lag
+        if lag > self.max_lag:
+            self.max_lag = lag
+        self._recent.append((now, lag))
+        self._recent_lag += lag
+        self._trim(now)
+        if self.on_lag is not None:
+            self.on_lag(lag)
+        stall, self._stall = self._stall, None
+        if lag >= self.threshold:
+            self.stall_count += 1
+            entry = {'at': time.time(), 'lag_ms': round(lag * 1000, 1),
+                     'task': stall['task'] if stall else None, 'room': stall['room'] if stall else None,
+                     'where': stall['where'] if stall else None}
+            self.stalls.append(entry)
+            self.log('event loop stalled', **{key: value for key, value in entry.items() if key != 'at'})
+
+    def _trim(self, now):
+        cutoff = now - self.ready_window
+        while self._recent and self._recent[0][0] < cutoff:
+            self._recent_lag -= self._recent.popleft()[1]
+
+    # --- watcher (own thread) ---
+
+    def _watch(self):
+        while not self._stop.wait(self.interval):
+            due = self._due
+            if due is None or time.perf_counter() - due < self.threshold:
+                continue
+            if self._stall is not None and self._stall['due'] == due:
+                # this stall has been sampled already
+                continue
+            self._stall = self._sample(due)
+
+    def _sample(self, due):
+        """Describe what the loop thread is doing right now: task name, room and a stack sample."""
+        task = None
+        try:
+            task = asyncio.current_task(self._loop)
+        except Exception:
+            pass
+        name = task.get_name() if task is not None else None
+        room = name[5:] if name and name.startswith('room:') else None
+        frame = sys._current_frames().get(self._loop_thread)
+        stack = traceback.extract_stack(frame, limit=self.stack_depth) if frame is not None else []
+        # the innermost frame outside the libraries names the handler better than asyncio internals
+        where = next((f'{fs.name} ({os.path.basename(fs.filename)}:{fs.lineno})' for fs in reversed(stack)
+                      if not fs.filename.startswith(_LIBRARY_PATHS)), None)
+        self.log('event loop blocked', threshold_ms=int(self.threshold * 1000), task=name, room=room, where=where,
+                 stack='\n' + ''.join(traceback.format_list(stack)).rstrip())
+        return {'due': due, 'task': name, 'room': room, 'where': where}
+
+    def stats(self):
+        return {
+            'running': self.running,
+            'interval_ms': self.interval * 1000,
+            'threshold_ms': self.threshold * 1000,
+            'lag_ms': round(self.lag * 1000, 2),
+            'max_lag_ms': round(self.max_lag * 1000, 2),
+            'lag_in_window_ms': round(self._recent_lag * 1000, 1),
+            'ready_window_s': self.ready_window,
+            'saturated': self.saturated(),
+            'beats': self.beats,
+            'stalls': self.stall_count,
+            'recent_stalls': list(self.stalls),
+        }
@@ -0,0 +1,118 @@
+"""Cold-start benchmark: how long a fresh process takes to answer its first request.
+
+Each run starts a new server process (`python -m backend.app.serve`, one worker) on a free port
+with an empty chat database and journal, polls `GET /` until it answers, and records:
+
+- import_ms:   `import backend.app.main` in a fresh interpreter (measured separately)
+- first_ms:    process spawn -> first 200 from `GET /`
+- startup_ms:  the lifespan startup as reported by `/stats/startup` (schema + journal replay)
+
+and reports min / median / max over `--runs`. With `--max-ms` it exits non-zero when the median
+first response is slower, so it can guard against regressions in CI.
+
+    python -m backend.bench.cold_start --runs 5 --max-ms 2500
+"""
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def fetch(url, timeout=1.0):
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+def measure_import(env):
+    code = 'import time; t = time.perf_counter(); import backend.app.main; print((time.perf_counter() - t) * 1000)'
+    out = subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def measure_first_response(env, timeout):
+    port = free_port()
+    started = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, '-m', 'backend.app.serve', '--host', '127.0.0.1', '--port', str(port)],
+                            cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            if proc.poll() is not None:
+                raise RuntimeError(f'server exited with code {proc.returncode} before answering')
+            if time.perf_counter() - started > timeout:
+                raise RuntimeError(f'no response within {timeout}s')
+            try:
+                fetch(f'http://127.0.0.1:{port}/', timeout=0.5)
+            except OSError:
+                time.sleep(0.005)
+                continue
+            first_ms = (time.perf_counter() - started) * 1000
+            try:
+                return first_ms, fetch(f'http://127.0.0.1:{port}/stats/startup')
+            except urllib.error.HTTPError:
+                # older trees without startup stats can still be compared on the first response
+                return first_ms, {}
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def summary(values):
+    return {'min': round(min(values), 1), 'median': round(statistics.median(values), 1), 'max': round(max(values), 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--timeout', type=float, default=30.0, help='seconds to wait for one server to answer')
+    parser.add_argument('--max-ms', type=float, default=None, help='fail if the median first response is slower')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+
+    imports, firsts, startups = [], [], []
+    for _ in range(max(1, args.runs)):
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(os.environ, CHAT_DB_PATH=os.path.join(tmp, 'chat.db'), GAME_JOURNAL=os.path.join(tmp, 'journal.db'),
+                       WEB_CONCURRENCY='1', DRAIN_TIMEOUT='0')
+            env.pop('STATE_BACKEND', None)
+            imports.append(measure_import(env))
+            first_ms, stats = measure_first_response(env, args.timeout)
+            firsts.append(first_ms)
+            startups.append(stats.get('startup_ms', 0.0))
+    results = {
+        'runs': len(firsts),
+        'import_ms': summary(imports),
+        'first_response_ms': summary(firsts),
+        'startup_ms': summary(startups),
+    }
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for key in ('import_ms', 'first_response_ms', 'startup_ms'):
+            r = results[key]
+            print(f"{key:>18}: min {r['min']:8.1f}  median {r['median']:8.1f}  max {r['max']:8.1f}")
+    if args.max_ms is not None and results['first_response_ms']['median'] > args.max_ms:
+        print(f"median first response {results['first_response_ms']['median']}ms exceeds {args.max_ms}ms", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+"""Hot-path micro-benchmarks: per-call time and memory of the code that runs on every game event.
+
+For each room size in `--sizes` it builds a room of that many players (roles assigned, everyone
+has voted, that many messages in the room's chat) and times:
+
+- assign_roles:    `_assign_roles_to_players` for the whole roster (game start)
+- tally_votes:     the vote count behind `_resolve_votes` (`engine.tally_votes`)
+- win_check:       the alive-by-role counting in `_check_win_conditions`
+- room_state:      `RoomState.snapshot()`, the `room_state` payload
+- save_message:    `save_message` (synchronous SQLite write, the write-behind queue's fallback)
+- recent_hot:      `get_recent_messages` served from the hot cache
+- recent_cold:     `get_recent_messages` after the room was evicted (cache reload from SQLite)
+
+plus two cases that do not depend on room size: `connect_headers` (the handshake header scan in
+`connect`) and `metrics`, the instrumentation every handler pays (a histogram observation and a
+counter increment, see `backend/app/metrics.py`).
+
+Every case is run `--repeat` times in timeit-style batches sized to take about 0.1s; the report
+gives the best and median time per call and the peak memory one call allocates (tracemalloc).
+Times are wall-clock and machine dependent: compare runs on the same machine.
+
+    python -m backend.bench.hot_paths --sizes 5,50,500 --repeat 7
+"""
+
+import argparse
+import itertools
+import json
+import os
+import random
+import statistics
+import tempfile
+import timeit
+import tracemalloc
+
+from backend.app import engine
+from backend.app.state import RoomState
+
+HEADERS = [
+    (b'host', b'localhost:8000'), (b'connection', b'Upgrade'), (b'pragma', b'no-cache'),
+    (b'cache-control', b'no-cache'), (b'user-agent', b'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36'),
+    (b'upgrade', b'websocket'), (b'origin', b'http://localhost:5173'), (b'sec-websocket-version', b'13'),
+    (b'accept-encoding', b'gzip, deflate, br'), (b'accept-language', b'en-US,en;q=0.9'),
+    (b'sec-websocket-key', b'dGhlIHNhbXBsZSBub25jZQ=='), (b'sec-websocket-extensions', b'permessage-deflate'),
+]
+
+
+def measure(fn, repeat):
+    """Best and median seconds per call over `repeat` batches, and the peak bytes one call allocates."""
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    number = max(1, number // 2)
+    runs = [t / number for t in timer.repeat(repeat=max(1, repeat), number=number)]
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        fn()
+        peak = tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+    return {'best_us': round(min(runs) * 1e6, 2), 'median_us': round(statistics.median(runs) * 1e6, 2),
+            'peak_kb': round(max(0, peak) / 1024, 1), 'loops': number}
+
+
+def build_room(size):
+    state = RoomState(f'bench-{size}')
+    players = [{'id': f'p{i}', 'name': f'Player {i}'} for i in range(size)]
+    for p in players:
+        state.add_player(p)
+    state.set_host('p0')
+    settings = {'killCount': max(1, size // 5), 'doctorCount': 1, 'detectiveCount': 1}
+    return state, players, settings
+
+
+def size_cases(app, size, rnd):
+    state, players, settings = build_room(size)
+    state.assign_roles(app._assign_roles_to_players(players, settings, seed=rnd.random()))
+    state.take_update()
+    # everyone votes; about one in five skips
+    ids = list(state.players)
+    for pid in ids:
+        state.cast_vote(pid, None if rnd.random() < 0.2 else rnd.choice(ids))
+
+    room = state.room_id
+    seq = itertools.count()
+
+    def message():
+        n = next(seq)
+        return {'id': f'{room}-m{n}', 'from': {'id': ids[n % size], 'name': 'Player'}, 'text': f'message {n}', 'ts': 1_700_000_000 + n}
+
+    app.save_messages([app._message_row(room, message(), app.chat_epoch(room)) for _ in range(size)])
+    app.message_cache.forget(room)
+    app.get_recent_messages(room)
+
+    def recent_cold():
+        app.message_cache.forget(room)
+        return app.get_recent_messages(room)
+
+    return {
+        'assign_roles': lambda: app._assign_roles_to_players(players, settings),
+        'tally_votes': lambda: engine.tally_votes(state.votes),
+        'win_check': lambda: app._alive_role_summary(state),
+        'room_state': state.snapshot,
+        'save_message': lambda: app.save_message(room, message()),
+        'recent_hot': lambda: app.get_recent_messages(room),
+        'recent_cold': recent_cold,
+    }
+
+
+def load_app(tmp):
+    os.environ['CHAT_DB_PATH'] = os.path.join(tmp, 'chat.db')
+    from backend.app import main as app
+    app.init_db()
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', default='5,50,500', help='comma-separated room sizes (players)')
+    parser.add_argument('--repeat', type=int, default=7, help='timed batches per case')
+    parser.add_argument('--only', default=None, help='comma-separated case names to run')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+    sizes = [int(s) for s in args.sizes.split(',') if s.strip()]
+    only = set(args.only.split(',')) if args.only else None
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = load_app(tmp)
+        results = {'sizes': {}, 'fixed': {}}
+        environ = {'REMOTE_ADDR': '127.0.0.1', 'headers': HEADERS}
+        if only is None or 'connect_headers' in only:
+            results['fixed']['connect_headers'] = measure(lambda: app._handshake_info(environ), args.repeat)
+        if only is None or 'metrics' in only:
+            histogram, counter = app.HANDLER_SECONDS.labels('bench'), app.EMITS.labels('bench')
+            results['fixed']['metrics'] = measure(lambda: (histogram.observe(0.0004), counter.inc()), args.repeat)
+        for size in sizes:
+            cases = size_cases(app, size, random.Random(args.seed))
+            results['sizes'][size] = {name: measure(fn, args.repeat) for name, fn in cases.items()
+                                      if only is None or name in only}
+        app.get_db_conn().close()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'case':>16} {'players':>8} {'best us':>10} {'median us':>10} {'peak KB':>9}")
+    for name, r in results['fixed'].items():
+        print(f"{name:>16} {'-':>8} {r['best_us']:10.2f} {r['median_us']:10.2f} {r['peak_kb']:9.1f}")
+    names = list(next(iter(results['sizes'].values()), {}))
+    for name in names:
+        for size, cases in results['sizes'].items():
+            r = cases[name]
+            print(f"{name:>16} {size:>8} {r['best_us']:10.2f} {r['median_us']:10.2f} {r['peak_kb']:9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""Journal replay benchmark: how long a restart takes to rebuild N rooms.
+
+Plays `--rooms` rooms of `--players` players through `--rounds` night/vote rounds with the game
+journal attached (timer entries included, as the scheduler would record them), then measures
+`replay()` (load + rebuild, as at server startup) from a fresh journal in two layouts:
+
+- log:      every entry still in the log (a crash before any compaction)
+- snapshot: one snapshot per room (after a clean shutdown or compaction)
+
+and checks the rebuilt rooms against the originals.
+
+    python -m backend.bench.journal_replay --rooms 1000 --players 10 --rounds 3
+"""
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+from backend.app.journal import GameJournal
+from backend.app.state import RoomState
+
+
+def play(state, journal, players, rounds, rnd):
+    room = state.room_id
+    now = int(time.time() * 1000)
+
+    def timer(kind, step, seconds):
+        journal.record(room, 'timer', (kind, now + seconds * 1000, step, []))
+
+    for i in range(players):
+        state.add_player({'id': f'{room}-p{i}', 'name': f'Player {i}'})
+    state.set_host(f'{room}-p0')
+    state.set_settings({'killCount': 2, 'doctorCount': 1, 'detectiveCount': 1,
+                        'killerDuration': 120, 'doctorDuration': 120, 'votingDuration': 120})
+    for pid in list(state.players):
+        state.set_ready(pid)
+    roles = ['Killer'] * 2 + ['Doctor', 'Detective'] + ['Civilian'] * max(0, players - 4)
+    rnd.shuffle(roles)
+    assigned = [dict(p.data, role=role) for p, role in zip(state.players.values(), roles)]
+    state.start_game(assigned, f'{room}__killers', f'{room}__doctors')
+    timer('prestart', '_start_night_sequence', 3)
+    for _ in range(rounds):
+        alive = state.alive_ids()
+        killers = state.alive_ids('Killer')
+        if not killers or len(killers) >= len(alive) - len(killers):
+            break
+        state.enter_phase('night_start', {'phase': 'night_start', 'duration': 5, 'start_ts': now})
+        journal.record(room, 'timer_done', ('prestart',))
+        timer('night_start', '_end_night_start', 5)
+        state.enter_phase('killer', {'phase': 'killer', 'duration': 120, 'start_ts': now})
+        timer('killer', '_end_killer_phase', 120)
+        victim = rnd.choice([pid for pid in alive if state.role_of(pid) != 'Killer'])
+        state.record_kill(killers[0], victim)
+        journal.record(room, 'timer_done', ('killer',))
+        state.enter_phase('doctor', {'phase': 'doctor', 'duration': 120, 'start_ts': now})
+        timer('doctor', '_end_doctor_phase', 120)
+        doctors = state.alive_ids('Doctor')
+        if doctors:
+            state.record_save(doctors[0], rnd.choice(alive))
+        journal.record(room, 'timer_done', ('doctor',))
+        state.eliminate(victim)
+        state.enter_phase('day_start', {'phase': 'day_start', 'duration': 5, 'start_ts': now})
+        timer('day_start', '_show_night_summary', 5)
+        state.enter_phase('voting', {'phase': 'voting', 'duration': 120, 'start_ts': now})
+        timer('voting', '_resolve_votes', 120)
+        alive = state.alive_ids()
+        for pid in alive:
+            state.cast_vote(pid, rnd.choice(alive))
+        journal.record(room, 'timer_done', ('voting',))
+        state.eliminate(rnd.choice(alive))
+        state.enter_phase('post_vote')
+        timer('post_vote', '_next_night', 3)
+
+
+def measure(path):
+    journal = GameJournal(path)
+    journal.open()
+    rooms = {room: state for room, (state, _) in journal.replay().items()}
+    journal._conn.close()
+    return rooms, journal.replayed_events, journal.load_ms, journal.replay_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--rooms', type=int, default=1000)
+    parser.add_argument('--players', type=int, default=10)
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'journal.db')
+        originals = {}
+        journal = GameJournal(path, snapshot_fn=lambda room: originals[room].to_record(),
+                              snapshot_every=10 ** 9, snapshot_interval=float('inf'))
+        journal.open()
+        for i in range(args.rooms):
+            state = originals[f'room{i}'] = RoomState(f'room{i}')
+            state.journal = journal.record
+            play(state, journal, args.players, args.rounds, rnd)
+        entries = journal.records
+        journal.flush_sync()
+        for layout in ('log', 'snapshot'):
+            if layout == 'snapshot':
+                journal.flush_sync(snapshot_all=True)
+            rooms, events, load_ms, total_ms = measure(path)
+            for room, state in originals.items():
+                expected, got = state.to_record(), rooms[room].to_record()
+                # the client-facing version counter is not journaled, only snapshotted
+                expected.pop('version'), got.pop('version')
+                assert got == expected, f'{layout}: room {room} rebuilt differently'
+            results[layout] = {
+                'rooms': len(rooms),
+                'events_replayed': events,
+                'load_ms': round(load_ms, 2),
+                'replay_ms': round(total_ms, 2),
+                'ms_per_1k_rooms': round(total_ms * 1000 / max(1, len(rooms)), 2),
+                'db_bytes': sum(os.path.getsize(f) for f in (path, path + '-wal') if os.path.exists(f)),
+            }
+        journal._conn.close()
+    if args.json:
+        print(json.dumps({'entries_recorded': entries, **results}, indent=2))
+        return
+    print(f'{args.rooms} rooms x {args.players} players x {args.rounds} rounds, {entries} journal entries')
+    for layout, r in results.items():
+        print(f"{layout:>9}: {r['replay_ms']:9.2f} ms total ({r['load_ms']:.2f} ms reading), "
+              f"{r['ms_per_1k_rooms']:8.2f} ms per 1k rooms, {r['events_replayed']} entries replayed, "
+              f"{r['db_bytes'] / 1024:.0f} KiB on disk")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,374 @@
+"""Socket.IO load test: many rooms of simulated players playing full games against a server.
+
+Starts a local server (`python -m backend.app.serve` on a free port, empty databases) unless
+`--url` points at one, then connects `--rooms` x `--players` python-socketio clients. Each room
+runs the real event sequence a browser would send: `join_room`, `set_settings` (host),
+`player_ready`, then per phase `detective_action` / `killer_action` / `doctor_action`, chat
+(`send_message`) in the day and `cast_vote`, for `--games` games per room.
+
+Every client event is sent with an acknowledgement, so its latency is the time until the server
+finished handling it (room mailbox wait included). The report has:
+
+- per-event latency percentiles (ms) and error / timeout counts
+- payload bytes per second received by (emitted to) and sent by the clients
+- event-loop lag: the server's timer lateness (`/stats/scheduler`, which includes up to one
+  50ms wheel tick even when idle), the round-trip time of a probe `time_sync` every 100ms, and
+  this process's own loop lag (if that one is high the load generator, not the server, is the
+  bottleneck)
+- server RSS (sampled from /proc, local servers only)
+
+    python -m backend.bench.load_test --rooms 50 --players 8 --games 1 --out report.json
+
+The async client needs aiohttp (`pip install aiohttp`).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+import socketio
+
+from .cold_start import ROOT, free_port
+
+# ack timeout for a single client event (seconds)
+CALL_TIMEOUT = 30.0
+
+
+def percentiles(values):
+    if not values:
+        return {'count': 0}
+    values = sorted(values)
+
+    def pick(q):
+        return round(values[min(len(values) - 1, int(q * len(values)))], 2)
+
+    return {'count': len(values), 'p50': pick(0.50), 'p90': pick(0.90), 'p99': pick(0.99), 'max': round(values[-1], 2)}
+
+
+def _size(payload):
+    return len(json.dumps(payload, separators=(',', ':'), default=str))
+
+
+def rss_mb(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+class Stats:
+    def __init__(self):
+        self.latency = {}
+        self.errors = {}
+        self.received = {}
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.games_finished = 0
+
+    def record(self, event, ms):
+        self.latency.setdefault(event, []).append(ms)
+
+    def error(self, event):
+        self.errors[event] = self.errors.get(event, 0) + 1
+
+
+class Bot:
+    """One simulated player: reacts to the phases it sees the way the web client's player would."""
+
+    def __init__(self, room, index, url, stats, args, rnd):
+        self.room = room
+        self.url = url
+        self.stats = stats
+        self.args = args
+        self.rnd = rnd
+        self.host = index == 0
+        self.player = {'id': f'{room.name}-p{index}', 'name': f'Bot {index}'}
+        self.client = socketio.AsyncClient(reconnection=False)
+        self.client.on('*', self._on_event)
+        self.role = None
+        self.players = []
+        self.eliminated = set()
+        self.blocked = set()
+        self.acted = set()
+
+    async def connect(self):
+        await self.client.connect(f'{self.url}?room={self.room.name}', transports=[self.args.transport],
+                                  socketio_path='socket.io', wait_timeout=CALL_TIMEOUT)
+
+    async def call(self, event, data):
+        data = dict(data, roomId=self.room.name)
+        self.stats.bytes_out += _size(data)
+        started = time.perf_counter()
+        try:
+            await self.client.call(event, data, timeout=CALL_TIMEOUT)
+        except Exception:
+            self.stats.error(event)
+            return
+        self.stats.record(event, (time.perf_counter() - started) * 1000)
+
+    def alive(self, exclude_self=True):
+        return [p['id'] for p in self.players
+                if p['id'] not in self.eliminated and not (exclude_self and p['id'] == self.player['id'])]
+
+    async def _on_event(self, event, data=None):
+        self.stats.bytes_in += _size([event, data])
+        self.stats.received[event] = self.stats.received.get(event, 0) + 1
+        if not isinstance(data, dict):
+            return
+        if event == 'your_role':
+            self.role = data.get('role')
+        elif event == 'room_state':
+            self.players = data.get('players') or self.players
+            self.eliminated = set(data.get('eliminated') or ())
+        elif event == 'room_patch':
+            removed = set(data.get('players_removed') or ())
+            self.players = [p for p in self.players if p['id'] not in removed] + list(data.get('players_added') or ())
+            self.eliminated.update(data.get('eliminated') or ())
+        elif event == 'phase':
+            key = (data.get('phase'), data.get('start_ts'))
+            if key not in self.acted:
+                self.acted.add(key)
+                asyncio.create_task(self.act(data.get('phase')))
+        elif event == 'action_blocked' and self.role == 'Killer' and 'Killer' in (data.get('message') or ''):
+            # picked a fellow killer: try someone else
+            asyncio.create_task(self.act('killer'))
+        elif event == 'game_over' and self.host:
+            self.room.game_over()
+        elif event == 'room_reset' and self.host:
+            self.room.reset()
+
+    async def act(self, phase):
+        if self.player['id'] in self.eliminated:
+            return
+        await asyncio.sleep(self.rnd.uniform(0, self.args.think_ms) / 1000)
+        targets = self.alive()
+        if not targets:
+            return
+        if phase == 'night_start' and self.role == 'Detective':
+            await self.call('detective_action', {'player': self.player, 'targetId': self.rnd.choice(targets)})
+        elif phase == 'killer' and self.role == 'Killer':
+            choices = [t for t in targets if t not in self.blocked] or targets
+            target = self.rnd.choice(choices)
+            self.blocked.add(target)
+            await self.call('killer_action', {'player': self.player, 'targetId': target})
+        elif phase == 'doctor' and self.role == 'Doctor':
+            await self.call('doctor_action', {'player': self.player, 'targetId': self.rnd.choice(self.alive(False))})
+        elif phase == 'day_start':
+            for i in range(self.args.chat):
+                message = {'id': f"{self.player['id']}-{time.time_ns()}-{i}", 'from': self.player,
+                           'text': f'I think it was {self.rnd.choice(targets)}', 'ts': int(time.time() * 1000)}
+                await self.call('send_message', {'message': message})
+        elif phase == 'voting':
+            await self.call('cast_vote', {'player': self.player, 'targetId': self.rnd.choice(targets)})
+
+
+class Room:
+    def __init__(self, name, url, stats, args, rnd):
+        self.name = name
+        self.stats = stats
+        self.args = args
+        self.bots = [Bot(self, i, url, stats, args, rnd) for i in range(args.players)]
+        self.games_left = args.games
+        self.done = asyncio.Event()
+        self._between_games = asyncio.Event()
+
+    def game_over(self):
+        self.stats.games_finished += 1
+        self.games_left -= 1
+        if self.games_left <= 0:
+            self.done.set()
+
+    def reset(self):
+        self._between_games.set()
+
+    async def run(self):
+        for bot in self.bots:
+            await bot.connect()
+            await bot.call('join_room', {'player': bot.player})
+        host = self.bots[0]
+        await host.call('set_settings', {'settings': {
+            'killCount': max(1, self.args.players // 5), 'doctorCount': 1, 'detectiveCount': 1,
+        }})
+        while True:
+            for bot in self.bots:
+                bot.role, bot.eliminated, bot.blocked = None, set(), set()
+                await bot.call('player_ready', {'player': bot.player})
+            await self._between_games.wait()
+            self._between_games.clear()
+            if self.done.is_set():
+                break
+
+    async def close(self):
+        for bot in self.bots:
+            try:
+                await bot.client.disconnect()
+            except Exception:
+                pass
+
+
+async def probe_loop(url, samples, stop):
+    """Round trips of `time_sync` on an otherwise idle connection: the server loop's responsiveness."""
+    client = socketio.AsyncClient(reconnection=False)
+    got = asyncio.Event()
+    client.on('time_sync_response', lambda data: got.set())
+    await client.connect(url, transports=['websocket'], wait_timeout=CALL_TIMEOUT)
+    try:
+        while not stop.is_set():
+            got.clear()
+            started = time.perf_counter()
+            await client.emit('time_sync', {})
+            try:
+                await asyncio.wait_for(got.wait(), CALL_TIMEOUT)
+                samples.append((time.perf_counter() - started) * 1000)
+            except asyncio.TimeoutError:
+                pass
+            await asyncio.sleep(0.1)
+    finally:
+        await client.disconnect()
+
+
+async def own_lag_loop(samples, stop, interval=0.05):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, (time.perf_counter() - started - interval) * 1000))
+
+
+async def rss_loop(pid, samples, stop):
+    while not stop.is_set():
+        value = rss_mb(pid)
+        if value is not None:
+            samples.append(value)
+        await asyncio.sleep(0.5)
+
+
+def fetch_json(url):
+    try:
+        with urllib.request.urlopen(url, timeout=5) as response:
+            return json.loads(response.read())
+    except Exception:
+        return None
+
+
+def start_server(tmp):
+    port = free_port()
+    env = dict(os.environ, CHAT_DB_PATH=os.path.join(tmp, 'chat.db'), GAME_JOURNAL=os.path.join(tmp, 'journal.db'),
+               WEB_CONCURRENCY='1', DRAIN_TIMEOUT='0')
+    env.pop('STATE_BACKEND', None)
+    proc = subprocess.Popen([sys.executable, '-m', 'backend.app.serve', '--host', '127.0.0.1', '--port', str(port)],
+                            cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 30
+    while fetch_json(url + '/') is None:
+        if proc.poll() is not None or time.monotonic() > deadline:
+            proc.kill()
+            raise RuntimeError('the server did not start')
+        time.sleep(0.05)
+    return proc, url
+
+
+async def run(args, url, server_pid):
+    rnd = random.Random(args.seed)
+    stats = Stats()
+    rooms = [Room(f'load{i}', url, stats, args, rnd) for i in range(args.rooms)]
+    stop = asyncio.Event()
+    probe, own_lag, rss = [], [], []
+    background = [asyncio.create_task(probe_loop(url, probe, stop)), asyncio.create_task(own_lag_loop(own_lag, stop))]
+    if server_pid is not None:
+        background.append(asyncio.create_task(rss_loop(server_pid, rss, stop)))
+    started = time.perf_counter()
+    # stagger room start-up so the connect storm itself is not all that gets measured
+    tasks = []
+    for room in rooms:
+        tasks.append(asyncio.create_task(room.run()))
+        await asyncio.sleep(args.ramp / max(1, len(rooms)))
+    finished = await asyncio.wait([asyncio.create_task(r.done.wait()) for r in rooms], timeout=args.timeout)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*background, *tasks, return_exceptions=True)
+    scheduler = fetch_json(url + '/stats/scheduler') or {}
+    actors = fetch_json(url + '/stats/room_actors') or {}
+    await asyncio.gather(*(room.close() for room in rooms))
+    return {
+        'config': {'rooms': args.rooms, 'players': args.players, 'games': args.games, 'transport': args.transport,
+                   'think_ms': args.think_ms, 'chat': args.chat, 'seed': args.seed},
+        'elapsed_s': round(elapsed, 2),
+        'rooms_completed': len(finished[0]),
+        'games_finished': stats.games_finished,
+        'events': {event: dict(percentiles(ms), errors=stats.errors.get(event, 0))
+                   for event, ms in sorted(stats.latency.items())},
+        'errors': stats.errors,
+        'received': dict(sorted(stats.received.items())),
+        'bytes': {
+            'received': stats.bytes_in,
+            'received_per_s': round(stats.bytes_in / elapsed),
+            'sent': stats.bytes_out,
+            'sent_per_s': round(stats.bytes_out / elapsed),
+        },
+        'loop_lag_ms': {
+            'server_timer_lag_max': scheduler.get('max_lag_ms'),
+            'probe_rtt': percentiles(probe),
+            'load_generator': percentiles(own_lag),
+        },
+        'server': {
+            'rss_mb_start': round(rss[0], 1) if rss else None,
+            'rss_mb_max': round(max(rss), 1) if rss else None,
+            'rss_mb_end': round(rss[-1], 1) if rss else None,
+            'room_actor_max_queue': actors.get('max_queue'),
+            'room_actor_errors': actors.get('errors'),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--url', default=None, help='server to test (default: start a local one)')
+    parser.add_argument('--server-pid', type=int, default=None, help='pid of the --url server, for RSS sampling')
+    parser.add_argument('--rooms', type=int, default=20)
+    parser.add_argument('--players', type=int, default=8)
+    parser.add_argument('--games', type=int, default=1, help='games played per room')
+    parser.add_argument('--chat', type=int, default=1, help='chat messages per player each day')
+    parser.add_argument('--think-ms', type=float, default=500, help='max random delay before a bot acts')
+    parser.add_argument('--ramp', type=float, default=2.0, help='seconds over which rooms are started')
+    parser.add_argument('--transport', choices=('websocket', 'polling'), default='websocket')
+    parser.add_argument('--timeout', type=float, default=600, help='give up on unfinished rooms after this many seconds')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', default=None, help='write the JSON report to this file')
+    args = parser.parse_args()
+    if args.players < 4:
+        parser.error('--players must be at least 4 (killer, doctor, detective and a civilian)')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        proc = None
+        url, server_pid = args.url, args.server_pid
+        if url is None:
+            proc, url = start_server(tmp)
+            server_pid = proc.pid
+        try:
+            report = asyncio.run(run(args, url.rstrip('/'), server_pid))
+        finally:
+            if proc is not None:
+                proc.terminate()
+                proc.wait(timeout=30)
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+"""Full games on a virtual clock: every room plays from lobby to `game_over` and back to the lobby.
+
+Drives the real Socket.IO handlers (as registered on `sio`, room mailboxes and instrumentation
+included) with bot players, while `main.use_clock(VirtualClock(...))` makes every phase timer,
+grace period and reset delay pass instantly. Only the transport is replaced: `emit`,
+`enter_room` / `leave_room` and the session store record into memory, and the bots react to the
+`phase` / `your_role` events they would receive. Killers kill a random non-killer, the doctor
+saves and the detective checks a random player, and everyone votes for a random alive player, so
+games last a varying number of rounds.
+
+By default virtual time is moved by `run_until()`, deadline by deadline; `--autojump` leaves it
+to the clock's own jumper task instead. Either way the run fails (exit status 1) unless every
+room saw `game_over` and then `room_reset` within `--limit` virtual seconds.
+
+    python -m backend.bench.virtual_game --rooms 20 --players 8
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from backend.app.clock import VirtualClock
+
+
+def load_app(tmp):
+    os.environ['CHAT_DB_PATH'] = os.path.join(tmp, 'chat.db')
+    from backend.app import main as app
+    app.init_db()
+    return app
+
+
+class Table:
+    """Bot players of one room, reacting to what the server emits to them."""
+
+    def __init__(self, app, room, players, rng):
+        self.app = app
+        self.room = room
+        self.rng = rng
+        self.players = {f'{room}-s{i}': {'id': f'{room}-p{i}', 'name': f'P{i}'} for i in range(players)}
+        self.roles = {}
+        self.winner = None
+        self.reset = False
+        self.rounds = 0
+
+    def call(self, event, sid, data):
+        return self.app.sio.handlers['/'][event](sid, dict(data, roomId=self.room))
+
+    def alive(self, role=None, exclude=None):
+        state = self.app._rooms[self.room]
+        return [(sid, p) for sid, p in self.players.items()
+                if state.is_alive(p['id']) and (role is None or self.roles.get(sid) == role)
+                and (exclude is None or self.roles.get(sid) != exclude)]
+
+    def pick(self, candidates):
+        return self.rng.choice(candidates)[1]['id'] if candidates else None
+
+    async def start(self, settings):
+        for sid, p in self.players.items():
+            await self.call('join_room', sid, {'player': p})
+        host = next(iter(self.players))
+        await self.call('set_settings', host, {'settings': settings})
+        for sid, p in self.players.items():
+            await self.call('player_ready', sid, {'player': p})
+
+    async def on_phase(self, phase):
+        if phase == 'killer':
+            killers = self.alive('Killer')
+            if killers:
+                sid, p = killers[0]
+                await self.call('killer_action', sid, {'player': p, 'targetId': self.pick(self.alive(exclude='Killer'))})
+        elif phase == 'doctor':
+            for sid, p in self.alive('Doctor')[:1]:
+                await self.call('doctor_action', sid, {'player': p, 'targetId': self.pick(self.alive())})
+        elif phase == 'night_start':
+            for sid, p in self.alive('Detective')[:1]:
+                await self.call('detective_action', sid, {'player': p, 'targetId': self.pick(self.alive())})
+        elif phase == 'voting':
+            self.rounds += 1
+            alive = self.alive()
+            for sid, p in alive:
+                others = [entry for entry in alive if entry[0] != sid]
+                await self.call('cast_vote', sid, {'player': p, 'targetId': self.pick(others)})
+
+
+class Transport:
+    """Stands in for the Socket.IO server's I/O: rooms, sessions and emits go to the bots."""
+
+    def __init__(self, tables):
+        self.tables = tables
+        self.by_sid = {sid: table for table in tables.values() for sid in table.players}
+        self.sessions = {}
+        self.reactions = set()
+        self.emits = 0
+
+    def install(self, sio):
+        sio.emit = self.emit
+        sio.enter_room = self.enter_room
+        sio.leave_room = self.leave_room
+        sio.save_session = self.save_session
+        sio.get_session = self.get_session
+
+    def busy(self):
+        return bool(self.reactions)
+
+    def react(self, coro):
+        task = asyncio.get_running_loop().create_task(coro)
+        self.reactions.add(task)
+        task.add_done_callback(self.reactions.discard)
+
+    async def emit(self, event, data=None, room=None, **kw):
+        self.emits += 1
+        if event == 'your_role':
+            table = self.by_sid.get(room)
+            if table is not None:
+                table.roles[room] = data['role']
+            return
+        table = self.tables.get(room)
+        if table is None:
+            # team rooms and single sockets: the bots only need the main room's events
+            return
+        if event == 'phase':
+            self.react(table.on_phase(data['phase']))
+        elif event == 'game_over':
+            table.winner = data['winner']
+        elif event == 'room_reset':
+            table.reset = True
+
+    async def enter_room(self, sid, room, **kw):
+        pass
+
+    async def leave_room(self, sid, room, **kw):
+        pass
+
+    async def save_session(self, sid, session, **kw):
+        self.sessions[sid] = session
+
+    async def get_session(self, sid, **kw):
+        return self.sessions.get(sid)
+
+
+async def play(app, args):
+    rng = random.Random(args.seed)
+    tables = {f'V{i}': Table(app, f'V{i}', args.players, random.Random(rng.random())) for i in range(args.rooms)}
+    transport = Transport(tables)
+    transport.install(app.sio)
+    clock = VirtualClock(start=1.7e9, autojump=args.autojump,
+                         idle=lambda: not transport.busy() and app.room_actors.idle() and app.scheduler.idle())
+    app.use_clock(clock)
+    settings = {'killCount': max(1, args.players // 4), 'doctorCount': 1, 'detectiveCount': 1 if args.players >= 6 else 0}
+    done = lambda: all(table.reset for table in tables.values())
+    started = time.perf_counter()
+    for table in tables.values():
+        await table.start(settings)
+    if args.autojump:
+        # the clock's jumper advances time whenever the games are idle: just wait for the results
+        while not done() and clock.monotonic() <= args.limit:
+            await asyncio.sleep(0)
+        elapsed = clock.monotonic()
+    else:
+        elapsed = await clock.run_until(done, limit=args.limit)
+    real = time.perf_counter() - started
+    clock.close()
+    return {
+        'rooms': args.rooms,
+        'players': args.players,
+        'virtual_s': round(elapsed, 1),
+        'real_ms': round(real * 1000, 1),
+        'jumps': clock.jumps,
+        'emits': transport.emits,
+        'winners': {room: table.winner for room, table in tables.items()},
+        'rounds': {room: table.rounds for room, table in tables.items()},
+        'unfinished': sorted(room for room, table in tables.items() if table.winner is None or not table.reset
+                             or app._rooms[room].in_game),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--rooms', type=int, default=4, help='games played at the same time')
+    parser.add_argument('--players', type=int, default=8, help='players per room')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--autojump', action='store_true', help="let the clock's jumper task move time")
+    parser.add_argument('--limit', type=float, default=6 * 3600, help='virtual seconds before giving up')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+    if args.players < 4:
+        parser.error('--players must be at least 4')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = load_app(tmp)
+        results = asyncio.run(play(app, args))
+        app.get_db_conn().close()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{results['rooms']} rooms x {results['players']} players: {results['virtual_s']}s virtual "
+              f"in {results['real_ms']} ms, {results['jumps']} jumps, {results['emits']} emits")
+        for room, winner in results['winners'].items():
+            print(f"{room:>6} {winner or 'unfinished':>10} after {results['rounds'][room]} rounds")
+    if results['unfinished']:
+        sys.exit(f"games did not finish: {', '.join(results['unfinished'])}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,14 @@
 import React, { useState, useEffect, useRef } from 'react';
 import '../styles.css';
-import socket from '../lib/socket';
+import socket, { connectToRoom } from '../lib/socket';
+import { patchPlayers, roomPatchHandler } from '../lib/roomPatch';
 
 export default function GameLobby({ roomCode = '7XYRGF', players = ['Alice','Bob','Charlie','David'], isHost = true, hostId: initialHostId = null, playerName = null, settings = {}, onStart = () => {}, onClose = () => {}, onLeave = () => {} }) {
   const [activeTab, setActiveTab] = useState('players');
   const [playerList, setPlayerList] = useState(players);
   const [hostId, setHostId] = useState(initialHostId || null);
+  // version of the last room_state/room_patch applied (patches carry the version they build on)
+  const roomVersionRef = useRef(null);
   // stable local player identity (used for join/leave and local labeling)
   const meRef = useRef(null);
   if (!meRef.current) {
@@ -62,7 +65,7 @@ export default function GameLobby({ roomCode = '7XYRGF', players = ['Alice','Bob
 
   useEffect(() => {
   // Connect socket when lobby mounts
-  socket.connect();
+  connectToRoom(roomCode);
 
   const me = meRef.current;
     // fetch initial state (players + recent messages)
@@ -105,10 +108,16 @@ export default function GameLobby({ roomCode = '7XYRGF', players = ['Alice','Bob
 
     const handleRoomState = (data) => {
       if (!data) return;
+      if (typeof data.version === 'number') roomVersionRef.current = data.version;
       if (Array.isArray(data.players)) setPlayerList(data.players);
       if (data.host_id) setHostId(data.host_id);
     };
 
+    const handleRoomPatch = roomPatchHandler(roomCode, roomVersionRef, (d) => {
+      setPlayerList((prev) => patchPlayers(prev, d));
+      if ('host_id' in d) setHostId(d.host_id || null);
+    });
+
     const handlePlayerLeft = (data) => {
       const leaving = data?.player;
       if (!leaving) return;
@@ -139,6 +148,7 @@ export default function GameLobby({ roomCode = '7XYRGF', players = ['Alice','Bob
 
     socket.on('player_joined', handlePlayerJoined);
   socket.on('room_state', handleRoomState);
+    socket.on('room_patch', handleRoomPatch);
     socket.on('player_left', handlePlayerLeft);
     socket.on('new_message', handleNewMessage);
 
@@ -146,6 +156,7 @@ export default function GameLobby({ roomCode = '7XYRGF', players = ['Alice','Bob
       // remove the handlers we registered and leave the room
       socket.off('player_joined', handlePlayerJoined);
       socket.off('room_state', handleRoomState);
+      socket.off('room_patch', handleRoomPatch);
       socket.off('player_left', handlePlayerLeft);
       socket.off('new_message', handleNewMessage);
       socket.emit('leave_room', { roomId: roomCode, player: me });
@@ -1,6 +1,7 @@
 import React, { useState, useEffect, useRef } from 'react';
 import '../styles.css';
-import socket from '../lib/socket';
+import socket, { connectToRoom } from '../lib/socket';
+import { patchAliveRoles, patchPlayers, roomPatchHandler } from '../lib/roomPatch';
 
 export default function GamePage({ roomCode, players = [], role = null, onExit = () => {} }) {
   const [copyStatus, setCopyStatus] = useState('');
@@ -34,6 +35,8 @@ export default function GamePage({ roomCode, players = [], role = null, onExit =
   const [notifKey, setNotifKey] = useState(0);
   const [noVotesCountdown, setNoVotesCountdown] = useState(null);
   const [hostId, setHostId] = useState(null);
+  // version of the last room_state/room_patch applied (patches carry the version they build on)
+  const roomVersionRef = useRef(null);
   const [localSettings, setLocalSettings] = useState({ killCount: 1, doctorCount: 1, detectiveCount: 0, killerDuration: 120, doctorDuration: 120, votingDuration: 120 });
   const inputRef = useRef(null);
   // privateScope removed: main chat always sends to public; private panels use scoped sends
@@ -91,10 +94,22 @@ export default function GamePage({ roomCode, players = [], role = null, onExit =
   const [showSettingsPopup, setShowSettingsPopup] = useState(false);
   const [showSettingsToast, setShowSettingsToast] = useState(false);
   const [winShowing, setWinShowing] = useState(false);
+  // simulated win rates per role combination for the current room size (from GET /balance)
+  const [balanceResults, setBalanceResults] = useState(null);
+
+  useEffect(() => {
+    if (!showSettingsPopup || playerList.length < 3) return;
+    let cancelled = false;
+    fetch(`${import.meta.env.VITE_API_URL || 'http://localhost:8000'}/balance?players=${playerList.length}`)
+      .then((r) => (r.ok ? r.json() : null))
+      .then((d) => { if (!cancelled) setBalanceResults(d && d.results ? d.results : null); })
+      .catch(() => { if (!cancelled) setBalanceResults(null); });
+    return () => { cancelled = true; };
+  }, [showSettingsPopup, playerList.length]);
 
   useEffect(() => {
     // Connect socket and fetch initial state
-    socket.connect();
+    connectToRoom(roomCode);
     const me = meRef.current;
 
     // perform a simple time sync: send request and measure RTT to estimate clock offset
@@ -245,6 +260,7 @@ export default function GamePage({ roomCode, players = [], role = null, onExit =
       // prefer authoritative player list from server; avoid falling back to the closed-over playerList variable
       const playersFromServer = Array.isArray(d?.players) ? d.players : [];
       console.debug('[socket] room_state received', { room: roomCode, playersFromServer, host_id: d?.host_id });
+      if (typeof d?.version === 'number') roomVersionRef.current = d.version;
       setPlayerList(playersFromServer);
       setHostId(d?.host_id || null);
       try {
@@ -262,6 +278,16 @@ export default function GamePage({ roomCode, players = [], role = null, onExit =
       } catch (e) {}
     });
 
+    const handleRoomPatch = roomPatchHandler(roomCode, roomVersionRef, (d) => {
+      setPlayerList((prev) => patchPlayers(prev, d));
+      if ('host_id' in d) setHostId(d.host_id || null);
+      if (d.eliminated && d.eliminated.length) {
+        setEliminatedIds((s) => Array.from(new Set([...s, ...d.eliminated])));
+      }
+      setAliveRoleMembers((prev) => patchAliveRoles(prev, d));
+    });
+    socket.on('room_patch', handleRoomPatch);
+
     // focus management: save previous active element and focus inside modal when opened; restore on close
     try {
       if (privatePanel) {
@@ -583,6 +609,7 @@ export default function GamePage({ roomCode, players = [], role = null, onExit =
       socket.off('player_joined', handlePlayerJoined);
       socket.off('player_left', handlePlayerLeft);
       socket.off('ready_state', handleReadyState);
+      socket.off('room_patch', handleRoomPatch);
       socket.emit('leave_room', { roomId: roomCode, player: me });
       socket.disconnect();
       try {
@@ -607,7 +634,7 @@ export default function GamePage({ roomCode, players = [], role = null, onExit =
     try {
       if (!socket.connected) {
         console.debug('[socket] not connected — attempting to connect');
-        try { socket.connect(); } catch (e) {}
+        try { connectToRoom(roomCode); } catch (e) {}
         // small delay to allow handshake
         await new Promise((r) => setTimeout(r, 200));
       }
@@ -718,6 +745,20 @@ export default function GamePage({ roomCode, players = [], role = null, onExit =
                   </div>
                 </div>
 
+                {balanceResults && balanceResults.length > 0 && (() => {
+                  const best = balanceResults[0].settings;
+                  const current = balanceResults.find((r) => r.settings.killCount === localSettings.killCount && r.settings.doctorCount === localSettings.doctorCount && r.settings.detectiveCount === localSettings.detectiveCount);
+                  return (
+                    <div className="panel-note" style={{marginTop:8}}>
+                      {current && <div>Killers win {Math.round(current.killer_win_rate * 100)}% of simulated games with these settings.</div>}
+                      <div>
+                        Most balanced for {playerList.length} players: {best.killCount} killer{best.killCount === 1 ? '' : 's'}, {best.doctorCount} doctor{best.doctorCount === 1 ? '' : 's'}, {best.detectiveCount} detective{best.detectiveCount === 1 ? '' : 's'} ({Math.round(balanceResults[0].killer_win_rate * 100)}% killer wins).
+                        {' '}<button className="btn" onClick={() => setLocalSettings((s) => ({...s, ...best}))}>Use</button>
+                      </div>
+                    </div>
+                  );
+                })()}
+
                 <hr />
                 <div className="panel-note" style={{marginTop:8, fontWeight:700}}>Phase Durations (seconds) — cannot decrease below defaults</div>
                 <div className="row" style={{marginTop:8}}>
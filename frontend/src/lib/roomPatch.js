@@ -0,0 +1,44 @@
+import socket from './socket';
+
+// room_patch carries only what changed since the room version it names as `base`. Both the
+// lobby and the game page keep the last version they applied in a ref and hand the checked
+// patch to these helpers.
+
+const playerId = (p) => (p && typeof p === 'object' ? p.id : p);
+
+// Handler for room_patch: applies `d` via `apply(d)` when it builds on the version we hold,
+// otherwise asks the server for a full room_state (we missed an update).
+export const roomPatchHandler = (roomCode, versionRef, apply) => (d) => {
+  if (!d) return;
+  if (d.base !== versionRef.current) {
+    socket.emit('request_room_state', { roomId: roomCode });
+    return;
+  }
+  versionRef.current = d.version;
+  apply(d);
+};
+
+// Player list after the patch's players_removed / players_added (unchanged list if neither).
+export const patchPlayers = (prev, d) => {
+  const removed = new Set(d.players_removed || []);
+  const added = d.players_added || [];
+  if (!removed.size && !added.length) return prev;
+  const kept = prev.filter((p) => !removed.has(playerId(p)));
+  const ids = new Set(kept.map(playerId));
+  return [...kept, ...added.filter((p) => !ids.has(p.id))];
+};
+
+// { role: [{id, name}] } of alive players after the patch's alive_removed / alive_added.
+export const patchAliveRoles = (prev, d) => {
+  if (!d.alive_removed && !d.alive_added) return prev;
+  const gone = new Set(d.alive_removed || []);
+  const next = {};
+  Object.keys(prev || {}).forEach((r) => {
+    const members = (prev[r] || []).filter((m) => !gone.has(m.id));
+    if (members.length) next[r] = members;
+  });
+  Object.entries(d.alive_added || {}).forEach(([r, members]) => {
+    next[r] = [...(next[r] || []), ...members];
+  });
+  return next;
+};
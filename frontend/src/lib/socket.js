@@ -4,9 +4,58 @@ import { io } from 'socket.io-client';
 const SOCKET_URL = import.meta.env.VITE_SOCKET_URL || 'https://mafia-c6xl.onrender.com';
 
 // Create socket and export. Keep autoConnect false so callers control when to connect.
+// WebSocket only: a long-polling session is a series of HTTP requests that must all reach the
+// worker that opened it, which a backend running several workers behind one port cannot promise.
 export const socket = io(SOCKET_URL, {
   path: '/socket.io',
+  transports: ['websocket'],
   autoConnect: false,
 });
 
+// With room sharding the backend sends clients to the worker that owns their room:
+// either by refusing the handshake (connect_error with data.redirect) or, for an
+// established connection, with a room_redirect event.
+const moveTo = (url) => {
+  if (!url || socket.io.uri === url) return;
+  socket.disconnect();
+  socket.io.uri = url;
+  socket.connect();
+};
+
+// A restarting backend refuses handshakes and, once its games are saved, tells every client
+// to come back (server_restart) before disconnecting it. Server-side disconnects are not
+// retried by socket.io itself, so reconnect after the suggested delay (plus some jitter).
+let restartDelay = null;
+const reconnectLater = (ms) => {
+  setTimeout(() => {
+    if (!socket.connected) socket.connect();
+  }, (ms || 3000) + Math.random() * 2000);
+};
+
+socket.on('connect_error', (err) => {
+  if (err && err.data && err.data.redirect) moveTo(err.data.redirect);
+  else if (err && err.data && err.data.reconnect_after_ms) reconnectLater(err.data.reconnect_after_ms);
+});
+
+socket.on('server_restart', (data) => {
+  restartDelay = (data && data.reconnect_after_ms) || 3000;
+});
+
+socket.on('disconnect', (reason) => {
+  if (reason === 'io server disconnect' && restartDelay !== null) {
+    reconnectLater(restartDelay);
+    restartDelay = null;
+  }
+});
+
+socket.on('room_redirect', (data) => {
+  if (data && data.url) moveTo(data.url);
+});
+
+// Connect naming the room, so a sharded backend can route the handshake.
+export const connectToRoom = (roomCode) => {
+  socket.io.opts.query = { ...(socket.io.opts.query || {}), room: roomCode };
+  if (!socket.connected) socket.connect();
+};
+
 export default socket;